@@ -1,9 +1,14 @@
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 from matplotlib.colors import Normalize
 
+# 从仓库根目录运行 python 4fig/plot.py 时也能导入根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from layout_cache import load_case_layouts
+
 def plot_layout_with_temperature(chiplets, temp_map, intpsize, *,
                                  title="Chiplet Layout + Temperature",
                                  cmap="coolwarm",  # 低温偏蓝，高温偏红
@@ -104,24 +109,13 @@ if __name__ == "__main__":
         compact_pred = compact_np['pred']
         sid = compact_np['sid']
         
-        case_dir = f"./cases/{case_name}"
-        intpsize_path = os.path.join(case_dir, f"{case_name}.intpsize")
-        with open(intpsize_path) as f:
-                line = f.readline().strip()
-                width = height = float(line)
-        intpsize = (width, height)  # 板框大小 W, H
+        case = load_case_layouts(case_name)
+        intpsize = (case.intpsize, case.intpsize)  # 板框大小 W, H
         
         chiplets = []
-        pl_path = os.path.join(case_dir, f"{case_name}_{sid}.pl")
-        with open(pl_path) as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) < 5:
-                        continue
-                    
-                    x, y = float(parts[1]), float(parts[2])  # 左下角坐标(um)
-                    w, h = float(parts[3]), float(parts[4])  # 宽高(um)
-                    chiplets.append({"x": x, "y": y, "w": w, "h": h, "name": parts[0]})
+        for name, (cx, cy, w, h) in zip(case.names, case.layouts[case.rows([int(sid)])[0]].astype(np.float64)):
+            # 中心坐标转换为左下角坐标(um)
+            chiplets.append({"x": cx - w/2, "y": cy - h/2, "w": w, "h": h, "name": name})
 
         vmin = float(np.nanmin(ground_truth))
         vmax = float(np.nanmax(ground_truth))
@@ -1,4 +1,7 @@
+import hashlib
 import os
+import shutil
+import tempfile
 import time
 import subprocess
 
@@ -6,9 +9,181 @@ import numpy as np
 
 import utils.fill_space
 
+# 层叠结构: (层号, 描述, 横向导热, 是否发热, 比热容 J/(m^3K), 热阻率 (m-K)/W, 厚度 m, flp 文件后缀)
+LAYER_STACK = [
+    (0, "substrate", "Y", "N", "1.06E+06", "3.33", "0.0002", "L0_Substrate.flp"),
+    (1, "Epoxy SiO2 underfill with C4 copper pillar", "Y", "N", "2.32E+06", "0.625", "0.00007", "L1_C4Layer.flp"),
+    (2, "silicon interposer", "Y", "N", "1.75E+06", "0.01", "0.00011", "L2_Interposer.flp"),
+    (3, "Underfill with ubump", "Y", "N", "2.32E+06", "0.625", "1.00E-05", "L3_UbumpLayer.flp"),
+    (4, "Chip layer", "Y", "Y", "1.75E+06", "0.01", "0.00015", "L4_ChipLayer.flp"),
+    (5, "TIM", "Y", "N", "4.00E+06", "0.25", "2.00E-05", "L5_TIM.flp"),
+]
+# HotSpot 结果缓存的格式版本, 修改 gen_flp / gen_ptrace 的输出 (材料参数、fill_space 等) 或命令行参数时需要递增
+CACHE_VERSION = 2
+
+def _material_properties():
+    '''
+    各层材料在 flp 行末的比热容、热阻率两列; C4 / TSV / 微凸点层为铜与填充材料按面积比混合的等效值
+    与 case 无关, 只在导入时计算一次
+    '''
+    UnderFill = "\t2.32E+06\t0.625\n"
+    Copper = "\t3494400\t0.0025\n"
+    Silicon = "\t1.75E+06\t0.01\n"
+    resistivity_Cu, specHeat_Cu = 0.0025, 3494400
+    resistivity_UF, specHeat_UF = 0.625, 2320000
+    resistivity_Si, specHeat_Si = 0.01, 1750000
+    C4_diameter, C4_edge 	= 0.000250, 0.000600
+    TSV_diameter, TSV_edge  = 0.000010, 0.000050  
+    ubump_diameter, ubump_edge = 0.000025, 0.000045
+    
+    Aratio_C4 = (C4_edge/C4_diameter)*(C4_edge/C4_diameter)-1			# ratio of white area and C4 area
+    Aratio_TSV= (TSV_edge/TSV_diameter)*(TSV_edge/TSV_diameter)-1
+    Aratio_ubump=(ubump_edge/ubump_diameter)*(ubump_edge/ubump_diameter)-1
+    resistivity_C4=(1+Aratio_C4)*resistivity_Cu*resistivity_UF/(resistivity_UF+Aratio_C4*resistivity_Cu)
+    resistivity_TSV=(1+Aratio_TSV)*resistivity_Cu*resistivity_Si/(resistivity_Si+Aratio_TSV*resistivity_Cu)
+    resistivity_ubump=(1+Aratio_ubump)*resistivity_Cu*resistivity_UF/(resistivity_UF+Aratio_ubump*resistivity_Cu)
+    specHeat_C4=(specHeat_Cu+Aratio_C4*specHeat_UF)/(1+Aratio_C4)
+    specHeat_TSV=(specHeat_Cu+Aratio_TSV*specHeat_Si)/(1+Aratio_TSV)
+    specHeat_ubump=(specHeat_Cu+Aratio_ubump*specHeat_UF)/(1+Aratio_ubump)
+    mat_C4 = "\t"+str(specHeat_C4)+"\t"+str(resistivity_C4)+"\n"
+    mat_TSV = "\t"+str(specHeat_TSV)+"\t"+str(resistivity_TSV)+"\n"
+    mat_ubump = "\t"+str(specHeat_ubump)+"\t"+str(resistivity_ubump)+"\n"
+    Head_description = "# Line Format: <unit-name>\\t<width>\\t<height>\\t<left-x>\\t<bottom-y>\\t"+\
+                        "[<specific-heat>]\\t[<resistivity>]\n"+"# all dimensions are in meters\n"+\
+                        "# comment lines begin with a '#' \n"+"# comments and empty lines are ignored\n\n"
+    return UnderFill, Silicon, mat_C4, mat_TSV, mat_ubump, Head_description
+
+UNDERFILL, SILICON, MAT_C4, MAT_TSV, MAT_UBUMP, HEAD_DESCRIPTION = _material_properties()
+# 每个布局单独生成的层, 其余层只与中介层尺寸有关, 在 set_params 时为整个 case 生成一次
+LAYOUT_LAYERS = (3, 4)
+
+class HotspotCache():
+    '''
+    按内容寻址的 HotSpot 结果缓存: 键为布局几何、功率、中介层尺寸、层叠结构和 hotspot.config 的哈希,
+    命中时直接复制保存的 .steady / .grid.steady 而不运行 HotSpot
+    每个条目是 root 下以键命名的目录; 总大小超过 max_bytes 时按最近使用时间淘汰到 low_water * max_bytes 以下
+    多个进程可以共用同一个 root: 条目先写到临时目录再整体改名
+    总大小和条目数在内存中累加, 只有第一次写入和超过上限时才扫描整个目录 (其它进程写入的条目在扫描时才计入)
+    '''
+    OUTPUTS = ('.steady', '.grid.steady')
+    _shared = {}
+
+    def __init__(self, root='cache/hotspot', max_bytes=2**30, low_water=0.9):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits = self.misses = self.evictions = 0
+        self.size = self.entries = None  # 第一次 store 时扫描得到
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def shared(cls, root='cache/hotspot', max_bytes=2**30):
+        '''进程内按 (root, max_bytes) 共用的实例, 使同一 worker 进程处理的多个布局共用累加的大小, 不必各自扫描目录'''
+        key = (os.path.abspath(root), max_bytes)
+        if key not in cls._shared:
+            cls._shared[key] = cls(root, max_bytes)
+        return cls._shared[key]
+
+    def fetch(self, key, prefix):
+        '''命中时把结果复制为 prefix + .steady / .grid.steady 并返回 True'''
+        entry = os.path.join(self.root, key)
+        try:
+            for suffix in self.OUTPUTS:
+                shutil.copyfile(os.path.join(entry, 'result' + suffix), prefix + suffix)
+            os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, prefix):
+        '''保存 prefix + .steady / .grid.steady; 累加后的总大小超过上限时淘汰最久未使用的条目'''
+        if self.size is None:
+            self.size, self.entries = self._totals(self._scan())
+        entry = os.path.join(self.root, key)
+        tmp = tempfile.mkdtemp(dir=self.root, prefix='.tmp_')
+        size = 0
+        for suffix in self.OUTPUTS:
+            shutil.copyfile(prefix + suffix, os.path.join(tmp, 'result' + suffix))
+            size += os.path.getsize(prefix + suffix)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # 其它进程已经写入了同一个键
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.size += size
+        self.entries += 1
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def _scan(self):
+        '''所有条目的 (最近使用时间, 大小, 路径)'''
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.tmp_'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return entries
+
+    @staticmethod
+    def _totals(entries):
+        return sum(size for _, size, _ in entries), len(entries)
+
+    def evict(self):
+        '''重新扫描目录 (计入其它进程写入的条目), 按最近使用时间淘汰到 low_water * max_bytes 以下'''
+        entries = self._scan()
+        total, count = self._totals(entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.low_water * self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                count -= 1
+                self.evictions += 1
+        self.size, self.entries = total, count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+def read_ttrace(path, units=None):
+    '''
+    逐行读取 HotSpot 的瞬态温度轨迹 (-o 输出: 表头为单元名, 之后每个时间步一行, 单位摄氏度),
+    每步 yield 一个 float64 数组 (K); 不会把整个文件读入内存
+    units: 可选, 只返回这些单元的温度, 顺序与 units 相同; 默认为表头中的所有单元
+    '''
+    with open(path) as f:
+        header = f.readline().split()
+        columns = None if units is None else [header.index(unit) for unit in units]
+        for line in f:
+            values = line.split()
+            if not values:
+                continue
+            values = np.array(values, dtype=np.float64)
+            yield (values if columns is None else values[columns]) + 273.15
+
 class Thermal_solver():
-    def __init__(self, thermal_root_path):
+    def __init__(self, thermal_root_path, cache=None, solver='hotspot', case_path=None):
+        '''
+        cache: 可选的 HotspotCache, 给定时 run_hotspot 先查缓存
+        solver: 'hotspot' 调用 thermal/hotspot; 'grid' 用 grid_solver 中的 NumPy/SciPy 实现, 只输出 .grid.steady, 不使用 cache
+        case_path: 可选, 已由另一个 Thermal_solver 的 gen_case_files 生成好 case 共用文件的目录;
+            给定时 set_params 不再生成, lcf、HotSpot 和 grid_solver 直接引用该目录中的文件 (多个 worker 共用一份)
+        '''
         self.path = thermal_root_path
+        self.case_path = thermal_root_path if case_path is None else case_path
+        self.shared_case_files = case_path is not None
+        self.cache = cache
+        self.solver = solver
 
     def set_params(self, system):
         '''
@@ -18,6 +193,8 @@ class Thermal_solver():
         self.decimal = 6 #len(str(self.granularity).split('.')[-1])
         self.intp_width = np.round((system.intp_width)/1e3, self.decimal+1)
         self.intp_height = np.round((system.intp_height)/1e3, self.decimal+1)
+        if not self.shared_case_files:
+            self.gen_case_files()
 
     def set_pos(self, power, pos, width, height):
         self.power = power
@@ -30,118 +207,34 @@ class Thermal_solver():
         os.system('rm ' + self.path + '{*.flp,*.lcf,*.ptrace,*.steady}')
         os.system('rm ' + self.path + 'new_hotspot.config')
 
-    def gen_flp(self, filename):
-        # material properties
-        UnderFill = "\t2.32E+06\t0.625\n"
-        Copper = "\t3494400\t0.0025\n"
-        Silicon = "\t1.75E+06\t0.01\n"
-        resistivity_Cu, specHeat_Cu = 0.0025, 3494400
-        resistivity_UF, specHeat_UF = 0.625, 2320000
-        resistivity_Si, specHeat_Si = 0.01, 1750000
-        C4_diameter, C4_edge 	= 0.000250, 0.000600
-        TSV_diameter, TSV_edge  = 0.000010, 0.000050  
-        ubump_diameter, ubump_edge = 0.000025, 0.000045
-        
-        Aratio_C4 = (C4_edge/C4_diameter)*(C4_edge/C4_diameter)-1			# ratio of white area and C4 area
-        Aratio_TSV= (TSV_edge/TSV_diameter)*(TSV_edge/TSV_diameter)-1
-        Aratio_ubump=(ubump_edge/ubump_diameter)*(ubump_edge/ubump_diameter)-1
-        resistivity_C4=(1+Aratio_C4)*resistivity_Cu*resistivity_UF/(resistivity_UF+Aratio_C4*resistivity_Cu)
-        resistivity_TSV=(1+Aratio_TSV)*resistivity_Cu*resistivity_Si/(resistivity_Si+Aratio_TSV*resistivity_Cu)
-        resistivity_ubump=(1+Aratio_ubump)*resistivity_Cu*resistivity_UF/(resistivity_UF+Aratio_ubump*resistivity_Cu)
-        specHeat_C4=(specHeat_Cu+Aratio_C4*specHeat_UF)/(1+Aratio_C4)
-        specHeat_TSV=(specHeat_Cu+Aratio_TSV*specHeat_Si)/(1+Aratio_TSV)
-        specHeat_ubump=(specHeat_Cu+Aratio_ubump*specHeat_UF)/(1+Aratio_ubump)
-        mat_C4 = "\t"+str(specHeat_C4)+"\t"+str(resistivity_C4)+"\n"
-        mat_TSV = "\t"+str(specHeat_TSV)+"\t"+str(resistivity_TSV)+"\n"
-        mat_ubump = "\t"+str(specHeat_ubump)+"\t"+str(resistivity_ubump)+"\n"
-        Head_description = "# Line Format: <unit-name>\\t<width>\\t<height>\\t<left-x>\\t<bottom-y>\\t"+\
-                            "[<specific-heat>]\\t[<resistivity>]\n"+"# all dimensions are in meters\n"+\
-                            "# comment lines begin with a '#' \n"+"# comments and empty lines are ignored\n\n"
-
-        with open(self.path + filename+ 'L0_Substrate.flp','w') as L0_Substrate:
+    def gen_case_files(self):
+        '''
+        生成只与中介层尺寸有关的输入: 基板 / C4 / 中介层 / TIM 层的 flp 和 new_hotspot.config, 写到 case_path,
+        由 set_params 调用一次, 同一 case 的所有布局共用
+        '''
+        with open(self.case_path + 'L0_Substrate.flp','w') as L0_Substrate:
             L0_Substrate.write("# Floorplan for Substrate Layer with size "+\
                                str(self.intp_width/1000)+"x"+str(self.intp_height/1000)+" m\n")
-            L0_Substrate.write(Head_description)
+            L0_Substrate.write(HEAD_DESCRIPTION)
             L0_Substrate.write("Substrate\t"+str(self.intp_width/1000)+"\t"+str(self.intp_height/1000)+"\t0.0\t0.0\n")
 
-        with open(self.path+filename +'L1_C4Layer.flp','w') as L1_C4Layer:
+        with open(self.case_path + 'L1_C4Layer.flp','w') as L1_C4Layer:
             L1_C4Layer.write("# Floorplan for C4 Layer \n")
-            L1_C4Layer.write(Head_description)
-            L1_C4Layer.write("C4Layer\t"+str(self.intp_width/1000)+"\t"+str(self.intp_height/1000)+"\t0.0\t0.0"+mat_C4)
+            L1_C4Layer.write(HEAD_DESCRIPTION)
+            L1_C4Layer.write("C4Layer\t"+str(self.intp_width/1000)+"\t"+str(self.intp_height/1000)+"\t0.0\t0.0"+MAT_C4)
 
-        with open(self.path+filename +'L2_Interposer.flp','w') as L2_Interposer:
+        with open(self.case_path + 'L2_Interposer.flp','w') as L2_Interposer:
             L2_Interposer.write("# Floorplan for Silicon Interposer Layer\n")
-            L2_Interposer.write(Head_description)
-            L2_Interposer.write("Interposer\t"+str(self.intp_width/1000)+"\t"+str(self.intp_height/1000)+"\t0.0\t0.0"+mat_TSV)
-
-        with open(self.path+filename + 'sim.flp','w') as SIMP:
-            with open(self.path + filename + 'L3.flp', 'w') as L3_UbumpLayer:
-                with open(self.path + filename + 'L4.flp', 'w') as L4_ChipLayer:
-                    L3_UbumpLayer.write("# Floorplan for Microbump Layer \n")
-                    L3_UbumpLayer.write(Head_description)
-                    L4_ChipLayer.write("# Floorplan for Chip Layer\n")
-                    L4_ChipLayer.write(Head_description)
-                    L3_UbumpLayer.write('Edge_0\t' + str(self.intp_width/1000 - self.granularity/1000) + '\t' +\
-                                        str(self.granularity/2/1000) + '\t'+str(self.granularity/2/1000)+'\t0\t' + mat_ubump)
-                    L3_UbumpLayer.write('Edge_1\t' + str(self.intp_width/1000 - self.granularity/1000) + '\t' +\
-                                        str(self.granularity/2/1000) + '\t'+str(self.granularity/2/1000)+'\t'+\
-                                        str(self.intp_height/1000 - self.granularity/2/1000)+'\t' + mat_ubump)
-                    L3_UbumpLayer.write('Edge_2\t' + str(self.granularity/2/1000) + '\t' + str(self.intp_height/1000) +\
-                                        '\t0\t0\t' + mat_ubump)
-                    L3_UbumpLayer.write('Edge_3\t' + str(self.granularity/2/1000) + '\t' + str(self.intp_height/1000) +\
-                                        '\t'+str(self.intp_width/1000-self.granularity/2/1000)+'\t0\t' + mat_ubump)
-                    L4_ChipLayer.write('Edge_0\t' + str(self.intp_width/1000 - self.granularity/1000) + '\t' +\
-                                        str(self.granularity/2/1000) + '\t'+str(self.granularity/2/1000)+'\t0\t' + mat_ubump)
-                    L4_ChipLayer.write('Edge_1\t' + str(self.intp_width/1000 - self.granularity/1000) + '\t' +\
-                                        str(self.granularity/2/1000) + '\t'+str(self.granularity/2/1000)+'\t'+\
-                                        str(self.intp_height/1000 - self.granularity/2/1000)+'\t' + mat_ubump)
-                    L4_ChipLayer.write('Edge_2\t' + str(self.granularity/2/1000) + '\t' + str(self.intp_height/1000) +\
-                                        '\t0\t0\t' + mat_ubump)
-                    L4_ChipLayer.write('Edge_3\t' + str(self.granularity/2/1000) + '\t' + str(self.intp_height/1000) +\
-                                        '\t'+str(self.intp_width/1000-self.granularity/2/1000)+'\t0\t' + mat_ubump)
-
-                    x_offset0, y_offset0 = self.granularity / 2 / 1000, self.granularity / 2 / 1000
-                    for i in range(0, len(self.x)):
-                        x_offset1 = self.x[i] / 1000 - self.width[i] / 1000 * 0.5
-                        y_offset1 = self.y[i] / 1000 - self.height[i] / 1000 * 0.5
-                        L3_UbumpLayer.write("Chiplet_"+str(i)+"\t"+str(self.width[i]/1000)+"\t"+\
-                                            str(self.height[i]/1000)+"\t"+str(x_offset1)+"\t"+str(y_offset1)+mat_ubump)
-                        L4_ChipLayer.write("Chiplet_"+str(i)+"\t"+str(self.width[i]/1000)+"\t"+\
-                                           str(self.height[i]/1000)+"\t"+str(x_offset1)+"\t"+str(y_offset1)+Silicon)
-                        SIMP.write("Unit_"+str(i)+"\t"+str(self.width[i]/1000)+"\t"+\
-                                   str(self.height[i]/1000)+"\t"+str(x_offset1)+"\t"+str(y_offset1)+"\n")
-                        
-        utils.fill_space.fill_space(x_offset0, self.intp_width/1000 - x_offset0, y_offset0, self.intp_height/1000 - y_offset0,
-                                   self.path+filename+'sim', self.path+filename+'L3', self.path+filename+'L3_UbumpLayer', 
-                                    UnderFill)
-        utils.fill_space.fill_space(x_offset0, self.intp_width/1000 - x_offset0, y_offset0, self.intp_height/1000 - y_offset0,
-                                   self.path+filename+'sim', self.path+filename+'L4', self.path+filename+'L4_ChipLayer', 
-                                   UnderFill)
-        
-        with open(self.path+filename +'L5_TIM.flp','w') as L5_TIM:
+            L2_Interposer.write(HEAD_DESCRIPTION)
+            L2_Interposer.write("Interposer\t"+str(self.intp_width/1000)+"\t"+str(self.intp_height/1000)+"\t0.0\t0.0"+MAT_TSV)
+
+        with open(self.case_path + 'L5_TIM.flp','w') as L5_TIM:
             L5_TIM.write("# Floorplan for TIM Layer \n")
-            L5_TIM.write(Head_description)
+            L5_TIM.write(HEAD_DESCRIPTION)
             L5_TIM.write("TIM\t"+str(self.intp_width/1000)+"\t"+str(self.intp_height/1000)+"\t0.0\t0.0\n")
 
-        with open(self.path+filename + 'layers.lcf','w') as LCF:
-            LCF.write("# File Format:\n")
-            LCF.write("#<Layer Number>\n")
-            LCF.write("#<Lateral heat flow Y/N?>\n")
-            LCF.write("#<Power Dissipation Y/N?>\n")
-            LCF.write("#<Specific heat capacity in J/(m^3K)>\n")
-            LCF.write("#<Resistivity in (m-K)/W>\n")
-            LCF.write("#<Thickness in m>\n")
-            LCF.write("#<floorplan file>\n")
-            LCF.write("\n# Layer 0: substrate\n0\nY\nN\n1.06E+06\n3.33\n0.0002\n"+self.path+filename+"L0_Substrate.flp\n")
-            LCF.write("\n# Layer 1: Epoxy SiO2 underfill with C4 copper pillar\n1\nY\nN\n2.32E+06\n0.625\n0.00007\n"+self.path+filename+"L1_C4Layer.flp\n")
-            LCF.write("\n# Layer 2: silicon interposer\n2\nY\nN\n1.75E+06\n0.01\n0.00011\n"+self.path+filename+"L2_Interposer.flp\n")
-            LCF.write("\n# Layer 3: Underfill with ubump\n3\nY\nN\n2.32E+06\n0.625\n1.00E-05\n"+self.path+filename+"L3_UbumpLayer.flp\n")
-            LCF.write("\n# Layer 4: Chip layer\n4\nY\nY\n1.75E+06\n0.01\n0.00015\n"+self.path+filename+"L4_ChipLayer.flp\n")
-            LCF.write("\n# Layer 5: TIM\n5\nY\nN\n4.00E+06\n0.25\n2.00E-05\n"+self.path+filename+"L5_TIM.flp\n")
-
-        #if not os.path.isfile(self.path + 'new_hotspot.config'):
         with open('./thermal/' + 'hotspot.config','r') as Config_in:
-            with open(self.path + 'new_hotspot.config','w') as Config_out:
+            with open(self.case_path + 'new_hotspot.config','w') as Config_out:
                 size_spreader = (self.intp_width + self.intp_height) / 1000
                 size_heatsink = 2 * size_spreader
                 r_convec =  0.1 * 0.06 * 0.06 / size_heatsink / size_heatsink   #0.06*0.06 by default config
@@ -155,49 +248,146 @@ class Thermal_solver():
                     else:
                         Config_out.write(line)
 
-    def gen_ptrace(self, filename):
-        num_component = 0
-        component, component_name, component_index = [], [], []
-        # Read components from flp file
-        with open (self.path + filename + 'L4_ChipLayer.flp','r') as FLP:
-            for line in FLP:
-                line_sp = line.split()
-                if line_sp:
-                    if line_sp[0] != '#':
-                        component.append(line_sp[0])
-                        comp = component[num_component].split('_')
-                        component_name.append(comp[0])
-                        component_index.append(int(comp[1]))
-                        num_component+=1
+    def gen_flp(self, filename):
+        # 微凸点层 (L3) 和芯片层 (L4) 的几何完全相同, 只有 chiplet 的材料不同:
+        # 先在内存中构建单元列表, 空白填充只计算一次, 两层共用
+        FlpItem = utils.fill_space.FlpItem
+        edges = [FlpItem('Edge_0', self.intp_width/1000 - self.granularity/1000, self.granularity/2/1000,
+                         self.granularity/2/1000, 0),
+                 FlpItem('Edge_1', self.intp_width/1000 - self.granularity/1000, self.granularity/2/1000,
+                         self.granularity/2/1000, self.intp_height/1000 - self.granularity/2/1000),
+                 FlpItem('Edge_2', self.granularity/2/1000, self.intp_height/1000, 0, 0),
+                 FlpItem('Edge_3', self.granularity/2/1000, self.intp_height/1000,
+                         self.intp_width/1000-self.granularity/2/1000, 0)]
+        chiplets = []
+        x_offset0, y_offset0 = self.granularity / 2 / 1000, self.granularity / 2 / 1000
+        for i in range(0, len(self.x)):
+            x_offset1 = self.x[i] / 1000 - self.width[i] / 1000 * 0.5
+            y_offset1 = self.y[i] / 1000 - self.height[i] / 1000 * 0.5
+            chiplets.append(FlpItem("Chiplet_"+str(i), self.width[i]/1000, self.height[i]/1000, x_offset1, y_offset1))
+        # 空白填充的输入与原先从 sim.flp 读回的值相同 (str/float 往返是精确的)
+        units = [FlpItem("Unit_"+str(i), float(c.width), float(c.height), float(c.x), float(c.y))
+                 for i, c in enumerate(chiplets)]
+        whitespace = utils.fill_space.fill_whitespace(units, x_offset0, self.intp_width/1000 - x_offset0, y_offset0,
+                                                      self.intp_height/1000 - y_offset0)
+        # gen_ptrace 使用的 L4 单元顺序
+        self.components = [item.name for item in edges + chiplets + whitespace]
 
+        for flp, title, chiplet_material in (('L3_UbumpLayer.flp', "# Floorplan for Microbump Layer \n", MAT_UBUMP),
+                                             ('L4_ChipLayer.flp', "# Floorplan for Chip Layer\n", SILICON)):
+            lines = [title, HEAD_DESCRIPTION]
+            # 边缘单元的坐标后面原本就多一个制表符, 保持文件内容不变
+            lines += [utils.fill_space.flp_line(item, '\t' + MAT_UBUMP) for item in edges]
+            lines += [utils.fill_space.flp_line(item, chiplet_material) for item in chiplets]
+            lines += [utils.fill_space.flp_line(item, UNDERFILL) for item in whitespace]
+            with open(self.path + filename + flp, 'w') as FLP:
+                FLP.write(''.join(lines))
+        
+        with open(self.path+filename + 'layers.lcf','w') as LCF:
+            LCF.write("# File Format:\n")
+            LCF.write("#<Layer Number>\n")
+            LCF.write("#<Lateral heat flow Y/N?>\n")
+            LCF.write("#<Power Dissipation Y/N?>\n")
+            LCF.write("#<Specific heat capacity in J/(m^3K)>\n")
+            LCF.write("#<Resistivity in (m-K)/W>\n")
+            LCF.write("#<Thickness in m>\n")
+            LCF.write("#<floorplan file>\n")
+            for layer, description, lateral, power, heat, resistivity, thickness, flp in LAYER_STACK:
+                flp_path = self.path+filename+flp if layer in LAYOUT_LAYERS else self.case_path+flp
+                LCF.write("\n# Layer "+str(layer)+": "+description+"\n"+str(layer)+"\n"+lateral+"\n"+power+"\n"+\
+                          heat+"\n"+resistivity+"\n"+thickness+"\n"+flp_path+"\n")
+
+    def gen_ptrace(self, filename, trace=None):
+        '''
+        单元列表由 gen_flp 在内存中给出, 只有 Chiplet_i 有功率
+        trace: 可选, 可迭代对象, 每个元素是一个时间步各 chiplet 的功率 (长度 N); 逐行写出, 不在内存中保留整条轨迹。
+            默认只写一行 self.power (稳态)
+        返回写出的时间步数
+        '''
+        chiplets = [int(name.split('_')[1]) if name.split('_')[0] == 'Chiplet' else None for name in self.components]
+        steps = 0
         with open (self.path + filename + '.ptrace','w') as Ptrace:
-            # Write ptrace header
-            for i in range(0,num_component):
-                Ptrace.write(component[i]+'\t')
-            Ptrace.write('\n')
-            for i in range(0,num_component):
-                if component_name[i] == 'Chiplet':
-                    Ptrace.write(str(self.power[component_index[i]])+'\t')
-                else:
-                    Ptrace.write('0\t')
-            Ptrace.write('\n')
+            Ptrace.write(''.join(name+'\t' for name in self.components)+'\n')
+            for power in ([self.power] if trace is None else trace):
+                Ptrace.write(''.join((str(power[i]) if i is not None else '0')+'\t' for i in chiplets)+'\n')
+                steps += 1
+        return steps
+
+    def cache_key(self):
+        '''当前布局的 HotSpot 输入的哈希: 几何、功率、中介层尺寸、层叠结构和 hotspot.config'''
+        h = hashlib.sha256()
+        h.update(repr((CACHE_VERSION, LAYER_STACK, self.granularity, float(self.intp_width),
+                       float(self.intp_height))).encode())
+        for values in (self.x, self.y, self.width, self.height, self.power):
+            h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        with open('./thermal/' + 'hotspot.config', 'rb') as Config_in:
+            h.update(Config_in.read())
+        return h.hexdigest()
+
+    def hotspot_command(self, filename):
+        return ["./thermal/"+"hotspot", "-c",self.case_path+"new_hotspot.config", 
+                "-f",self.path+filename+"L4_ChipLayer.flp", 
+                "-p",self.path+filename+".ptrace", 
+                "-steady_file",self.path+filename+".steady", 
+                "-grid_steady_file",self.path+filename+".grid.steady",
+                "-model_type","grid", "-detailed_3D","on", 
+                "-grid_layer_file",self.path+filename+"layers.lcf"]
+
+    def run_transient(self, filename, trace, sampling_interval=None, init_file=None, units=None):
+        '''
+        HotSpot 瞬态分析: trace 逐行写入 .ptrace (见 gen_ptrace), 温度轨迹写到 filename.ttrace,
+        返回逐个时间步读取该文件的生成器 (见 read_ttrace), 默认每步给出各 chiplet 的温度 (K), 顺序与 self.power 相同
+        sampling_interval: 每个时间步的时长 (s), 默认为 hotspot.config 中的 sampling_intvl
+        init_file: 可选, 初始温度文件 (如之前稳态分析的 .steady), 默认从 init_temp 开始
+        units: 可选, 要读取的单元名 (如 'WS_0'), 默认 Chiplet_0 ~ Chiplet_{N-1}
+        HotSpot 在瞬态分析之后还会按平均功率求一次稳态, 同样写出 .steady / .grid.steady; 瞬态结果不使用 cache
+        '''
+        if self.solver != 'hotspot':
+            raise ValueError("transient analysis needs thermal/hotspot, not solver " + repr(self.solver))
+        self.gen_flp(filename)
+        steps = self.gen_ptrace(filename, trace)
+        if not steps:
+            raise ValueError("empty power trace for " + filename)
+        cmd = self.hotspot_command(filename) + ["-o", self.path+filename+".ttrace"]
+        if sampling_interval is not None:
+            cmd += ["-sampling_intvl", str(sampling_interval)]
+        if init_file is not None:
+            cmd += ["-init_file", init_file]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError("hotspot failed on " + filename + ": " + proc.stderr.decode(errors='replace').strip())
+        if units is None:
+            units = ["Chiplet_" + str(i) for i in range(len(self.x))]
+        return read_ttrace(self.path + filename + ".ttrace", units)
 
     def run_hotspot(self, filename, default=1):
         # self.clean_hotspot(filename)
+        if self.solver == 'grid':
+            # 同一进程中相同网格的布局共用一个求解器, 复用消元顺序
+            import grid_solver
+            solver = grid_solver.shared_solver(self.case_path + 'new_hotspot.config', self.intp_width, self.intp_height,
+                                               self.granularity)
+            temperature = solver.solve(self.x, self.y, self.width, self.height, self.power)
+            grid_solver.write_grid_steady(temperature, self.path + filename + '.grid.steady')
+            return
+        key = None
+        if self.cache is not None:
+            # 命中时只写出 .steady / .grid.steady, 不生成 flp/ptrace
+            key = self.cache_key()
+            if self.cache.fetch(key, self.path + filename):
+                return
         self.gen_flp(filename)
         self.gen_ptrace(filename)
-        cmd = ["./thermal/"+"hotspot", "-c",self.path+"new_hotspot.config", 
-               "-f",self.path+filename+"L4_ChipLayer.flp", 
-               "-p",self.path+filename+".ptrace", 
-               "-steady_file",self.path+filename+".steady", 
-               "-grid_steady_file",self.path+filename+".grid.steady",
-               "-model_type","grid", "-detailed_3D","on", 
-               "-grid_layer_file",self.path+filename+"layers.lcf"]
+        cmd = self.hotspot_command(filename)
         t1 = time.time()
         if default:
             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr = subprocess.PIPE)
             stdout, stderr = proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError("hotspot failed on " + filename + ": " + stderr.decode(errors='replace').strip())
             outlist = stdout.split() 
+            if key is not None:
+                self.cache.store(key, self.path + filename)
         else:
             os.system(" ".join(cmd))
             print(time.time()-t1)
@@ -0,0 +1,138 @@
+"""
+主动采样: 只把紧凑模型最不可靠的布局送去 HotSpot, 用更少的仿真达到同样的测试误差
+
+训练一组 ChipletThermalModel (集成): 第 0 个成员用全部已仿真的布局, 其余成员用自助重采样 (bootstrap) 的训练集
+并从随机的 lx/ly 出发。候选布局上各成员预测的分歧 (逐单元标准差的平均) 估计模型在该布局上的不确定度,
+每轮仿真分歧最大的若干个候选, 重新拟合, 直到保留的测试布局上第 0 个成员的 MAE 达到目标或用完仿真预算
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from compact_themal_model import ChipletThermalModel
+from layout_cache import load_case_layouts
+from pipeline import ENV_TMP_K, iter_results, produce
+from train_compact_themal_model import device, fit_varpro, layout_inputs
+
+
+def simulate(case_name, layout_ids, workers=None, cache_dir=None, simulator='hotspot', queue_size=16):
+    """
+    仿真这些布局 (dataset/ 中已有结果的直接读取), 返回 {布局 id: 温度图 (grid*grid,) float32}
+    与 run_pipeline 相同, produce 在单独的线程中写入有界队列, 这里边到达边取出
+    """
+    results = queue.Queue(maxsize=queue_size)
+    failures = []
+    producer = threading.Thread(target=lambda: failures.extend(
+        produce(case_name, layout_ids, results, workers, cache_dir, solver=simulator)), daemon=True)
+    producer.start()
+    temperature = {idx: item.reshape(-1) for idx, item in iter_results(results)}
+    producer.join()
+    for idx, error in failures:
+        print(f"{case_name}:{idx} failed: {error}")
+    return temperature
+
+
+class Ensemble():
+    '''M 个 ChipletThermalModel, 成员 0 在全部数据上拟合, 其余成员在自助重采样的数据上拟合'''
+    def __init__(self, case, members=4, seed=0):
+        self.case = case
+        self.rng = np.random.default_rng(seed)
+        self.models = [ChipletThermalModel(len(case.names)).to(device) for _ in range(members)]
+        with torch.no_grad():
+            for model in self.models[1:]:
+                for name in ('lx', 'ly'):
+                    getattr(model, name).copy_(torch.tensor(self.rng.uniform(0.5, 2.0, len(case.names))))
+
+    def fit(self, temperature):
+        '''temperature: {布局 id: 温度图}; 每个成员从上一次的参数继续拟合'''
+        ids = sorted(temperature)
+        for m, model in enumerate(self.models):
+            sample = ids if m == 0 else list(self.rng.choice(ids, len(ids)))
+            x_input, y_input, chiplets = layout_inputs(self.case, sample)
+            target = torch.tensor(np.stack([temperature[idx] for idx in sample]), device=device)
+            fit_varpro(model, x_input, y_input, chiplets, target, ENV_TMP_K, verbose=False)
+
+    @torch.no_grad()
+    def predict(self, layout_ids):
+        '''各成员的预测 (K), shape (M, len(layout_ids), grid*grid)'''
+        x_input, y_input, chiplets = layout_inputs(self.case, layout_ids)
+        return torch.stack([model.predict(x_input, y_input, *chiplets, env_temperature=ENV_TMP_K)
+                            for model in self.models]).cpu().numpy()
+
+    def disagreement(self, layout_ids):
+        '''每个布局上各成员预测的逐单元标准差的平均 (K)'''
+        return self.predict(layout_ids).std(axis=0).mean(axis=1)
+
+
+def active_sampling(case_name, test_ids, target_mae=1.0, initial=4, batch=2, budget=50, members=4, seed=0,
+                    workers=None, cache_dir=None, simulator='hotspot'):
+    """
+    对一个 case 做主动采样, test_ids 以外的布局都是候选
+    target_mae: 测试布局上的目标平均绝对误差 (K); budget: 训练用的最大仿真数 (不含测试布局)
+    返回 (成员 0 的模型, 被仿真的训练布局 id 列表 (按采样顺序), 最终测试 MAE);
+    模型保存到 model/{case_name}_thermal_model.pth
+    """
+    case = load_case_layouts(case_name)
+    test_ids = [idx for idx in test_ids if idx in set(case.layout_ids.tolist())]
+    pool = [int(idx) for idx in case.layout_ids if idx not in set(test_ids)]
+    rng = np.random.default_rng(seed)
+    start = time.time()
+
+    test_truth = simulate(case_name, test_ids, workers, cache_dir, simulator)
+    test_ids = sorted(test_truth)
+    test_target = np.stack([test_truth[idx] for idx in test_ids])
+    ensemble = Ensemble(case, members, seed)
+
+    chosen = [int(idx) for idx in rng.choice(pool, min(initial, len(pool), budget), replace=False)]
+    train_truth = {}
+    while True:
+        train_truth.update(simulate(case_name, chosen, workers, cache_dir, simulator))
+        # 失败的布局也移出候选, 不再重试
+        pool = [idx for idx in pool if idx not in chosen]
+        ensemble.fit(train_truth)
+        mae = np.abs(ensemble.predict(test_ids)[0] - test_target).mean()
+        print(f"[{time.time() - start:7.1f} s] {len(train_truth)} training layouts, test MAE = {mae:.4f} K")
+        if mae <= target_mae or not pool or len(train_truth) >= budget:
+            break
+        scores = ensemble.disagreement(pool)
+        order = np.argsort(scores)[::-1][:min(batch, budget - len(train_truth))]
+        chosen = [pool[k] for k in order]
+        print(f"  next: {chosen}, disagreement {', '.join(f'{s:.3f}' for s in scores[order])} K "
+              f"(pool mean {scores.mean():.3f} K)")
+
+    reason = "target reached" if mae <= target_mae else "budget exhausted" if pool else "no candidates left"
+    print(f"{case_name}: {reason}, test MAE = {mae:.4f} K with {len(train_truth)} training simulations "
+          f"(+{len(test_ids)} test)")
+    os.makedirs('model', exist_ok=True)
+    torch.save(ensemble.models[0].state_dict(), f'model/{case_name}_thermal_model.pth')
+    return ensemble.models[0], list(train_truth), mae
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="1", help='case number')
+    arg.add_argument('--target-mae', type=float, default=1.0, help='Stop once the test MAE (K) is at most this')
+    arg.add_argument('--test-layouts', type=int, default=20, help='The last N layouts of the case are held out for testing')
+    arg.add_argument('--initial', type=int, default=4, help='Randomly chosen layouts simulated before the first fit')
+    arg.add_argument('--batch', type=int, default=2, help='Layouts simulated per round')
+    arg.add_argument('--budget', type=int, default=50, help='Maximum number of training simulations')
+    arg.add_argument('--ensemble', type=int, default=4, help='Number of ensemble members')
+    arg.add_argument('--seed', type=int, default=0)
+    arg.add_argument('--workers', type=int, default=None, help='Number of simulation processes (default: CPU count)')
+    arg.add_argument('--cache', type=str, default=None, help='Directory of a content-addressed HotSpot result cache')
+    arg.add_argument('--simulator', type=str, default='hotspot', choices=['hotspot', 'grid'],
+                     help='"grid" simulates with grid_solver.py instead of thermal/hotspot')
+    args = arg.parse_args()
+    if args.ensemble < 2:
+        arg.error('--ensemble needs at least 2 members to measure disagreement')
+
+    case_name = f"Case{args.case}"
+    layout_ids = load_case_layouts(case_name).layout_ids
+    active_sampling(case_name, layout_ids[-args.test_layouts:].tolist(), args.target_mae, args.initial, args.batch,
+                    args.budget, args.ensemble, args.seed, args.workers, args.cache, args.simulator)
@@ -0,0 +1,97 @@
+""".blocks 解析: 原来的 Modules 字典 (逐字符取顶点) 与列式 ChipletTable 的耗时和常驻内存对比
+
+生成 --sizes 个 hardrectilinear 块的 .blocks 文件, 每个规模都检查 parse_blocks 的 Modules 与原实现完全一致
+期望 ChipletTable 每块的耗时和内存不随块数增长
+
+用法: python -m benchmarks.bench_blocks [--sizes 1000 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+
+from utils.blocks_parser import load_blocks_table, parse_blocks, parse_header
+from utils.uscs_parser import blank_line, word_split
+
+
+def loop_parse_blocks(file_path):
+    """原来的实现: 每个块一个 dict, 顶点从重新拼接的字符串中逐字符取出, 仅作为数值与耗时的参照"""
+    modules, headers = {}, {}
+    with open(file_path) as f:
+        lines = re.split('\n', f.read())
+    i = 0
+    while i < len(lines) and parse_header(lines, i, headers):
+        i += 1
+    while i < len(lines):
+        if blank_line(lines[i]):
+            i += 1
+            continue
+        words = word_split(lines[i])
+        if len(words) != 11 or words[1] != "hardrectilinear":
+            break
+        joint_string = " " + " ".join(words[3:])
+        vertices = []
+        index = 0
+        for _ in range(int(words[2])):
+            while index < len(joint_string) and joint_string[index] != '(':
+                index += 1
+            index += 1
+            point_string = ""
+            while index < len(joint_string) and joint_string[index] != ')':
+                point_string += joint_string[index]
+                index += 1
+            point_split = point_string.split(",")
+            vertices.append((float(point_split[0]), float(point_split[1])))
+        min_x, max_x = min(v[0] for v in vertices), max(v[0] for v in vertices)
+        min_y, max_y = min(v[1] for v in vertices), max(v[1] for v in vertices)
+        modules[words[0]] = {
+            'rectangles': [[(min_x + max_x) / 2, (min_y + max_y) / 2, max_x - min_x, max_y - min_y]],
+            'fixed': True
+        }
+        i += 1
+    return {'Modules': modules}, {'Headers': headers}
+
+
+def measure(fn, repeat):
+    """(每次的平均耗时, 返回值常驻的字节数)"""
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.time() - start) / repeat
+    tracemalloc.start()
+    out = fn()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del out
+    return elapsed, retained
+
+
+def main():
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000], help='blocks per file')
+    arg.add_argument('--repeat', type=int, default=3, help='timed repetitions per file')
+    args = arg.parse_args()
+
+    print(f"{'blocks':>8} {'dict (us/blk)':>14} {'table (us/blk)':>15} {'dict (B/blk)':>13} {'table (B/blk)':>14}")
+    ok = True
+    with tempfile.TemporaryDirectory() as scratch:
+        for n in args.sizes:
+            path = os.path.join(scratch, f"{n}.blocks")
+            with open(path, "w") as f:
+                f.write(f"NumSoftRectangularBlocks : 0\nNumHardRectilinearBlocks : {n}\nNumTerminals : 0\n\n")
+                for k in range(n):
+                    w, h = 1000 + k % 9000, 1000 + k % 7000
+                    f.write(f"C{k} hardrectilinear 4 (0, 0) (0, {h}) ({w}, {h}) ({w}, 0)\n")
+            t_dict, m_dict = measure(lambda: loop_parse_blocks(path), args.repeat)
+            t_table, m_table = measure(lambda: load_blocks_table(path), args.repeat)
+            ok &= parse_blocks({'filename_blocks': path}) == loop_parse_blocks(path)
+            print(f"{n:>8} {t_dict / n * 1e6:>14.2f} {t_table / n * 1e6:>15.2f} {m_dict / n:>13.0f} {m_table / n:>14.0f}")
+    if not ok:
+        raise SystemExit("Modules from the chiplet table differ from the original parser")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""空白填充: 扫描线分解 (fill_whitespace) 与原递归切分 (fill_whitespace_recursive) 的块数、耗时与面积校验
+
+每个布局都检查两种结果: 空白块互不重叠、不与 chiplet 重叠、且空白面积 + chiplet 面积 = 区域面积
+随机布局有两种: grid 把区域分成 k x k 个格子, 每格放一个随机大小和偏移的 chiplet;
+scattered 用拒绝采样随机撒点; 两种都保证 chiplet 之间互不重叠
+
+用法: python -m benchmarks.bench_fill_space [--sizes 5 20 50 100 200 400 800] [--repeat 3] [--cases 1 2 ...]
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from layout_cache import load_case_layouts
+from utils.fill_space import FlpItem, fill_whitespace, fill_whitespace_recursive
+
+TOL = 0.00001
+
+
+def random_layout(n, size, rng):
+    """在 size x size 的区域内放 n 个互不重叠的 chiplet"""
+    k = math.ceil(math.sqrt(n))
+    cell = size / k
+    cells = rng.choice(k * k, n, replace=False)
+    units = []
+    for i, c in enumerate(cells):
+        w, h = rng.uniform(0.3, 1.0, 2) * cell
+        x = (c % k) * cell + rng.uniform(0, cell - w)
+        y = (c // k) * cell + rng.uniform(0, cell - h)
+        units.append(FlpItem(f"chiplet_{i}", w, h, x, y))
+    return units
+
+
+def scattered_layout(n, size, rng):
+    """在 size x size 的区域内随机撒 n 个互不重叠的 chiplet (拒绝采样), 一般不能被 guillotine 切分"""
+    side = size / math.sqrt(n) * 0.6
+    units, boxes = [], np.empty((0, 4))
+    while len(units) < n:
+        w, h = rng.uniform(0.3, 1.0, 2) * side
+        x, y = rng.uniform(0, size - w), rng.uniform(0, size - h)
+        if ((boxes[:, 0] < x + w) & (x < boxes[:, 1]) & (boxes[:, 2] < y + h) & (y < boxes[:, 3])).any():
+            continue
+        units.append(FlpItem(f"chiplet_{len(units)}", w, h, x, y))
+        boxes = np.vstack([boxes, (x, x + w, y, y + h)])
+    return units
+
+
+def case_layout(case, row):
+    """与 Thermal.gen_flp 相同的坐标换算 (mm, 中介层内留 0.1mm 边)"""
+    cx, cy, w, h = case.layouts[row].astype(np.float64).T / 1000
+    units = [FlpItem(name, w[i], h[i], cx[i] - w[i]/2, cy[i] - h[i]/2) for i, name in enumerate(case.names)]
+    return units, (0.1, case.intpsize/1000 - 0.1, 0.1, case.intpsize/1000 - 0.1)
+
+
+def _boxes(items):
+    return np.array([(i.x, i.x + i.width, i.y, i.y + i.height) for i in items]).reshape(-1, 4)
+
+
+def _overlap(a, b):
+    """a, b 中矩形两两之间的重叠面积, (len(a), len(b))"""
+    dx = np.minimum(a[:, None, 1], b[None, :, 1]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    dy = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 2], b[None, :, 2])
+    return np.clip(dx, 0, None) * np.clip(dy, 0, None)
+
+
+def check(units, ws, region):
+    """返回 (面积误差, 最大重叠面积); 两者都应在 TOL 量级"""
+    x0, x1, y0, y1 = region
+    chips = _boxes(units)
+    chips[:, [0, 2]] = np.maximum(chips[:, [0, 2]], (x0, y0))
+    chips[:, [1, 3]] = np.minimum(chips[:, [1, 3]], (x1, y1))
+    chips = chips[(chips[:, 1] > chips[:, 0]) & (chips[:, 3] > chips[:, 2])]
+    spaces = _boxes(ws)
+    area = lambda b: ((b[:, 1] - b[:, 0]) * (b[:, 3] - b[:, 2])).sum()
+    error = abs((x1 - x0) * (y1 - y0) - area(chips) - area(spaces))
+    self_overlap = _overlap(spaces, spaces)
+    np.fill_diagonal(self_overlap, 0)
+    overlap = max(self_overlap.max(initial=0), _overlap(spaces, chips).max(initial=0))
+    return error, overlap
+
+
+def timeit(fn, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        out = fn()
+    return (time.time() - start) / repeat, out
+
+
+def compare(label, units, region, repeat):
+    t_rec, ws_rec = timeit(lambda: fill_whitespace_recursive(units, *region), repeat)
+    t_sweep, ws_sweep = timeit(lambda: fill_whitespace(units, *region), repeat)
+    err_rec, ovl_rec = check(units, ws_rec, region)
+    err_sweep, ovl_sweep = check(units, ws_sweep, region)
+    ok = max(err_sweep, ovl_sweep) < 100 * TOL
+    print(f"{label:>10} {len(units):>5} {len(ws_rec):>7} {len(ws_sweep):>7} {t_rec*1e3:>11.2f} {t_sweep*1e3:>11.2f} "
+          f"{t_rec / t_sweep:>8.2f} {max(err_rec, ovl_rec):>10.1e} {max(err_sweep, ovl_sweep):>10.1e} "
+          f"{'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def main():
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50, 100, 200, 400, 800],
+                     help='chiplet counts of the random layouts')
+    arg.add_argument('--cases', type=int, nargs='*', default=list(range(1, 11)), help='cases to check (first layout)')
+    arg.add_argument('--repeat', type=int, default=3, help='timed repetitions per layout')
+    arg.add_argument('--seed', type=int, default=0)
+    args = arg.parse_args()
+
+    print(f"{'layout':>10} {'N':>5} {'#WS rec':>7} {'#WS new':>7} {'rec (ms)':>11} {'sweep (ms)':>11} "
+          f"{'speedup':>8} {'rec err':>10} {'new err':>10}")
+    ok = True
+    for idx in args.cases:
+        case = load_case_layouts(f"Case{idx}")
+        units, region = case_layout(case, 0)
+        ok &= compare(f"Case{idx}", units, region, args.repeat)
+    rng = np.random.default_rng(args.seed)
+    for n in args.sizes:
+        ok &= compare("grid", random_layout(n, 50.0, rng), (0, 50.0, 0, 50.0), args.repeat)
+    for n in args.sizes:
+        ok &= compare("scattered", scattered_layout(n, 50.0, rng), (0, 50.0, 0, 50.0), args.repeat)
+    if not ok:
+        raise SystemExit("whitespace decomposition failed the area check")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""ChipletThermalModel.forward 向量化前后的耗时对比 (Case1 ~ Case10)
+
+用法: python -m benchmarks.bench_forward [--batch 50] [--repeat 5] [--device cpu]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+from compact_themal_model import ChipletThermalModel, F
+from process_thermal import parse_intpsize_file, parse_power_file, parse_pl_file
+
+grid = 64
+
+
+def loop_forward(model, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, grid, train=True):
+    """原始的逐 chiplet 循环实现, 仅作为数值与耗时的参照"""
+    result = torch.zeros_like(x)
+    TRAIN = x.shape[0] if train else 1
+    for i in range(model.N):
+        dx = x - chiplets_x[:, i].view(TRAIN, -1).repeat(1, grid*grid)
+        dy = y - chiplets_y[:, i].view(TRAIN, -1).repeat(1, grid*grid)
+        w2 = chiplets_width[:, i].view(TRAIN, -1).repeat(1, grid*grid) / 2
+        h2 = chiplets_height[:, i].view(TRAIN, -1).repeat(1, grid*grid) / 2
+        Pi = chiplets_power[:, i].view(TRAIN, -1).repeat(1, grid*grid)
+        terms = []
+        for sx in [-1, 1]:
+            for sy in [-1, 1]:
+                b = (w2 - sx * dx) / model.lx[i]
+                c = (h2 - sy * dy) / model.ly[i]
+                terms.append(F(model.a, b, c))
+        sumF = sum(terms) + model.B
+        result += Pi * model.A * sumF
+    return result
+
+
+def load_case(case_name, batch, device):
+    case_dir = f"./cases/{case_name}"
+    intpsize, _ = parse_intpsize_file(os.path.join(case_dir, f"{case_name}.intpsize"))
+    intpsize /= 1e3
+    power = parse_power_file(os.path.join(case_dir, f"{case_name}.power"))
+    layouts = []
+    for i in range(batch):
+        chip_names, positions, widths, heights = parse_pl_file(os.path.join(case_dir, f"{case_name}_{i+1}.pl"))
+        positions = np.array(positions).transpose()
+        layouts.append([np.round(positions[0]/1e3), np.round(positions[1]/1e3),
+                        np.array(widths)/1e3, np.array(heights)/1e3,
+                        [power.get(name, 0.0) for name in chip_names]])
+    chiplets = torch.tensor(np.array(layouts), dtype=torch.float32, device=device)
+    X, Y = torch.meshgrid(torch.arange(grid), torch.arange(grid), indexing='xy')
+    x_input = X.flatten().float().repeat(batch, 1).to(device) * intpsize / grid
+    y_input = Y.flatten().float().repeat(batch, 1).to(device) * intpsize / grid
+    return x_input, y_input, chiplets.unbind(1)
+
+
+def timeit(fn, repeat, device):
+    fn()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeat):
+        out = fn()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / repeat, out
+
+
+def main():
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--batch', type=int, default=50, help='number of layouts per forward call')
+    arg.add_argument('--repeat', type=int, default=5, help='timed repetitions per case')
+    arg.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = arg.parse_args()
+
+    print(f"{'case':>7} {'N':>4} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8} {'max |diff|':>11}")
+    for idx in range(1, 11):
+        case_name = f"Case{idx}"
+        x_input, y_input, chiplets = load_case(case_name, args.batch, args.device)
+        model = ChipletThermalModel(chiplets[0].shape[1])
+        model.load_state_dict(torch.load(f'model/{case_name}_thermal_model.pth', weights_only=True,
+                                         map_location='cpu'))
+        model.to(args.device)
+        with torch.no_grad():
+            t_loop, ref = timeit(lambda: loop_forward(model, x_input, y_input, *chiplets, grid), args.repeat, args.device)
+            t_vec, out = timeit(lambda: model(x_input, y_input, *chiplets, grid), args.repeat, args.device)
+        diff = (out - ref).abs().max().item()
+        print(f"{case_name:>7} {model.N:>4} {t_loop:>10.4f} {t_vec:>15.4f} {t_loop / t_vec:>8.2f} {diff:>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+""".nets 解析: 原逐行解析 (parse_nets) 与一次扫描的 CSR 解析 (parse_nets_csr) 及其缓存 (load_nets_csr) 的耗时对比
+
+每个 case 都检查 CSR 结果与 parse_nets 的线网、引脚名字和偏移完全一致
+另外把 case 的线网复制 --scale 倍生成一个更大的文件, 看耗时是否随引脚数线性增长
+
+用法: python -m benchmarks.bench_nets [--cases 1 2 ...] [--repeat 3] [--scale 20]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils.nets_parser import load_nets_csr, parse_nets, parse_nets_csr
+
+
+def timeit(fn, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        out = fn()
+    return (time.time() - start) / repeat, out
+
+
+def same_nets(nets, csr):
+    """parse_nets 的结果 ([名字, x 字符串, y 字符串] 的列表的列表) 与 CSR 是否一致"""
+    if len(nets) != csr.num_nets or not np.array_equal(np.diff(csr.net_offsets), [len(net) for net in nets]):
+        return False
+    pins = [pin for net in nets for pin in net]
+    return ([pin[0] for pin in pins] == [csr.names[i] for i in csr.pin_chiplet] and
+            np.array_equal([float(pin[1]) for pin in pins], csr.pin_dx) and
+            np.array_equal([float(pin[2]) for pin in pins], csr.pin_dy))
+
+
+def compare(label, path, repeat, cache_dir):
+    t_old, (nets, _) = timeit(lambda: parse_nets({'filename_nets': path}), repeat)
+    t_csr, csr = timeit(lambda: parse_nets_csr(path), repeat)
+    load_nets_csr(path, cache_dir=cache_dir)  # 写缓存
+    t_cached, _ = timeit(lambda: load_nets_csr(path, cache_dir=cache_dir), repeat)
+    ok = same_nets(nets['Nets'], csr)
+    print(f"{label:>10} {csr.num_nets:>7} {len(csr.pin_chiplet):>7} {t_old*1e3:>10.2f} {t_csr*1e3:>10.2f} "
+          f"{t_cached*1e3:>10.2f} {t_old / t_csr:>8.2f} {t_old / t_cached:>9.1f} {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+def main():
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--cases', type=int, nargs='*', default=list(range(1, 11)), help='cases to parse')
+    arg.add_argument('--repeat', type=int, default=3, help='timed repetitions per file')
+    arg.add_argument('--scale', type=int, default=20, help='copies of Case3 nets in the large synthetic file')
+    args = arg.parse_args()
+
+    print(f"{'nets':>10} {'#nets':>7} {'#pins':>7} {'old (ms)':>10} {'csr (ms)':>10} {'cached':>10} "
+          f"{'speedup':>8} {'vs cache':>9}")
+    ok = True
+    with tempfile.TemporaryDirectory() as scratch:
+        cache_dir = os.path.join(scratch, "cache")
+        for idx in args.cases:
+            ok &= compare(f"Case{idx}", f"cases/Case{idx}/Case{idx}.nets", args.repeat, cache_dir)
+        if args.scale > 1:
+            with open("cases/Case3/Case3.nets") as f:
+                lines = f.read().splitlines(keepends=True)
+            body = [line for line in lines if not line.startswith("Num")]
+            num_nets = sum(line.startswith("NetDegree") for line in body)
+            num_pins = sum(len(line.split()) == 5 for line in body)
+            path = os.path.join(scratch, "large.nets")
+            with open(path, "w") as f:
+                f.write(f"NumNets : {num_nets * args.scale}\nNumPins : {num_pins * args.scale}\n\n")
+                f.writelines(body * args.scale)
+            ok &= compare(f"Case3 x{args.scale}", path, args.repeat, cache_dir)
+    if not ok:
+        raise SystemExit("CSR nets differ from parse_nets")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 #themal model from
 #ATPlace2.5D: Analytical Thermal-Aware Chiplet Placement Framework for Large-Scale 2.5D-IC
+import math
+
 import torch
 import torch.nn as nn
 
+# chiplet_response 在 no_grad 下同时存活的 (B, N, grid*grid) 临时张量个数的上界, 用于估算显存
+_RESPONSE_TEMPORARIES = 12
+# ChipletContribution 反向时同时存活的 (B, N, grid*grid) 临时张量个数的上界
+_BACKWARD_TEMPORARIES = 20
+
 def F(a, b, c):
     delta = torch.sqrt(a**2 + b**2 + c**2)
     term1 = b * torch.log((c + delta) / torch.sqrt(a**2 + b**2))
@@ -10,6 +17,205 @@ def F(a, b, c):
     term3 = a * torch.atan((b * c) / (a * delta))
     return (2 / torch.sqrt(torch.tensor(torch.pi))) * (term1 + term2 - term3)
 
+def _F_partials(a, b, c):
+    """
+    F 对 b, c, a 的偏导 (除去系数 2/sqrt(pi)):
+    F 是 1/sqrt(a²+u²+v²) 在 [0,b]x[0,c] 上的积分, 因此
+    dF/db ∝ log((c+δ)/sqrt(a²+b²)), dF/dc ∝ log((b+δ)/sqrt(a²+c²)), dF/da ∝ -atan(bc/(aδ))
+    """
+    delta = torch.sqrt(a**2 + b**2 + c**2)
+    log_b = torch.log((c + delta) / torch.sqrt(a**2 + b**2))
+    log_c = torch.log((b + delta) / torch.sqrt(a**2 + c**2))
+    atan_a = torch.atan((b * c) / (a * delta))
+    return log_b, log_c, atan_a
+
+
+def _sum_to(grad, shape):
+    """把广播后的梯度求和回输入的形状"""
+    if grad.shape == shape:
+        return grad
+    lead = grad.dim() - len(shape)
+    if lead:
+        grad = grad.sum(dim=tuple(range(lead)))
+    dims = [i for i, (g, s) in enumerate(zip(grad.shape, shape)) if s == 1 and g != 1]
+    return grad.sum(dim=dims, keepdim=True) if dims else grad
+
+
+class FFunction(torch.autograd.Function):
+    """
+    F(a, b, c) 的自定义 autograd 实现: 只保存输入, 反向时重新计算 δ 和两个 log/atan 项,
+    不保存 delta、log 参数、atan 参数等中间量
+    """
+    @staticmethod
+    def forward(ctx, a, b, c):
+        ctx.save_for_backward(a, b, c)
+        return F(a, b, c)
+
+    @staticmethod
+    def backward(ctx, grad):
+        a, b, c = ctx.saved_tensors
+        log_b, log_c, atan_a = _F_partials(a, b, c)
+        grad = grad * (2 / math.sqrt(math.pi))
+        grad_a = _sum_to(-grad * atan_a, a.shape) if ctx.needs_input_grad[0] else None
+        grad_b = _sum_to(grad * log_b, b.shape) if ctx.needs_input_grad[1] else None
+        grad_c = _sum_to(grad * log_c, c.shape) if ctx.needs_input_grad[2] else None
+        return grad_a, grad_b, grad_c
+
+
+class ChipletContribution(torch.autograd.Function):
+    """
+    融合的温升计算 sum_n P_n * A * (sum_corners F(a, b, c) + B), 对所有输入给出手推的解析梯度
+
+    前向不建计算图, 只保存输入 (均为 (B, N) / (N,) / 标量 以及坐标); 反向时重新计算
+    (B, N, grid*grid) 的中间量, 用完即释放, 激活内存与 chiplet 数和网格大小无关。
+    lx/ly 可以是所有行共享的 (N,) 也可以是逐行的 (B, N); a/A/B 可以是 (1,) 也可以是逐行的 (B, 1),
+    后者用于多个 case 堆叠在一个 batch 里 (见 MultiCaseThermalModel)。
+    """
+    @staticmethod
+    def forward(ctx, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, lx, ly, a, A, B):
+        ctx.save_for_backward(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power,
+                              lx, ly, a, A, B)
+        dx, dy, w2, h2, lx, ly = _chiplet_offsets(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height,
+                                                  lx, ly)
+        a, A, B = a.view(-1, 1, 1), A.view(-1, 1), B.view(-1, 1, 1)
+        b_neg, b_pos = (w2 + dx) / lx, (w2 - dx) / lx
+        c_neg, c_pos = (h2 + dy) / ly, (h2 - dy) / ly
+        sumF = F(a, b_neg, c_neg) + F(a, b_neg, c_pos) + F(a, b_pos, c_neg) + F(a, b_pos, c_pos)
+        return ((chiplets_power * A).unsqueeze(2) * (sumF + B)).sum(dim=1)
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, lx, ly, a, A, B = \
+            ctx.saved_tensors
+        dx, dy, w2, h2, lx_, ly_ = _chiplet_offsets(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height,
+                                                    lx, ly)
+        a_, A_, B_ = a.view(-1, 1, 1), A.view(-1, 1), B.view(-1, 1, 1)
+        b_neg, b_pos = (w2 + dx) / lx_, (w2 - dx) / lx_
+        c_neg, c_pos = (h2 + dy) / ly_, (h2 - dy) / ly_
+
+        k = 2 / math.sqrt(math.pi)
+        sumF = 0
+        dF_db = [0, 0]  # 对 b_neg / b_pos 的导数, 已对 c 的两个角点求和
+        dF_dc = [0, 0]
+        dF_da = 0
+        for i, b in enumerate((b_neg, b_pos)):
+            for j, c in enumerate((c_neg, c_pos)):
+                log_b, log_c, atan_a = _F_partials(a_, b, c)
+                sumF = sumF + k * (b * log_b + c * log_c - a_ * atan_a)
+                dF_db[i] = dF_db[i] + log_b
+                dF_dc[j] = dF_dc[j] + log_c
+                dF_da = dF_da - atan_a
+
+        # 每个 chiplet 在每个网格点上收到的梯度: grad * P_n * A
+        H = grad.unsqueeze(1) * (chiplets_power * A_).unsqueeze(2)
+        R = (grad.unsqueeze(1) * (sumF + B_)).sum(dim=2)
+        grad_x = grad_y = grad_cx = grad_cy = grad_w = grad_h = None
+        grad_p = R * A_ if ctx.needs_input_grad[6] else None
+        # a/A/B 的梯度先逐行求出 (B, 1), 再求和回 (1,) 或保持逐行
+        grad_A = _sum_to((R * chiplets_power).sum(dim=1, keepdim=True), A.shape) \
+            if ctx.needs_input_grad[10] else None
+        grad_B = _sum_to((grad.sum(dim=1) * (chiplets_power * A_).sum(dim=1)).unsqueeze(1), B.shape) \
+            if ctx.needs_input_grad[11] else None
+        grad_a = _sum_to(k * (H * dF_da).sum(dim=(1, 2)).unsqueeze(1), a.shape) \
+            if ctx.needs_input_grad[9] else None
+
+        H = H * k
+        g_dx = H * (dF_db[0] - dF_db[1]) / lx_
+        g_dy = H * (dF_dc[0] - dF_dc[1]) / ly_
+        if ctx.needs_input_grad[0]:
+            grad_x = _sum_to(g_dx.sum(dim=1), x.shape)
+        if ctx.needs_input_grad[1]:
+            grad_y = _sum_to(g_dy.sum(dim=1), y.shape)
+        if ctx.needs_input_grad[2]:
+            grad_cx = -g_dx.sum(dim=2)
+        if ctx.needs_input_grad[3]:
+            grad_cy = -g_dy.sum(dim=2)
+        if ctx.needs_input_grad[4]:
+            grad_w = (H * (dF_db[0] + dF_db[1]) / lx_).sum(dim=2) / 2
+        if ctx.needs_input_grad[5]:
+            grad_h = (H * (dF_dc[0] + dF_dc[1]) / ly_).sum(dim=2) / 2
+        grad_lx = _sum_to(-(H * (dF_db[0] * b_neg + dF_db[1] * b_pos) / lx_).sum(dim=2), lx.shape) \
+            if ctx.needs_input_grad[7] else None
+        grad_ly = _sum_to(-(H * (dF_dc[0] * c_neg + dF_dc[1] * c_pos) / ly_).sum(dim=2), ly.shape) \
+            if ctx.needs_input_grad[8] else None
+        return (grad_x, grad_y, grad_cx, grad_cy, grad_w, grad_h, grad_p, grad_lx, grad_ly, grad_a, grad_A, grad_B)
+
+
+def _chiplet_offsets(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, lx, ly):
+    """网格点相对 chiplet 中心的偏移, 以及广播到 (B, N, grid*grid) 布局的半宽/半高和 lx/ly"""
+    dx = x.unsqueeze(1) - chiplets_x.unsqueeze(2)
+    dy = y.unsqueeze(1) - chiplets_y.unsqueeze(2)
+    w2 = (chiplets_width / 2).unsqueeze(2)
+    h2 = (chiplets_height / 2).unsqueeze(2)
+    return dx, dy, w2, h2, lx.reshape(-1, lx.shape[-1], 1), ly.reshape(-1, ly.shape[-1], 1)
+
+
+class TabulatedKernel:
+    """
+    训练后 a 固定, F(a, b, c) 退化为 (b, c) 的光滑二维函数; 在均匀网格上预先计算 F 并双线性插值,
+    用于 CPU 上超越函数开销占主导的 placer 推理循环。仅用于推理, 不支持对 a/lx/ly 求导。
+    """
+    def __init__(self, a, extent, resolution):
+        """
+        a: 固定的厚度因子
+        extent: 表的定义域为 b, c ∈ [-extent, extent], 超出部分按边界值截断
+        resolution: 每个维度的采样点数
+        """
+        self.a = float(a)
+        self.extent = float(extent)
+        self.resolution = resolution
+        nodes = torch.linspace(-self.extent, self.extent, resolution, dtype=torch.float64)
+        self.table = F(torch.tensor(self.a, dtype=torch.float64), nodes.view(-1, 1), nodes.view(1, -1)).float()
+        self.max_error = None
+
+    @classmethod
+    def fit(cls, a, extent, tolerance=1e-3, resolution=256, max_resolution=4096):
+        """
+        从 resolution 开始每次加倍采样点数, 直到插值相对解析 F 的最大误差不超过 tolerance (F 的单位)
+        误差由 validate 在加密的采样点上测得, 记录在 max_error 中; 这是误差的估计而不是严格上界
+        """
+        while True:
+            kernel = cls(a, extent, resolution)
+            kernel.max_error = kernel.validate()
+            if kernel.max_error <= tolerance or resolution >= max_resolution:
+                return kernel
+            resolution *= 2
+
+    def validate(self, oversample=4, rows=256):
+        """
+        返回插值与解析 F 的最大绝对误差 (估计值)
+
+        每个网格单元内按 1/oversample 的步长取样, 覆盖单元中心、边中点和节点之间的点;
+        F 的导数在 b = 0、c = 0 处不光滑, 误差最大处不一定在单元中心, 因此这两条线也总被采样。
+        rows: 每次计算的 b 方向采样行数, 限制临时张量的大小
+        """
+        samples = torch.linspace(-self.extent, self.extent, (self.resolution - 1) * oversample + 1,
+                                 dtype=torch.float64)
+        samples = torch.unique(torch.cat([samples, samples.new_zeros(1)]))
+        a = torch.tensor(self.a, dtype=torch.float64)
+        c = samples.view(1, -1)
+        error = 0.0
+        for start in range(0, samples.numel(), rows):
+            b = samples[start:start + rows].view(-1, 1)
+            exact = F(a, b, c)
+            approx = self(None, b.float().to(self.table.device), c.float().to(self.table.device))
+            error = max(error, (approx.double().cpu() - exact).abs().max().item())
+        return error
+
+    def to(self, device):
+        self.table = self.table.to(device)
+        return self
+
+    def __call__(self, a, b, c):
+        """与 F(a, b, c) 相同的调用方式, a 被忽略 (使用构造时的固定值)"""
+        shape = torch.broadcast_shapes(b.shape, c.shape)
+        # grid_sample 的坐标最后一维为 (列, 行), 归一化到 [-1, 1]; border 即超出定义域时截断
+        coords = torch.stack(torch.broadcast_tensors(c, b), dim=-1).mul_(1 / self.extent).view(1, -1, 1, 2)
+        table = self.table.view(1, 1, self.resolution, self.resolution)
+        return nn.functional.grid_sample(table, coords, mode='bilinear', padding_mode='border',
+                                         align_corners=True).view(shape)
+
+
 class ChipletThermalModel(nn.Module):
     def __init__(self, num_chiplets):
         super().__init__()
@@ -23,36 +229,226 @@ class ChipletThermalModel(nn.Module):
         self.lx = nn.Parameter(torch.ones(self.N))         # 每个chiplet的lx
         self.ly = nn.Parameter(torch.ones(self.N))         # 每个chiplet的ly
 
-    def forward(self, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, grid, train=True):
-        """
-        x, y: shape (B,) - 坐标位置
-        chiplets: dict with tensors of shape (N,) for:
-            - xi, yi: chiplet 中心坐标
-            - wi, hi: chiplet 尺寸
-            - Pi: chiplet 功率
-        """
-        result = torch.zeros_like(x)
-        if train:
-            TRAIN = x.shape[0]
-        else:
-            TRAIN = 1
-        for i in range(self.N):
-            dx = x - chiplets_x[:,i].view(TRAIN,-1).repeat(1, grid*grid)
-            dy = y - chiplets_y[:,i].view(TRAIN,-1).repeat(1, grid*grid)
-
-            w2 = chiplets_width[:,i].view(TRAIN,-1).repeat(1, grid*grid) / 2
-            h2 = chiplets_height[:,i].view(TRAIN,-1).repeat(1, grid*grid) / 2
-            Pi = chiplets_power[:,i].view(TRAIN,-1).repeat(1, grid*grid)
-
-            # 四项热扩散
-            terms = []
-            for sx in [-1, 1]:
-                for sy in [-1, 1]:
-                    b = ( w2 - sx * dx) / self.lx[i]
-                    c = ( h2 - sy * dy) / self.ly[i]
-                    terms.append(F(self.a, b, c))
-
-            sumF = sum(terms) + self.B
-            result += Pi * self.A * sumF
-
-        return result 
+        # 可选的推理后端, 为 None 时使用解析的 F, 见 use_tabulated_kernel
+        self.kernel = None
+
+    def forward(self, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, grid, train=True,
+                index=None):
+        """
+        x, y: shape (B, grid*grid) or (1, grid*grid) - 坐标位置
+        chiplets_x, chiplets_y: shape (B, N) - chiplet 中心坐标
+        chiplets_width, chiplets_height: shape (B, N) - chiplet 尺寸
+        chiplets_power: shape (B, N) - chiplet 功率
+        grid, train: 保留以兼容旧接口, batch 维度由广播自动推断
+        index: 可选, 只计算这些 chiplet 的贡献之和, chiplets_* 只包含这些 chiplet
+        """
+        if self.kernel is not None:
+            return self.chiplet_response(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height,
+                                         chiplets_power, index).sum(dim=1)
+        lx = self.lx if index is None else self.lx[index]
+        ly = self.ly if index is None else self.ly[index]
+        return ChipletContribution.apply(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height,
+                                         chiplets_power, lx, ly, self.a, self.A, self.B)
+
+    def chunk_sizes(self, batch, cells, memory_budget, element_size=4):
+        """
+        在 memory_budget 字节内一次反向最多能处理的 (布局数, chiplet 数):
+        优先整组 chiplet 按布局切分, 一个布局都放不下时再切分 chiplet
+        """
+        per_chiplet = _BACKWARD_TEMPORARIES * cells * element_size
+        chiplets = max(1, min(self.N, int(memory_budget // per_chiplet)))
+        layouts = max(1, min(batch, int(memory_budget // (per_chiplet * chiplets)))) if chiplets == self.N else 1
+        return layouts, chiplets
+
+    def chiplet_response(self, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, index=None):
+        """
+        每个 chiplet 对温升的贡献, 返回 shape (B, N, grid*grid)
+        index: 可选, chiplet 下标; 给定时 chiplets_* 只包含这些 chiplet, 对应选取 lx/ly
+
+        所有 chiplet 和四个角点项在 (batch, chiplet, grid-cell) 布局上一次广播计算,
+        不再逐 chiplet 循环, 也不再把参数 repeat 到 grid*grid。
+        """
+        dx, dy, w2, h2, lx, ly = _chiplet_offsets(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height,
+                                                  self.lx if index is None else self.lx[index],
+                                                  self.ly if index is None else self.ly[index])
+
+        # 四项热扩散, sx/sy = -1, 1
+        kernel = FFunction.apply if self.kernel is None else self.kernel
+        b_neg, b_pos = (w2 + dx) / lx, (w2 - dx) / lx
+        c_neg, c_pos = (h2 + dy) / ly, (h2 - dy) / ly
+        sumF = (kernel(self.a, b_neg, c_neg) + kernel(self.a, b_neg, c_pos) +
+                kernel(self.a, b_pos, c_neg) + kernel(self.a, b_pos, c_pos))
+        return (chiplets_power * self.A).unsqueeze(2) * (sumF + self.B)
+
+    @torch.no_grad()
+    def use_tabulated_kernel(self, intpsize, tolerance=1e-3, max_resolution=4096):
+        """
+        切换到查表插值的 F (推理用) 并返回该 TabulatedKernel; intpsize 为中介层边长, 与 chiplet 坐标同单位
+        对给定功率的温度误差估计见 tabulated_error_bound; 需要解析路径时把 self.kernel 设回 None
+        """
+        # |b| = |w/2 ± dx| / lx <= 1.5 * intpsize / lx
+        extent = 1.5 * intpsize / min(self.lx.abs().min().item(), self.ly.abs().min().item())
+        self.kernel = TabulatedKernel.fit(self.a.item(), extent, tolerance, max_resolution=max_resolution)
+        self.kernel.to(self.a.device)
+        return self.kernel
+
+    def tabulated_error_bound(self, chiplets_power):
+        """
+        当前查表后端对给定功率 (…, N) 的温度误差估计 (K): 4 个角点项, 每项误差不超过 max_error 时成立,
+        即 4 * max_error * |A| * sum|P|; max_error 是加密采样得到的估计, 因此结果也是估计
+        """
+        return 4 * self.kernel.max_error * self.A.abs().item() * chiplets_power.abs().sum(dim=-1)
+
+    @torch.no_grad()
+    def predict(self, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power,
+                peak_only=False, memory_budget=None, env_temperature=0.0):
+        """
+        同一 case 的 K 个候选布局的批量推理
+
+        x, y: shape (1, grid*grid) - 坐标位置
+        chiplets_x, chiplets_y, chiplets_width, chiplets_height: shape (K, N)
+        chiplets_power: shape (K, N), (1, N) or (N,) - 所有候选共用时只需给一份
+        peak_only: 为 True 时只返回每个布局的最高温度 shape (K,), 否则返回温度图 shape (K, grid*grid)
+        memory_budget: 单次计算允许的临时张量字节数, 据此自动把 K 切分成多个 chunk;
+            默认 GPU 上 1 GiB, CPU 上 4 MiB (CPU 上超出缓存后更大的 chunk 反而更慢)
+        """
+        if memory_budget is None:
+            memory_budget = 2**30 if x.is_cuda else 2**22
+        K = chiplets_x.shape[0]
+        chiplets_power = chiplets_power.reshape(-1, self.N).expand(K, -1)
+        per_layout = _RESPONSE_TEMPORARIES * self.N * x.shape[-1] * x.element_size()
+        chunk = max(1, int(memory_budget // per_layout))
+
+        results = []
+        for start in range(0, K, chunk):
+            part = slice(start, start + chunk)
+            T = self(x, y, chiplets_x[part], chiplets_y[part], chiplets_width[part], chiplets_height[part],
+                     chiplets_power[part], None) + env_temperature
+            results.append(T.amax(dim=1) if peak_only else T)
+        return torch.cat(results)
+
+
+class MultiCaseThermalModel(nn.Module):
+    """
+    多个 case 的 ChipletThermalModel 参数堆叠在一起, 在一个 batch 里同时前向/反向
+
+    chiplet 数不同的 case 补齐到 max(N): 补齐的 chiplet 功率为 0, mask 把它们的功率强制置零,
+    因此不贡献温度, 对应的 lx/ly 也不会收到梯度。batch 的每一行是某个 case 的一个布局,
+    由 case_index 指明所属的 case, 各 case 的网格坐标可以不同。
+    """
+    def __init__(self, num_chiplets):
+        """num_chiplets: 每个 case 的 chiplet 数"""
+        super().__init__()
+        self.num_chiplets = list(num_chiplets)
+        C, N = len(self.num_chiplets), max(self.num_chiplets)
+        self.N = N
+
+        self.A = nn.Parameter(torch.ones(C))
+        self.a = nn.Parameter(torch.ones(C))
+        self.B = nn.Parameter(torch.zeros(C))
+        self.lx = nn.Parameter(torch.ones(C, N))
+        self.ly = nn.Parameter(torch.ones(C, N))
+        self.register_buffer('mask', torch.arange(N) < torch.tensor(self.num_chiplets).view(-1, 1))
+
+    def forward(self, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power, case_index):
+        """
+        x, y: shape (B, grid*grid) - 每行所属 case 的坐标位置
+        chiplets_*: shape (B, N) - 补齐到 max(N) 的 chiplet 参数
+        case_index: shape (B,) - 每行所属的 case 下标
+        """
+        return ChipletContribution.apply(x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height,
+                                         chiplets_power * self.mask[case_index],
+                                         self.lx[case_index], self.ly[case_index], self.a[case_index].view(-1, 1),
+                                         self.A[case_index].view(-1, 1), self.B[case_index].view(-1, 1))
+
+    def chunk_size(self, cells, memory_budget, element_size=4):
+        """在 memory_budget 字节内一次反向最多能处理的行数"""
+        return max(1, int(memory_budget // (_BACKWARD_TEMPORARIES * self.N * cells * element_size)))
+
+    def case_state_dict(self, c):
+        """第 c 个 case 的参数, 格式与 ChipletThermalModel.state_dict() 相同"""
+        N = self.num_chiplets[c]
+        return {'A': self.A[c:c+1].detach().clone(), 'a': self.a[c:c+1].detach().clone(),
+                'B': self.B[c:c+1].detach().clone(), 'lx': self.lx[c, :N].detach().clone(),
+                'ly': self.ly[c, :N].detach().clone()}
+
+    @torch.no_grad()
+    def load_case_state_dict(self, c, state_dict):
+        """用 ChipletThermalModel 的 state_dict 初始化第 c 个 case"""
+        N = self.num_chiplets[c]
+        self.A[c] = state_dict['A'][0]
+        self.a[c] = state_dict['a'][0]
+        self.B[c] = state_dict['B'][0]
+        self.lx[c, :N] = state_dict['lx']
+        self.ly[c, :N] = state_dict['ly']
+
+
+class IncrementalThermalEvaluator:
+    """
+    单个布局的增量温度评估器, 供 MaskPlace / 模拟退火等逐个移动 chiplet 的 placer 使用
+
+    保存当前温度图和每个 chiplet 的贡献 (N, grid*grid)。移动、缩放或修改某个 chiplet 的功率时
+    只重新计算这一个 chiplet: T' = T - contrib[i] + new_i, 代价为 O(grid*grid) 而不是 O(N*grid*grid)。
+    每次 propose() 之后调用 commit() 接受或 revert() 放弃。
+    """
+    def __init__(self, model, x, y, chiplets_x, chiplets_y, chiplets_width, chiplets_height, chiplets_power,
+                 env_temperature=0.0, refresh_every=1000):
+        """
+        x, y: shape (grid*grid,) or (1, grid*grid) - 坐标位置
+        chiplets_*: shape (N,) or (1, N) - 初始布局
+        env_temperature: 加到温度图上的环境温度
+        refresh_every: 每提交多少次后整体重算一次, 消除累计的浮点误差
+        """
+        self.model = model
+        self.x = x.reshape(1, -1)
+        self.y = y.reshape(1, -1)
+        # 行: x, y, width, height, power
+        self.chiplets = torch.stack([t.reshape(-1) for t in (chiplets_x, chiplets_y, chiplets_width,
+                                                             chiplets_height, chiplets_power)]).clone()
+        self.env_temperature = env_temperature
+        self.refresh_every = refresh_every
+        self._pending = None
+        self.refresh()
+
+    @torch.no_grad()
+    def refresh(self):
+        """按当前布局整体重算所有 chiplet 的贡献和温度图"""
+        self.contrib = self.model.chiplet_response(self.x, self.y, *self.chiplets.unsqueeze(1))[0]
+        self.temperature = self.contrib.sum(dim=0) + self.env_temperature
+        self._commits = 0
+
+    @torch.no_grad()
+    def propose(self, i, x=None, y=None, width=None, height=None, power=None):
+        """
+        试探性地修改第 i 个 chiplet, 返回修改后的温度图 (grid*grid,)
+        未给出的量保持不变; 未提交的上一次 propose 会被丢弃
+        """
+        params = self.chiplets[:, i].clone()
+        for row, value in enumerate((x, y, width, height, power)):
+            if value is not None:
+                params[row] = value
+        term = self.model.chiplet_response(self.x, self.y, *params.view(5, 1, 1), index=[i])[0, 0]
+        temperature = self.temperature - self.contrib[i] + term
+        self._pending = (i, params, term, temperature)
+        return temperature
+
+    def commit(self):
+        """接受最近一次 propose 的修改"""
+        if self._pending is None:
+            raise RuntimeError("No pending move to commit")
+        i, params, term, temperature = self._pending
+        self.chiplets[:, i] = params
+        self.contrib[i] = term
+        self.temperature = temperature
+        self._pending = None
+        self._commits += 1
+        if self._commits >= self.refresh_every:
+            self.refresh()
+
+    def revert(self):
+        """放弃最近一次 propose 的修改"""
+        self._pending = None
+
+    def peak(self):
+        """当前 (已提交) 布局的最高温度"""
+        return self.temperature.max().item()
@@ -0,0 +1,346 @@
+"""
+HotSpot 网格模型的 NumPy/SciPy 实现: 按 LAYER_STACK 和 new_hotspot.config 建立三维网格热导网络并求稳态温度,
+没有 thermal/hotspot 可执行文件的环境也能生成 .grid.steady
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+from Thermal import LAYER_STACK, MAT_C4, MAT_TSV, MAT_UBUMP, SILICON, UNDERFILL
+
+
+def _resistivity(material: str) -> float:
+    """flp 行末材料串 (比热容, 热阻率) 中的热阻率"""
+    return float(material.split()[1])
+
+
+# 整层只有一种材料且在 flp 中覆盖了 LAYER_STACK 默认值的层 (见 Thermal.gen_case_files)
+UNIFORM_MATERIALS = {1: MAT_C4, 2: MAT_TSV}
+# 布局层中 (边缘, chiplet) 的材料, 其余为空白填充的 UNDERFILL (见 Thermal.gen_flp)
+LAYOUT_MATERIALS = {3: (MAT_UBUMP, MAT_UBUMP), 4: (MAT_UBUMP, SILICON)}
+POWER_LAYER = 4
+# HotSpot 的 -grid_steady_file 输出的是第 0 层 (基板) 的网格温度
+OUTPUT_LAYER = 0
+# LAYER_STACK 之后的两层: spreader, sink
+SPREADER, SINK = len(LAYER_STACK), len(LAYER_STACK) + 1
+N_EXTRA = 12  # spreader / sink 超出芯片部分的外围节点, 与 HotSpot 的 inode_0 ~ inode_11 对应
+# spreader / sink 层四边 (W, E, N, S) 的单元 (行 0 在 y = 0 处) 及连接外围节点所用热阻的方向 (0: x, 1: y)
+SIDES = ((np.s_[:, 0], 0), (np.s_[:, -1], 0), (np.s_[-1, :], 1), (np.s_[0, :], 1))
+
+
+def read_hotspot_config(path: str) -> Dict[str, str]:
+    """读取 hotspot.config 中的 "-参数名 值" 行"""
+    config = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].startswith('-'):
+                config[parts[0][1:]] = parts[1]
+    return config
+
+
+def _overlap(lo: np.ndarray, hi: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """区间 [lo, hi] 与网格区间 [edges[k], edges[k+1]] 的重叠长度, (N, len(edges) - 1)"""
+    return np.clip(np.minimum(hi[:, None], edges[None, 1:]) - np.maximum(lo[:, None], edges[None, :-1]), 0, None)
+
+
+class GridThermalSolver():
+    '''
+    稳态网格热模型, 结构与 HotSpot 的 grid 模型 (-model_type grid -detailed_3D on) 相同:
+    LAYER_STACK 的 6 层加上 spreader 和 sink 两层, 每层 grid_rows x grid_cols 个单元; spreader/sink 超出芯片的部分
+    是 12 个外围节点, sink 底面和外围节点经对流热阻接环境温度。单元的热导率按其中各材料的面积加权, chiplet 功率按面积分到单元
+
+    用稀疏 LU (SuperLU) 直接求解。同一个中介层尺寸和 config 下网络的稀疏结构固定, 只有布局层的数值随布局变化:
+    第一次分解时记下 SuperLU 算出的消元顺序并按它重排矩阵结构, 之后的布局复用这个顺序, 但每个布局仍要做一次完整的
+    数值 LU 分解; 只有热导率与上一次完全相同 (只有功率变化) 时才直接复用上一次的分解
+    '''
+    def __init__(self, config_path, intp_width, intp_height, granularity):
+        '''
+        config_path: new_hotspot.config (Thermal_solver.gen_case_files 生成, spreader/sink 尺寸已按中介层调整)
+        intp_width, intp_height, granularity: 单位 mm, 与 Thermal_solver 相同
+        '''
+        config = read_hotspot_config(config_path)
+        self.rows, self.cols = int(config['grid_rows']), int(config['grid_cols'])
+        self.ambient = float(config['ambient'])
+        self.width, self.height = intp_width / 1000, intp_height / 1000
+        self.granularity = granularity / 1000
+        self.factorizations = self.solves = 0
+        self._elimination = None  # 消元顺序, 第一次分解后确定
+        self._k = self._solve = None
+
+        self.cw, self.ch = self.width / self.cols, self.height / self.rows
+        self.x_edges = np.linspace(0, self.width, self.cols + 1)
+        self.y_edges = np.linspace(0, self.height, self.rows + 1)
+        n_layers = len(LAYER_STACK) + 2
+        self.thickness = np.array([float(layer[6]) for layer in LAYER_STACK] +
+                                  [float(config['t_spreader']), float(config['t_sink'])])
+        # 与布局无关的层的热导率
+        self.k_base = np.empty((n_layers, self.rows, self.cols))
+        for layer, _, _, _, _, resistivity, _, _ in LAYER_STACK:
+            self.k_base[layer] = 1 / _resistivity(UNIFORM_MATERIALS.get(layer, '0 ' + resistivity))
+        self.k_base[SPREADER] = float(config['k_spreader'])
+        self.k_base[SINK] = float(config['k_sink'])
+
+        self._package(config)
+        self._pattern()
+
+    def _package(self, config):
+        '''spreader / sink 外围节点及对流热阻, 公式与 HotSpot 的 package 模型相同'''
+        w, h = self.width, self.height
+        s_sp, t_sp, k_sp = float(config['s_spreader']), float(config['t_spreader']), float(config['k_spreader'])
+        s_hs, t_hs, k_hs = float(config['s_sink']), float(config['t_sink']), float(config['k_sink'])
+        r_convec = float(config['r_convec'])
+        getr = lambda k, length, area: length / (k * area)
+        self.r_sp1 = (getr(k_sp, (s_sp - w) / 4, (s_sp + 3*h) / 4 * t_sp), getr(k_sp, (s_sp - h) / 4, (s_sp + 3*w) / 4 * t_sp))
+        self.r_hs1 = (getr(k_hs, (s_sp - w) / 4, (s_sp + 3*h) / 4 * t_hs), getr(k_hs, (s_sp - h) / 4, (s_sp + 3*w) / 4 * t_hs))
+        r_hs2 = (getr(k_hs, (s_sp - w) / 4, (3*s_sp + h) / 4 * t_hs), getr(k_hs, (s_sp - h) / 4, (3*s_sp + w) / 4 * t_hs))
+        r_hs = getr(k_hs, (s_hs - s_sp) / 4, (s_hs + 3*s_sp) / 4 * t_hs)
+        per_area = ((s_sp + h) * (s_sp - w) / 4, (s_sp + w) * (s_sp - h) / 4)
+        r_sp_per = tuple(getr(k_sp, t_sp, a) for a in per_area)
+        r_hs_c_per = tuple(getr(k_hs, t_hs, a) for a in per_area)
+        r_amb_c_per = tuple(r_convec * s_hs * s_hs / a for a in per_area)
+        outer_area = (s_hs * s_hs - s_sp * s_sp) / 4
+        r_hs_per, r_amb_per = getr(k_hs, t_hs, outer_area), r_convec * s_hs * s_hs / outer_area
+        # sink 中心部分每个单元到环境的对流热阻 (按面积分摊)
+        self.r_amb = r_convec * s_hs * s_hs / (self.cw * self.ch)
+
+        # 外围节点编号: spreader W/E/N/S, sink 内圈 W/E/N/S, sink 外圈 W/E/N/S
+        base = (len(LAYER_STACK) + 2) * self.rows * self.cols
+        self.n_nodes = base + N_EXTRA
+        self.sp_nodes = base + np.arange(4)
+        self.hs_c_nodes = base + 4 + np.arange(4)
+        hs_nodes = base + 8 + np.arange(4)
+        xy = (0, 0, 1, 1)  # W/E 用 x 方向的热阻, N/S 用 y 方向
+        self.extra_pairs = [(sp, c, 1 / r_sp_per[d]) for sp, c, d in zip(self.sp_nodes, self.hs_c_nodes, xy)]
+        self.extra_pairs += [(c, o, 1 / (r_hs2[d] + r_hs)) for c, o, d in zip(self.hs_c_nodes, hs_nodes, xy)]
+        self.extra_ambient = [(c, 1 / (r_hs_c_per[d] + r_amb_c_per[d])) for c, d in zip(self.hs_c_nodes, xy)]
+        self.extra_ambient += [(o, 1 / (r_hs_per + r_amb_per)) for o in hs_nodes]
+
+    def _pattern(self, position=None):
+        '''
+        固定的稀疏结构: 所有节点对 (i, j) 和对角线, 以及它们在 CSC 数据数组中的位置
+        position: 可选, 节点在重排后矩阵中的行/列号
+        '''
+        n_layers = len(LAYER_STACK) + 2
+        self.index = np.arange(n_layers * self.rows * self.cols).reshape(n_layers, self.rows, self.cols)
+        idx = self.index
+        pairs = [(idx[:, :, :-1], idx[:, :, 1:]), (idx[:, :-1, :], idx[:, 1:, :]), (idx[:-1], idx[1:])]
+        for layer, nodes in ((SPREADER, self.sp_nodes), (SINK, self.hs_c_nodes)):
+            for node, (cells, _) in zip(nodes, SIDES):
+                pairs.append((idx[layer][cells], np.full(idx[layer][cells].shape, node)))
+        pairs.append((np.array([p[0] for p in self.extra_pairs]), np.array([p[1] for p in self.extra_pairs])))
+        i = np.concatenate([a.ravel() for a, _ in pairs])
+        j = np.concatenate([b.ravel() for _, b in pairs])
+        self.pairs = (i, j)
+        diag = np.arange(self.n_nodes)
+        rows = np.concatenate([i, j, diag])
+        cols = np.concatenate([j, i, diag])
+        if position is not None:
+            rows, cols = position[rows], position[cols]
+        # 数据为条目序号 + 1, 转成 CSC 后即可得到每个 CSC 位置对应的条目 (没有重复条目)
+        pattern = sp.csc_matrix((np.arange(1, len(rows) + 1, dtype=np.float64), (rows, cols)),
+                                shape=(self.n_nodes, self.n_nodes))
+        pattern.sort_indices()
+        self._matrix = pattern
+        self._order = pattern.data.astype(np.int64) - 1
+
+    def conductivity(self, x, y, width, height):
+        '''
+        各层单元的热导率 (层数, rows, cols), 以及各 chiplet 在各单元中的面积占比 (N, rows, cols)
+        x, y 为 chiplet 中心坐标, 单位 mm (与 Thermal_solver.set_pos 相同)
+        '''
+        g = self.granularity
+        w, h = self.width, self.height
+        # 与 Thermal.gen_flp 相同的四条边缘
+        edges = np.array([(g/2, 0, w - g, g/2), (g/2, h - g/2, w - g, g/2), (0, 0, g/2, h), (w - g/2, 0, g/2, h)])
+        chips = np.stack([(x - width/2) / 1000, (y - height/2) / 1000, width / 1000, height / 1000], axis=1)
+        rects = np.concatenate([edges, chips])
+        fx = _overlap(rects[:, 0], rects[:, 0] + rects[:, 2], self.x_edges) / self.cw
+        fy = _overlap(rects[:, 1], rects[:, 1] + rects[:, 3], self.y_edges) / self.ch
+        fraction = fy[:, :, None] * fx[:, None, :]
+        rest = np.clip(1 - fraction.sum(0), 0, None)
+        k = self.k_base.copy()
+        for layer, (edge_material, chip_material) in LAYOUT_MATERIALS.items():
+            k_rects = np.array([1 / _resistivity(edge_material)] * len(edges) + [1 / _resistivity(chip_material)] * len(chips))
+            k[layer] = np.tensordot(k_rects, fraction, axes=1) + rest / _resistivity(UNDERFILL)
+        return k, fraction[len(edges):]
+
+    def matrix(self, k):
+        '''热导矩阵 (CSC, 已确定消元顺序时按该顺序重排), 对角线包含到环境的热导; 稀疏结构对称, 数值不对称'''
+        t = self.thickness[:, None, None]
+        gx = k * self.ch * t / self.cw
+        gy = k * self.cw * t / self.ch
+        gz = k * self.cw * self.ch / t
+        # 同层相邻单元: 与 HotSpot 的 -detailed_3D 迭代相同, 单元 i 的方程中用相邻单元 j 自身的热导, 反之亦然,
+        # 所以材料不同的相邻单元之间矩阵不对称 (取两者的平均会使温度整体偏低约 1%);
+        # 第 n 层与第 n+1 层之间为第 n 层整层厚度的热阻, 两个方向相同
+        forward = [gx[:, :, 1:], gy[:, 1:, :], gz[:-1]]  # (i, j): i 的方程中 j 的系数
+        backward = [gx[:, :, :-1], gy[:, :-1, :], gz[:-1]]  # (j, i)
+        for layer, r1 in ((SPREADER, self.r_sp1), (SINK, self.r_hs1)):
+            for cells, d in SIDES:
+                # 边上每个单元分摊外围热阻: 半个单元的热阻 + 单元数 x 整条边的热阻
+                half = 1 / (gx, gy)[d][layer][cells] / 2
+                forward.append(1 / (half + len(half) * r1[d]))
+                backward.append(forward[-1])
+        forward.append(np.array([p[2] for p in self.extra_pairs]))
+        backward.append(forward[-1])
+        g_ij = np.concatenate([v.ravel() for v in forward])
+        g_ji = np.concatenate([v.ravel() for v in backward])
+
+        ambient = np.zeros(self.n_nodes)
+        ambient[self.index[SINK].ravel()] = 1 / (self.r_amb + 1 / gz[SINK].ravel())
+        for node, value in self.extra_ambient:
+            ambient[node] += value
+        diag = ambient + np.bincount(self.pairs[0], g_ij, self.n_nodes) + np.bincount(self.pairs[1], g_ji, self.n_nodes)
+        data = np.concatenate([-g_ij, -g_ji, diag])
+        A = self._matrix.copy()
+        A.data = data[self._order]
+        return A
+
+    def cell_share(self, fraction, width, height):
+        '''各 chiplet 的功率分到各单元的比例 (按面积), (N, rows, cols)'''
+        return fraction * (self.cw * self.ch * 1e6 / (width * height))[:, None, None]
+
+    def power_map(self, power, fraction, width, height):
+        '''chiplet 功率按面积分到芯片层的各单元, (rows, cols)'''
+        return np.tensordot(np.asarray(power, dtype=np.float64), self.cell_share(fraction, width, height), axes=1)
+
+    def solve(self, x, y, width, height, power):
+        '''
+        一个布局的稳态温度 (K), shape (层数, rows, cols), 行 0 在 y = 0 处 (与 ground_truth_store 一致)
+        x, y, width, height: chiplet 中心坐标和尺寸 (mm), power: 各 chiplet 功率 (W)
+        '''
+        x, y, width, height = (np.asarray(v, dtype=np.float64) for v in (x, y, width, height))
+        k, fraction = self.conductivity(x, y, width, height)
+        b = np.zeros(self.n_nodes)
+        b[self.index[POWER_LAYER].ravel()] = self.power_map(power, fraction, width, height).ravel()
+
+        if self._k is None or not np.array_equal(k, self._k):
+            self._factorize(k)
+        self.solves += 1
+        rise = self._solve(b)
+        return rise[:self.index.size].reshape(self.index.shape) + self.ambient
+
+    def responses(self, x, y, width, height, layer=OUTPUT_LAYER):
+        '''
+        每个 chiplet 单独耗散 1 W 时 layer 层的温升 (K/W), shape (N, rows, cols), 行 0 在 y = 0 处
+        稳态温升对功率是线性的, 任意功率下的温度为 ambient + tensordot(power, responses);
+        N 个右端项共用一次分解, 一次回代求出
+        '''
+        x, y, width, height = (np.asarray(v, dtype=np.float64) for v in (x, y, width, height))
+        k, fraction = self.conductivity(x, y, width, height)
+        b = np.zeros((self.n_nodes, len(x)))
+        b[self.index[POWER_LAYER].ravel()] = self.cell_share(fraction, width, height).reshape(len(x), -1).T
+
+        if self._k is None or not np.array_equal(k, self._k):
+            self._factorize(k)
+        self.solves += len(x)
+        rise = self._solve(b)
+        return rise[self.index[layer].ravel()].T.reshape(len(x), self.rows, self.cols)
+
+    def _factorize(self, k):
+        A = self.matrix(k)
+        options = {'diag_pivot_thresh': 0.0, 'options': {'SymmetricMode': True}}
+        if self._elimination is None:
+            # 消元顺序只依赖稀疏结构: 记下来并按它重排矩阵结构, 之后的分解不再计算排序 (数值分解照常进行)
+            lu = spla.splu(A, permc_spec='MMD_AT_PLUS_A', **options)
+            self._elimination = np.argsort(lu.perm_c)
+            self._pattern(lu.perm_c)
+            self._solve = lu.solve
+        else:
+            lu = spla.splu(A, permc_spec='NATURAL', **options)
+            order = self._elimination
+            def solve(b):
+                x = np.empty_like(b)
+                x[order] = lu.solve(b[order])
+                return x
+            self._solve = solve
+        self._k = k
+        self.factorizations += 1
+
+    def stats(self):
+        return {'solves': self.solves, 'factorizations': self.factorizations}
+
+
+def write_grid_steady(temperature: np.ndarray, path: str, layer: int = OUTPUT_LAYER):
+    """按 HotSpot 的 .grid.steady 格式写出一层的网格温度: 行 0 在芯片顶部, 每行 "下标\t温度", 每 grid_cols 行后空一行"""
+    grid = np.flipud(temperature[layer])
+    rows, cols = grid.shape
+    lines = []
+    for i in range(rows):
+        lines += [f"{i * cols + j}\t{grid[i, j]:.2f}\n" for j in range(cols)]
+        lines.append("\n")
+    with open(path, 'w') as f:
+        f.write(''.join(lines))
+
+
+_SOLVERS = {}
+
+def shared_solver(config_path: str, intp_width: float, intp_height: float, granularity: float) -> GridThermalSolver:
+    """
+    进程内按 (config 内容, 中介层尺寸, 粒度) 共用的求解器, 使同一网格的多个布局 (包括进程池中同一 worker 处理的布局)
+    共用消元顺序; 每个布局仍各做一次数值分解
+    """
+    with open(config_path) as f:
+        key = (f.read(), float(intp_width), float(intp_height), float(granularity))
+    if key not in _SOLVERS:
+        _SOLVERS[key] = GridThermalSolver(config_path, intp_width, intp_height, granularity)
+    return _SOLVERS[key]
+
+
+def compare_with_hotspot(case_name: str, layout_ids=None, dataset_dir: str = "dataset"):
+    """
+    用 dataset/{case_name} 中已有的 HotSpot 结果检验精度: 对每个有 .grid.steady 的布局求解并比较输出层的温度
+    返回 {布局 id: (平均误差, 最大绝对误差)} (K, 本求解器 - HotSpot)
+    """
+    from ground_truth_store import _sources, read_grid_steady
+    from layout_cache import load_case_layouts
+    from process_thermal import get_system_params
+    from Thermal import Thermal_solver
+
+    case = load_case_layouts(case_name)
+    sources = _sources(os.path.join(dataset_dir, case_name))
+    layout_ids = sorted(sources) if layout_ids is None else [idx for idx in layout_ids if idx in sources]
+    # 用 Thermal_solver 得到与 HotSpot 输入完全相同的尺寸取整和 new_hotspot.config, 用完即删
+    scratch = tempfile.mkdtemp(prefix="grid_solver_", dir=os.path.join(dataset_dir, case_name))
+    try:
+        thermal = Thermal_solver(os.path.join(scratch, ""))
+        thermal.set_params(get_system_params(os.path.join("cases", case_name)))
+        solver = GridThermalSolver(os.path.join(scratch, "new_hotspot.config"), thermal.intp_width,
+                                   thermal.intp_height, thermal.granularity)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    errors = {}
+    start = time.time()
+    for idx in layout_ids:
+        layout = case.layouts[case.rows([idx])[0]].astype(np.float64)
+        thermal.set_pos(case.power, layout[:, :2].transpose(), layout[:, 2], layout[:, 3])
+        temperature = solver.solve(thermal.x, thermal.y, thermal.width, thermal.height, thermal.power)
+        diff = temperature[OUTPUT_LAYER] - read_grid_steady(sources[idx], solver.rows)
+        errors[idx] = (float(diff.mean()), float(np.abs(diff).max()))
+    elapsed = time.time() - start
+    if errors:
+        bias, worst = np.array(list(errors.values())).T
+        print(f"{case_name}: {len(errors)} layouts, mean error {bias.mean():+.3f} K, "
+              f"max |error| {worst.max():.3f} K, {elapsed / len(errors):.3f} s/layout, {solver.stats()}")
+    return errors
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="all", help='case number, or "all" for Case1-Case10')
+    arg.add_argument('--layouts', type=int, default=None, help='Only compare the first N layouts with HotSpot results')
+    args = arg.parse_args()
+
+    case_names = [f"Case{idx}" for idx in range(1, 11)] if args.case == 'all' else [f"Case{args.case}"]
+    for case_name in case_names:
+        compare_with_hotspot(case_name, range(1, args.layouts + 1) if args.layouts else None)
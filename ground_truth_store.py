@@ -0,0 +1,100 @@
+"""HotSpot 稳态结果的二进制缓存: 每个 case 一个 float32 数组文件, 训练/测试时 memory-map 读取"""
+
+import argparse
+import os
+import re
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+GRID = 64
+STORE_NAME = "ground_truth.npy"        # (布局数, grid, grid), 已 flipud, 与训练时的布局一致
+INDEX_NAME = "ground_truth_index.npy"  # 第 k 行对应的布局 id
+_SOURCE_PATTERN = re.compile(r"gen_dataset_(\d+)\.grid\.steady$")
+
+
+def _sources(case_dir: str) -> Dict[int, str]:
+    """case 目录下所有 HotSpot 稳态结果, {布局 id: 路径}"""
+    sources = {}
+    for entry in os.scandir(case_dir):
+        match = _SOURCE_PATTERN.match(entry.name)
+        if match:
+            sources[int(match.group(1))] = entry.path
+    return sources
+
+
+def read_grid_steady(path: str, grid: int = GRID) -> np.ndarray:
+    """
+    读取一个 .grid.steady 文件 (每行 "下标 温度", 每 grid 行之间有空行)
+    与 np.flipud(np.loadtxt(path, usecols=[1]).reshape(grid, grid)) 结果相同
+    """
+    with open(path) as f:
+        values = np.array(f.read().split(), dtype=np.float64)[1::2]
+    return np.flipud(values.reshape(grid, grid))
+
+
+def _is_stale(case_dir: str, sources: Dict[int, str]) -> bool:
+    """缓存不存在、布局集合变化或任一源文件比缓存新时需要重建"""
+    store_path = os.path.join(case_dir, STORE_NAME)
+    index_path = os.path.join(case_dir, INDEX_NAME)
+    if not (os.path.exists(store_path) and os.path.exists(index_path)):
+        return True
+    store_mtime = min(os.path.getmtime(store_path), os.path.getmtime(index_path))
+    if set(np.load(index_path).tolist()) != set(sources):
+        return True
+    return any(os.path.getmtime(path) > store_mtime for path in sources.values())
+
+
+def build_ground_truth_store(case_name: str, dataset_dir: str = "dataset", grid: int = GRID) -> str:
+    """把 dataset/{case_name} 下所有 .grid.steady 转成一个 float32 数组文件及其索引, 返回数组文件路径"""
+    case_dir = os.path.join(dataset_dir, case_name)
+    sources = _sources(case_dir)
+    ids = np.array(sorted(sources), dtype=np.int32)
+    temperature = np.empty((len(ids), grid, grid), dtype=np.float32)
+    for row, idx in enumerate(ids):
+        temperature[row] = read_grid_steady(sources[idx], grid)
+
+    # 先写临时文件再替换, 中途中断不会留下不完整的缓存
+    store_path = os.path.join(case_dir, STORE_NAME)
+    index_path = os.path.join(case_dir, INDEX_NAME)
+    np.save(store_path + ".tmp.npy", temperature)
+    np.save(index_path + ".tmp.npy", ids)
+    os.replace(store_path + ".tmp.npy", store_path)
+    os.replace(index_path + ".tmp.npy", index_path)
+    print(f"Built {store_path}: {len(ids)} layouts")
+    return store_path
+
+
+def open_ground_truth(case_name: str, dataset_dir: str = "dataset",
+                      grid: int = GRID) -> Tuple[np.ndarray, Dict[int, int]]:
+    """
+    memory-map 一个 case 的温度缓存, 缓存过期时自动重建
+    返回 (temperature, index): temperature 为只读的 (布局数, grid, grid) float32 数组, index 为 {布局 id: 行号}
+    """
+    case_dir = os.path.join(dataset_dir, case_name)
+    if _is_stale(case_dir, _sources(case_dir)):
+        build_ground_truth_store(case_name, dataset_dir, grid)
+    temperature = np.load(os.path.join(case_dir, STORE_NAME), mmap_mode='r')
+    ids = np.load(os.path.join(case_dir, INDEX_NAME))
+    return temperature, {int(idx): row for row, idx in enumerate(ids)}
+
+
+def load_ground_truth(case_name: str, layout_ids: Iterable[int], dataset_dir: str = "dataset",
+                      grid: int = GRID) -> np.ndarray:
+    """按布局 id 取出温度图, 返回 shape (len(layout_ids), grid, grid) 的 float32 数组"""
+    temperature, index = open_ground_truth(case_name, dataset_dir, grid)
+    return temperature[[index[idx] for idx in layout_ids]]
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="all", help='case number, or "all" for Case1-Case10')
+    arg.add_argument('--force', action='store_true', help='Rebuild even if the store is up to date')
+    args = arg.parse_args()
+
+    case_names = [f"Case{idx}" for idx in range(1, 11)] if args.case == 'all' else [f"Case{args.case}"]
+    for case_name in case_names:
+        if args.force:
+            build_ground_truth_store(case_name)
+        else:
+            open_ground_truth(case_name)
@@ -0,0 +1,114 @@
+"""把一个 case 的所有 .pl 布局连同 .power / .intpsize 一次解析成紧凑数组, 缓存在 cache/ 下"""
+
+import argparse
+import os
+import re
+from typing import Dict, Iterable, List, NamedTuple
+
+import numpy as np
+
+from process_thermal import parse_intpsize_file, parse_power_file
+
+CACHE_DIR = "cache"
+# layouts 最后一维的含义, 单位 um, 与 parse_pl_file 相同 (中心坐标)
+LAYOUT_FIELDS = ("center_x", "center_y", "width", "height")
+
+
+class CaseLayouts(NamedTuple):
+    names: List[str]          # chiplet 名字, 所有布局共用这个顺序
+    layout_ids: np.ndarray    # (L,) int32, 第 k 行对应的布局 id (CaseK_{id}.pl)
+    layouts: np.ndarray       # (L, N, 4) float32, 见 LAYOUT_FIELDS
+    power: np.ndarray         # (N,) float64, 与 names 顺序一致, .power 中没有的 chiplet 为 0
+    intpsize: float           # 中介层边长 (um)
+
+    def rows(self, layout_ids: Iterable[int]) -> np.ndarray:
+        """布局 id 对应的行号"""
+        index = {int(idx): row for row, idx in enumerate(self.layout_ids)}
+        return np.array([index[idx] for idx in layout_ids], dtype=np.int64)
+
+
+def _pl_files(case_dir: str, case_name: str) -> Dict[int, str]:
+    """case 目录下所有布局文件, {布局 id: 路径}"""
+    pattern = re.compile(re.escape(case_name) + r"_(\d+)\.pl$")
+    files = {}
+    for entry in os.scandir(case_dir):
+        match = pattern.match(entry.name)
+        if match:
+            files[int(match.group(1))] = entry.path
+    return files
+
+
+def _parse_pl(pl_path: str):
+    """解析一个 .pl 文件, 返回 (名字列表, (N, 4) 数组); 数值与 parse_pl_file 相同"""
+    names, rows = [], []
+    with open(pl_path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            x, y, w, h = float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])
+            names.append(parts[0])
+            rows.append((x + w/2, y + h/2, w, h))
+    return names, np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+
+def build_case_layouts(case_name: str, cases_dir: str = "cases") -> CaseLayouts:
+    """解析一个 case 的所有布局; chiplet 顺序以 id 最小的布局为准, 其余布局按名字重排"""
+    case_dir = os.path.join(cases_dir, case_name)
+    pl_files = _pl_files(case_dir, case_name)
+    layout_ids = np.array(sorted(pl_files), dtype=np.int32)
+    names, layouts = None, []
+    for idx in layout_ids:
+        chip_names, rows = _parse_pl(pl_files[idx])
+        if names is None:
+            names, order = chip_names, {name: i for i, name in enumerate(chip_names)}
+        elif chip_names != names:
+            if sorted(chip_names) != sorted(names):
+                raise ValueError(f"{pl_files[idx]}: chiplets differ from {case_name}_{layout_ids[0]}.pl")
+            rows = rows[np.argsort([order[name] for name in chip_names])]
+        layouts.append(rows)
+
+    powers = parse_power_file(os.path.join(case_dir, f"{case_name}.power"))
+    intpsize, _ = parse_intpsize_file(os.path.join(case_dir, f"{case_name}.intpsize"))
+    return CaseLayouts(names, layout_ids, np.array(layouts, dtype=np.float32).reshape(len(layout_ids), -1, 4),
+                       np.array([powers.get(name, 0.0) for name in names], dtype=np.float64), intpsize)
+
+
+def _sources_mtime(case_dir: str, case_name: str, pl_files: Dict[int, str]) -> float:
+    sources = list(pl_files.values()) + [os.path.join(case_dir, f"{case_name}.power"),
+                                         os.path.join(case_dir, f"{case_name}.intpsize")]
+    return max(os.path.getmtime(path) for path in sources)
+
+
+def load_case_layouts(case_name: str, cases_dir: str = "cases", cache_dir: str = CACHE_DIR) -> CaseLayouts:
+    """
+    读取一个 case 的全部布局, 优先使用 cache/{case_name}_layouts.npz
+    缓存不存在、布局集合变化或任一 .pl/.power/.intpsize 比缓存新时重新解析并写回缓存
+    """
+    case_dir = os.path.join(cases_dir, case_name)
+    cache_path = os.path.join(cache_dir, f"{case_name}_layouts.npz")
+    pl_files = _pl_files(case_dir, case_name)
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= _sources_mtime(case_dir, case_name, pl_files):
+        with np.load(cache_path) as cached:
+            if set(cached["layout_ids"].tolist()) == set(pl_files):
+                return CaseLayouts(cached["names"].tolist(), cached["layout_ids"], cached["layouts"],
+                                   cached["power"], float(cached["intpsize"]))
+
+    case = build_case_layouts(case_name, cases_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 先写临时文件再替换, 中途中断不会留下不完整的缓存
+    np.savez(cache_path + ".tmp.npz", names=np.array(case.names), layout_ids=case.layout_ids,
+             layouts=case.layouts, power=case.power, intpsize=case.intpsize)
+    os.replace(cache_path + ".tmp.npz", cache_path)
+    return case
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="all", help='case number, or "all" for Case1-Case10')
+    args = arg.parse_args()
+
+    case_names = [f"Case{idx}" for idx in range(1, 11)] if args.case == 'all' else [f"Case{args.case}"]
+    for case_name in case_names:
+        case = load_case_layouts(case_name)
+        print(f"{case_name}: {len(case.layout_ids)} layouts x {len(case.names)} chiplets")
@@ -0,0 +1,290 @@
+"""
+HotSpot 生成、紧凑模型训练和测试的流水线: HotSpot worker 每完成一个布局就把结果放进有界队列,
+训练在第一个训练布局到达后立即开始, 之后每到达一批新数据就在全部已到达的数据上继续优化;
+测试布局一到达就用当前模型计算误差, 全部结束后用最终模型重新计算并写出与 test() 相同格式的指标 CSV
+
+这样一个新 case 从开始仿真到得到可用模型的时间接近单纯的仿真时间, 而不是仿真、训练、测试三段之和
+"""
+
+import argparse
+import csv
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+
+from compact_themal_model import ChipletThermalModel
+from ground_truth_store import read_grid_steady
+from gf_layer4_tool import compute_metrics
+from layout_cache import load_case_layouts
+from process_thermal import generate_layout, prepare_case_files
+from train_compact_themal_model import chunked_backward, device, fit_varpro, grid, layout_inputs
+
+ENV_TMP_K = 45 + 273.15  # 环境温度 (K), 与 train() 相同
+DONE = None              # produce 放在队列末尾的结束标记
+
+
+def produce(case_name, layout_ids, results, workers=None, cache_dir=None, cache_size=2**30, solver='hotspot'):
+    """
+    在进程池中生成布局并把 (布局 id, 温度图 (grid, grid) float32) 按完成顺序放进 results, 最后放入 DONE
+    dataset/ 中已有结果的布局直接读取, 不再仿真; 布局按 layout_ids 的顺序提交 (训练布局应排在前面)
+    results 为有界队列时, 训练跟不上会使这里阻塞, 内存中最多保留队列长度个结果;
+    因此有界队列须由另一个线程消费 (见 run_pipeline、iter_results), 只有无界队列可以在同一线程里先生产后读取
+    返回失败的 (布局 id, 错误信息)
+    """
+    case = load_case_layouts(case_name)
+    output_dir = f"./dataset/{case_name}"
+    os.makedirs(os.path.join(output_dir, ".scratch"), exist_ok=True)
+    case_path = prepare_case_files(case_name, output_dir)
+    grid_steady = lambda idx: os.path.join(output_dir, f"gen_dataset_{idx}.grid.steady")
+    failures = []
+    try:
+        pending = []
+        for idx in layout_ids:
+            if os.path.exists(grid_steady(idx)):
+                results.put((idx, read_grid_steady(grid_steady(idx), grid).astype(np.float32)))
+            else:
+                pending.append(idx)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(generate_layout, case_name, idx, case.power,
+                                   case.layouts[case.rows([idx])[0]].astype(np.float64),
+                                   cache_dir, cache_size, solver, case_path): idx for idx in pending}
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    future.result()
+                    results.put((idx, read_grid_steady(grid_steady(idx), grid).astype(np.float32)))
+                except Exception as e:
+                    failures.append((idx, str(e)))
+                    print(f"{case_name}:{idx} failed: {e}")
+    finally:
+        try:
+            os.rmdir(os.path.join(output_dir, ".scratch"))
+        except OSError:
+            pass
+        results.put(DONE)
+    return failures
+
+
+def iter_results(results):
+    """逐个取出 produce 放进队列的 (布局 id, 温度图), 直到 DONE; 在 produce 之外的线程中调用"""
+    while (item := results.get()) is not DONE:
+        yield item
+
+
+def _receive(results, block):
+    """取出队列中所有已到达的结果; block 为 True 时至少等到一个"""
+    items = []
+    try:
+        items.append(results.get(block=block))
+        while True:
+            items.append(results.get_nowait())
+    except queue.Empty:
+        pass
+    return items
+
+
+class StreamingTrainer():
+    '''
+    在不断增长的训练集上增量训练 ChipletThermalModel
+    adam: 与 train() 相同的 Adam 和学习率计划 (milestones), 每轮 steps_per_round 步; 训练集到齐之前的轮次只是预热,
+        用初始学习率且不计入步数, 到齐之后才开始计 steps 总步数、学习率计划和 patience 早停,
+        这样后到达的布局不会因为步数已用完而得不到训练;
+    varpro: 每到达一批新数据用 fit_varpro 从当前参数继续拟合一轮, 数据未到齐时每轮最多 varpro_round_steps 步,
+        到齐后拟合到收敛
+    '''
+    def __init__(self, case, solver='adam', steps=10000, steps_per_round=50, varpro_round_steps=5, patience=None,
+                 min_delta=1e-6, memory_budget=None, milestones=(200,)):
+        self.case = case
+        self.solver = solver
+        self.steps, self.steps_per_round, self.varpro_round_steps = steps, steps_per_round, varpro_round_steps
+        self.patience, self.min_delta, self.memory_budget = patience, min_delta, memory_budget
+        self.model = ChipletThermalModel(len(case.names)).to(device)
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=0.1)
+        self.scheduler = torch.optim.lr_scheduler.MultiStepLR(self.optimizer, milestones=list(milestones), gamma=0.1)
+        self.step = self.warmup_steps = self.rounds = 0
+        self.best_loss, self.stale_steps = float('inf'), 0
+        self.converged = False
+        self.ids, self.targets = [], []
+        self.data = None
+
+    def add(self, idx, temperature):
+        self.ids.append(idx)
+        self.targets.append(temperature.reshape(-1))
+        self.data = None
+        # 新数据可能改变最优解, varpro 需要重新拟合
+        self.converged = False
+
+    def _inputs(self):
+        if self.data is None:
+            x_input, y_input, chiplets = layout_inputs(self.case, self.ids)
+            target = torch.tensor(np.stack(self.targets), device=device)
+            self.data = (x_input, y_input, chiplets, target)
+        return self.data
+
+    def refine(self, final=False):
+        '''在目前的训练集上优化一轮; final 表示训练集已经完整, 返回当前损失'''
+        x_input, y_input, chiplets, target = self._inputs()
+        self.rounds += 1
+        if self.solver == 'varpro':
+            # 在同一批数据上重复拟合没有意义, 等下一批数据到达 (add) 再继续
+            self.converged = True
+            return fit_varpro(self.model, x_input, y_input, chiplets, target, ENV_TMP_K, self.memory_budget,
+                              max_steps=200 if final else self.varpro_round_steps)
+        loss_fn = torch.nn.MSELoss()
+        for _ in range(self.steps_per_round):
+            self.optimizer.zero_grad()
+            if self.memory_budget is None:
+                loss = loss_fn(self.model(x_input, y_input, *chiplets, grid) + ENV_TMP_K, target)
+                loss.backward()
+            else:
+                loss = chunked_backward(self.model, x_input, y_input, chiplets, target, ENV_TMP_K, self.memory_budget)
+            self.optimizer.step()
+            if not final:
+                self.warmup_steps += 1
+                continue
+            # 步数、学习率计划和早停只在训练集完整之后计数, 之前损失会随新数据跳变
+            self.scheduler.step()
+            self.step += 1
+            if loss.item() < self.best_loss * (1 - self.min_delta):
+                self.best_loss, self.stale_steps = loss.item(), 0
+            else:
+                self.stale_steps += 1
+            if self.step >= self.steps:
+                break
+            if self.patience is not None and self.stale_steps >= self.patience:
+                self.converged = True
+                break
+        return loss.item()
+
+    @property
+    def exhausted(self):
+        '''在现有数据上已无事可做: adam 已在完整训练集上用完步数或早停, varpro 已在最新数据上拟合过'''
+        return self.converged or self.step >= self.steps
+
+    @torch.no_grad()
+    def predict(self, layout_ids):
+        '''当前模型对这些布局的温度图 (K), shape (len(layout_ids), grid, grid)'''
+        x_input, y_input, chiplets = layout_inputs(self.case, layout_ids)
+        T = self.model.predict(x_input, y_input, *chiplets, env_temperature=ENV_TMP_K)
+        return T.cpu().numpy().reshape(len(layout_ids), grid, grid)
+
+
+def run_pipeline(case_name, train_ids=range(1, 51), test_ids=range(51, 201), workers=None, queue_size=16,
+                 cache_dir=None, cache_size=2**30, simulator='hotspot', **trainer_args):
+    """
+    一个 case 的生成 + 训练 + 测试流水线
+    simulator: 'hotspot' 或 'grid' (见 Thermal_solver); trainer_args 传给 StreamingTrainer
+    返回 (model, {测试布局 id: 指标字典}), 指标由最终模型计算; 模型保存到 model/{case_name}_thermal_model.pth
+    """
+    case = load_case_layouts(case_name)
+    available = set(case.layout_ids.tolist())
+    train_ids = [idx for idx in train_ids if idx in available]
+    test_ids = [idx for idx in test_ids if idx in available and idx not in train_ids]
+    train_set = set(train_ids)
+
+    results = queue.Queue(maxsize=queue_size)
+    failures = []
+    producer = threading.Thread(target=lambda: failures.extend(
+        produce(case_name, train_ids + test_ids, results, workers, cache_dir, cache_size, simulator)), daemon=True)
+    start = time.time()
+    producer.start()
+
+    trainer = StreamingTrainer(case, **trainer_args)
+    test_truth = {}
+    done = False
+    while not (done and (not trainer.ids or trainer.exhausted)):
+        # 还能训练时不等待新数据, 否则阻塞到下一个结果到达
+        idle = not trainer.ids or trainer.exhausted
+        for item in _receive(results, block=idle and not done):
+            if item is DONE:
+                done = True
+                continue
+            idx, temperature = item
+            if idx in train_set:
+                trainer.add(idx, temperature)
+                continue
+            test_truth[idx] = temperature
+            if trainer.rounds:
+                mae = np.abs(trainer.predict([idx])[0] - temperature).mean()
+                print(f"[{time.time() - start:7.1f} s] test {idx}: MAE = {mae:.4f} K (model trained on "
+                      f"{len(trainer.ids)} layouts)")
+        if trainer.ids and not trainer.exhausted:
+            # 生成结束后不会再有新的训练布局 (其余的失败了)
+            final = done or len(trainer.ids) == len(train_ids)
+            loss = trainer.refine(final=final)
+            progress = ""
+            if trainer.solver == 'adam':
+                progress = f"step {trainer.step}, " if final else f"warm-up step {trainer.warmup_steps}, "
+            print(f"[{time.time() - start:7.1f} s] {len(trainer.ids)}/{len(train_ids)} training layouts, "
+                  f"{progress}loss = {loss:.6f}")
+    producer.join()
+    if not trainer.ids:
+        raise RuntimeError(f"{case_name}: no training layout could be simulated")
+    os.makedirs('model', exist_ok=True)
+    torch.save(trainer.model.state_dict(), f'model/{case_name}_thermal_model.pth')
+    print(f"{case_name}: model ready after {time.time() - start:.1f} s, saved to model/{case_name}_thermal_model.pth")
+
+    metrics = {}
+    ids = sorted(test_truth)
+    if ids:
+        predicted = trainer.predict(ids)
+        for k, idx in enumerate(ids):
+            metrics[idx] = compute_metrics(predicted[k] - 273.15, test_truth[idx].astype(np.float64) - 273.15)
+        write_metrics(case_name, metrics)
+        print(f"{case_name}: {len(ids)} test layouts, mean MAE = "
+              f"{np.mean([m['MAE'] for m in metrics.values()]):.4f} °C")
+    if failures:
+        print(f"{len(failures)} layouts failed: {sorted(idx for idx, _ in failures)}")
+    return trainer.model, metrics
+
+
+def write_metrics(case_name, metrics):
+    """与 train_compact_themal_model.test 相同格式的指标 CSV: tmp/compact_metrics_auto_test_{case_name}.csv"""
+    os.makedirs('tmp', exist_ok=True)
+    with open(os.path.join('tmp/', f"compact_metrics_auto_test_{case_name}.csv"), "w", newline="") as fcsv:
+        w = csv.writer(fcsv)
+        w.writerow(["sid", "MAE_C", "RMSE_C", "MAPE", "CORR", "PTE"])
+        rows = [(idx, m["MAE"], m["RMSE"], m["MAPE"], m["CORR"], m["PTE"]) for idx, m in sorted(metrics.items())]
+        w.writerows(rows)
+        if rows:
+            columns = np.array([r[1:] for r in rows], dtype=np.float64)
+            w.writerow(["mean", *np.mean(columns[:, :3], axis=0), np.nanmean(columns[:, 3]), np.mean(columns[:, 4])])
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="1", help='case number')
+    arg.add_argument('--train-layouts', type=int, default=50, help='Layouts 1..N are used for training')
+    arg.add_argument('--layouts', type=int, default=200, help='Total number of layouts; the rest are test layouts')
+    arg.add_argument('--workers', type=int, default=None, help='Number of simulation processes (default: CPU count)')
+    arg.add_argument('--queue-size', type=int, default=16, help='Finished layouts buffered between simulator and trainer')
+    arg.add_argument('--cache', type=str, default=None, help='Directory of a content-addressed HotSpot result cache')
+    arg.add_argument('--cache-size', type=int, default=1024, help='Size bound of the HotSpot cache in MiB')
+    arg.add_argument('--simulator', type=str, default='hotspot', choices=['hotspot', 'grid'],
+                     help='"grid" simulates with grid_solver.py instead of thermal/hotspot')
+    arg.add_argument('--solver', type=str, default='adam', choices=['adam', 'varpro'],
+                     help='adam: fixed-step Adam on all parameters; varpro: least-squares A/B + L-BFGS on a/lx/ly')
+    arg.add_argument('--steps', type=int, default=10000,
+                     help='Adam steps once all training layouts have arrived (earlier warm-up steps do not count)')
+    arg.add_argument('--steps-per-round', type=int, default=50, help='Adam steps between checks for new layouts')
+    arg.add_argument('--patience', type=int, default=None,
+                     help='Stop Adam training after this many steps without relative improvement of --min-delta')
+    arg.add_argument('--min-delta', type=float, default=1e-6, help='Relative loss improvement that resets --patience')
+    arg.add_argument('--lr-milestones', type=int, nargs='*', default=[200],
+                     help='Adam steps at which the learning rate is multiplied by 0.1 (default: 200)')
+    arg.add_argument('--memory-budget', type=int, default=None,
+                     help='Train in chunks that fit this many MiB of temporaries (default: full batch)')
+    args = arg.parse_args()
+    if args.simulator == 'grid' and args.cache is not None:
+        arg.error('--cache only applies to --simulator hotspot')
+
+    run_pipeline(f"Case{args.case}", range(1, args.train_layouts + 1), range(args.train_layouts + 1, args.layouts + 1),
+                 args.workers, args.queue_size, args.cache, args.cache_size * 2**20, args.simulator,
+                 solver=args.solver, steps=args.steps, steps_per_round=args.steps_per_round, patience=args.patience,
+                 min_delta=args.min_delta, milestones=args.lr_milestones,
+                 memory_budget=args.memory_budget * 2**20 if args.memory_budget is not None else None)
@@ -0,0 +1,246 @@
+"""
+固定布局下的功率扫描: 稳态温升对 chiplet 功率向量是线性的, 每个布局只需求一次各 chiplet 单独耗散 1 W 时的温度响应
+(N x grid*grid 的基), 之后任意多组功率场景都只是一次矩阵乘法
+
+基可以来自 HotSpot (每个 chiplet 一次 run_hotspot)、grid_solver (一次分解 + 一次多右端项回代) 或训练好的紧凑模型,
+缓存在 cache/power_basis/ 下, 布局变化 (或紧凑模型重新训练) 后自动重建
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from layout_cache import load_case_layouts
+from process_thermal import get_system_params
+from Thermal import HotspotCache, Thermal_solver
+
+GRID = 64
+BASIS_DIR = os.path.join("cache", "power_basis")
+SOURCES = ('hotspot', 'grid', 'compact')
+
+
+class PowerBasis(NamedTuple):
+    names: List[str]      # chiplet 名字, 与 CaseLayouts.names 顺序一致
+    basis: np.ndarray     # (N, grid*grid) float32, chiplet i 单独耗散 1 W 时的温升 (K/W), 网格行 0 在 y = 0 处
+    ambient: float        # 环境温度 (K)
+    layout: np.ndarray    # (N, 4) float32, 求基时的布局 (中心 x, 中心 y, 宽, 高, um)
+    source: str           # 'hotspot', 'grid' 或 'compact'
+
+    def temperature(self, power: np.ndarray) -> np.ndarray:
+        """功率场景 (S, N) 或 (N,) 下的温度图 (K), shape (S, grid, grid)"""
+        power = np.atleast_2d(np.asarray(power, dtype=np.float32))
+        grid = int(round(np.sqrt(self.basis.shape[1])))
+        return (power @ self.basis + self.ambient).reshape(len(power), grid, grid)
+
+    def peak(self, power: np.ndarray) -> np.ndarray:
+        """每个功率场景的最高温度 (K), shape (S,)"""
+        return self.temperature(power).reshape(len(np.atleast_2d(power)), -1).max(axis=1)
+
+
+def _thermal_solver(case_name: str, path: str, cache=None, solver='hotspot', case_path: str = None) -> Thermal_solver:
+    thermal = Thermal_solver(path, cache, solver, case_path)
+    thermal.set_params(get_system_params(os.path.join("cases", case_name)))
+    return thermal
+
+
+def _case_ambient(case_name: str, scratch: str) -> float:
+    """在 scratch 中生成 case 共用文件 (gen_case_files), 返回其 new_hotspot.config 中的环境温度 (K)"""
+    from grid_solver import read_hotspot_config
+    _thermal_solver(case_name, scratch)
+    return float(read_hotspot_config(scratch + "new_hotspot.config")['ambient'])
+
+
+def grid_basis(case_name: str, layout: np.ndarray, scratch: str) -> Tuple[np.ndarray, float]:
+    """用 grid_solver 求基: 与 HotSpot 相同的尺寸取整, 一次分解, N 个单位功率右端项一次回代"""
+    from grid_solver import GridThermalSolver, OUTPUT_LAYER
+    thermal = _thermal_solver(case_name, scratch)
+    solver = GridThermalSolver(scratch + "new_hotspot.config", thermal.intp_width, thermal.intp_height,
+                               thermal.granularity)
+    thermal.set_pos(np.zeros(len(layout)), layout[:, :2].transpose(), layout[:, 2], layout[:, 3])
+    response = solver.responses(thermal.x, thermal.y, thermal.width, thermal.height, OUTPUT_LAYER)
+    return response.reshape(len(layout), -1), solver.ambient
+
+
+def _hotspot_response(case_name: str, layout: np.ndarray, chiplet: int, probe: float, scratch_root: str,
+                      cache_dir: str = None) -> np.ndarray:
+    """
+    只有 chiplet 耗散 probe W 时 HotSpot 输出层的温度 (K), (grid*grid,), 在独立的临时目录中运行
+    scratch_root 中须已有 gen_case_files 生成的 case 共用文件 (见 hotspot_basis), 各 chiplet 直接引用
+    """
+    from ground_truth_store import read_grid_steady
+    scratch = tempfile.mkdtemp(prefix=f"chiplet_{chiplet}_", dir=scratch_root)
+    try:
+        cache = HotspotCache.shared(cache_dir) if cache_dir is not None else None
+        thermal = _thermal_solver(case_name, os.path.join(scratch, ""), cache, case_path=scratch_root)
+        power = np.zeros(len(layout))
+        power[chiplet] = probe
+        thermal.set_pos(power, layout[:, :2].transpose(), layout[:, 2], layout[:, 3])
+        thermal.run_hotspot("unit")
+        temperature = read_grid_steady(os.path.join(scratch, "unit.grid.steady"))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return temperature.ravel()
+
+
+def hotspot_basis(case_name: str, layout: np.ndarray, power: np.ndarray, scratch: str, workers: int = None,
+                  cache_dir: str = None) -> Tuple[np.ndarray, float]:
+    """
+    用 HotSpot 求基: 每个 chiplet 单独运行一次, 进程池并行
+    HotSpot 只输出两位小数, 为减小舍入误差每个 chiplet 以其 .power 中的功率 (为 0 时用 1 W) 求解再除以该功率
+    """
+    # case 共用文件只生成一次, 各 chiplet 的 worker 直接引用; 环境温度也取自这里的 new_hotspot.config
+    ambient = _case_ambient(case_name, scratch)
+    probes = np.where(power > 0, power, 1.0)
+    basis = np.empty((len(layout), GRID * GRID), dtype=np.float64)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(_hotspot_response, case_name, layout, i, float(probes[i]), scratch, cache_dir)
+                   for i in range(len(layout))]
+        for i, future in enumerate(futures):
+            basis[i] = future.result()
+    return (basis - ambient) / probes[:, None], ambient
+
+
+def compact_basis(case_name: str, layout: np.ndarray, model_path: str, scratch: str) -> Tuple[np.ndarray, float]:
+    """
+    用训练好的紧凑模型求基: 所有 chiplet 功率取 1 W 时 chiplet_response 的每一项就是该 chiplet 的响应
+    环境温度与 grid / hotspot 一样取自 scratch 中生成的 new_hotspot.config
+    """
+    import torch
+    from compact_themal_model import ChipletThermalModel
+    case = load_case_layouts(case_name)
+    model = ChipletThermalModel(len(layout))
+    model.load_state_dict(torch.load(model_path, weights_only=True, map_location='cpu'))
+    intpsize = case.intpsize / 1e3
+    # 与 train_compact_themal_model.test 相同的输入: 坐标 mm, 中心坐标取整
+    X, Y = torch.meshgrid(torch.arange(GRID), torch.arange(GRID), indexing='xy')
+    x_input = X.flatten().float().view(1, -1) * intpsize / GRID
+    y_input = Y.flatten().float().view(1, -1) * intpsize / GRID
+    chiplets = layout.astype(np.float64).T / 1e3
+    chiplets[:2] = np.round(chiplets[:2])
+    chiplets = torch.tensor(chiplets, dtype=torch.float32).unsqueeze(1)
+    with torch.no_grad():
+        response = model.chiplet_response(x_input, y_input, *chiplets, torch.ones(1, len(layout)))
+    return response[0].double().numpy(), _case_ambient(case_name, scratch)
+
+
+def _basis_path(case_name: str, idx: int, source: str, basis_dir: str) -> str:
+    return os.path.join(basis_dir, f"{case_name}_{idx}_{source}.npz")
+
+
+def build_basis(case_name: str, idx: int, source: str = 'grid', basis_dir: str = BASIS_DIR, workers: int = None,
+                cache_dir: str = None, model_path: str = None) -> PowerBasis:
+    """
+    求布局 CaseK_{idx}.pl 的功率响应基并写入 basis_dir
+    workers, cache_dir: 只用于 source='hotspot', 见 hotspot_basis / HotspotCache
+    model_path: 只用于 source='compact', 默认 model/{case_name}_thermal_model.pth
+    """
+    case = load_case_layouts(case_name)
+    layout = case.layouts[case.rows([idx])[0]]
+    os.makedirs(basis_dir, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix=f"{case_name}_{idx}_", dir=basis_dir)
+    start = time.time()
+    try:
+        if source == 'grid':
+            basis, ambient = grid_basis(case_name, layout.astype(np.float64), os.path.join(scratch, ""))
+        elif source == 'hotspot':
+            basis, ambient = hotspot_basis(case_name, layout.astype(np.float64), case.power, os.path.join(scratch, ""),
+                                           workers, cache_dir)
+        elif source == 'compact':
+            basis, ambient = compact_basis(case_name, layout, model_path or f"model/{case_name}_thermal_model.pth",
+                                           os.path.join(scratch, ""))
+        else:
+            raise ValueError(f"unknown basis source {source!r}, expected one of {SOURCES}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    result = PowerBasis(case.names, basis.astype(np.float32), ambient, layout, source)
+    print(f"{case_name}:{idx} {source} basis, {len(layout)} chiplets in {time.time() - start:.2f} s")
+
+    # 先写临时文件再替换, 中途中断不会留下不完整的缓存
+    path = _basis_path(case_name, idx, source, basis_dir)
+    np.savez(path + ".tmp.npz", names=np.array(result.names), basis=result.basis, ambient=result.ambient,
+             layout=result.layout, source=source)
+    os.replace(path + ".tmp.npz", path)
+    return result
+
+
+def load_basis(case_name: str, idx: int, source: str = 'grid', basis_dir: str = BASIS_DIR, **kwargs) -> PowerBasis:
+    """
+    读取 basis_dir 中的基, 不存在、布局已变化或 (source='compact' 时) 模型比基新时用 build_basis 重建
+    kwargs 传给 build_basis
+    """
+    path = _basis_path(case_name, idx, source, basis_dir)
+    if os.path.exists(path):
+        case = load_case_layouts(case_name)
+        model_path = kwargs.get('model_path') or f"model/{case_name}_thermal_model.pth"
+        fresh = source != 'compact' or os.path.getmtime(model_path) <= os.path.getmtime(path)
+        with np.load(path) as cached:
+            if fresh and np.array_equal(cached["layout"], case.layouts[case.rows([idx])[0]]):
+                return PowerBasis(cached["names"].tolist(), cached["basis"], float(cached["ambient"]),
+                                  cached["layout"], source)
+    return build_basis(case_name, idx, source, basis_dir, **kwargs)
+
+
+def read_scenarios(path: str, names: List[str], default_power: np.ndarray):
+    """
+    读取功率场景 CSV: 表头为 chiplet 名字 (第一列可以是场景名 "scenario"), 每行一个场景的功率 (W);
+    表中没有的 chiplet 取 default_power (.power 中的值)
+    返回 (场景名列表, (S, N) 功率数组)
+    """
+    column = {name: i for i, name in enumerate(names)}
+    labels, scenarios = [], []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        unknown = [name for name in reader.fieldnames if name != 'scenario' and name not in column]
+        if unknown:
+            raise ValueError(f"{path}: unknown chiplets {unknown}")
+        for row in reader:
+            power = default_power.copy()
+            for name, value in row.items():
+                if name != 'scenario' and value not in (None, ''):
+                    power[column[name]] = float(value)
+            labels.append(row.get('scenario') or str(len(labels)))
+            scenarios.append(power)
+    return labels, np.array(scenarios).reshape(-1, len(names))
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="1", help='case number')
+    arg.add_argument('--layout', type=int, default=1, help='layout id (CaseK_{id}.pl)')
+    arg.add_argument('--source', type=str, default='grid', choices=SOURCES,
+                     help='how the unit-power responses are computed')
+    arg.add_argument('--scenarios', type=str, default=None,
+                     help='CSV of power scenarios, one column per chiplet (missing chiplets keep their .power value)')
+    arg.add_argument('--scale', type=float, nargs='*', default=[0.5, 0.75, 1.0, 1.25, 1.5],
+                     help='Without --scenarios, sweep the .power vector scaled by these factors')
+    arg.add_argument('--output', type=str, default=None, help='Save the temperature maps (S, grid, grid) as .npy')
+    arg.add_argument('--force', action='store_true', help='Recompute the basis even if it is cached')
+    arg.add_argument('--workers', type=int, default=None, help='HotSpot worker processes (default: CPU count)')
+    arg.add_argument('--cache', type=str, default=None, help='HotspotCache directory used by --source hotspot')
+    args = arg.parse_args()
+
+    case_name = f"Case{args.case}"
+    kwargs = {'workers': args.workers, 'cache_dir': args.cache} if args.source == 'hotspot' else {}
+    build = build_basis if args.force else load_basis
+    basis = build(case_name, args.layout, args.source, **kwargs)
+    case = load_case_layouts(case_name)
+    if args.scenarios:
+        labels, power = read_scenarios(args.scenarios, basis.names, case.power)
+    else:
+        labels, power = [f"x{s:g}" for s in args.scale], np.outer(args.scale, case.power)
+
+    start = time.time()
+    temperature = basis.temperature(power)
+    elapsed = time.time() - start
+    for label, p, T in zip(labels, power, temperature):
+        print(f"{label:>12}: total {p.sum():8.2f} W, peak {T.max() - 273.15:7.2f} °C, mean {T.mean() - 273.15:7.2f} °C")
+    print(f"{len(labels)} scenarios in {elapsed * 1e3:.2f} ms")
+    if args.output:
+        np.save(args.output, temperature)
@@ -1,9 +1,13 @@
 """热分析处理脚本,用于生成20个布局的热点分析结果"""
 
+import argparse
 import os
+import shutil
+import tempfile
 import numpy as np
-from typing import List, Tuple
-from Thermal import Thermal_solver
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Tuple
+from Thermal import HotspotCache, Thermal_solver
 import time
 
 def parse_intpsize_file(intpsize_path: str) -> Tuple[float, float]:
@@ -71,8 +75,65 @@ def parse_power_file(power_path: str) -> List[float]:
                 powers[parts[0]] = float(parts[1])
     return powers
 
-def main(case_name = "Case1"):
-    """主处理流程"""
+def read_power_trace(trace_path: str, names: List[str], default_power: np.ndarray) -> Iterator[np.ndarray]:
+    """
+    逐行读取功率轨迹文件: 第一行为 chiplet 名字 (空白分隔, 与 .pl 中的名字相同), 之后每行一个时间步的功率 (W)
+    按 names 的顺序 yield 每步的功率数组, 文件中没有的 chiplet 取 default_power (.power 中的值); 不会把整个文件读入内存
+    """
+    column = {name: i for i, name in enumerate(names)}
+    with open(trace_path) as f:
+        header = f.readline().split()
+        unknown = [name for name in header if name not in column]
+        if unknown:
+            raise ValueError(f"{trace_path}: unknown chiplets {unknown}")
+        index = np.array([column[name] for name in header], dtype=np.int64)
+        for line in f:
+            values = line.split()
+            if not values:
+                continue
+            power = default_power.copy()
+            power[index] = np.array(values, dtype=np.float64)
+            yield power
+
+def transient_layout(case_name: str, idx: int, trace_path: str, sampling_interval: float = None,
+                     output_path: str = None) -> np.ndarray:
+    """
+    用 HotSpot 对一个布局做瞬态分析, 功率轨迹见 read_power_trace, 轨迹和温度结果都逐步流式处理
+    output_path: 可选, 逐步写出各 chiplet 温度 (K) 的 CSV
+    返回各 chiplet 在整个轨迹中的最高温度 (K)
+    """
+    from layout_cache import load_case_layouts
+    case = load_case_layouts(case_name)
+    layout = case.layouts[case.rows([idx])[0]].astype(np.float64)
+    scratch = tempfile.mkdtemp(prefix=f"transient_{idx}_", dir=f"./dataset/{case_name}")
+    try:
+        thermal = Thermal_solver(os.path.join(scratch, ""))
+        thermal.set_params(get_system_params(f"./cases/{case_name}"))
+        thermal.set_pos(case.power.copy(), layout[:, :2].transpose(), layout[:, 2], layout[:, 3])
+        start = time.time()
+        steps = thermal.run_transient(f"transient_{idx}", read_power_trace(trace_path, case.names, case.power),
+                                      sampling_interval)
+        peak = np.full(len(case.names), -np.inf)
+        step = -1
+        out = open(output_path, 'w') if output_path else None
+        try:
+            if out:
+                out.write("step," + ",".join(case.names) + "\n")
+            for step, temperature in enumerate(steps):
+                np.maximum(peak, temperature, out=peak)
+                if out:
+                    out.write(f"{step}," + ",".join(f"{t:.2f}" for t in temperature) + "\n")
+        finally:
+            if out:
+                out.close()
+        print(f"{case_name}:{idx} transient, {step + 1} steps in {time.time() - start:.2f} s, "
+              f"peak {peak.max() - 273.15:.2f} °C ({case.names[int(peak.argmax())]})")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return peak
+
+def main(case_name = "Case1", cache = None, solver = 'hotspot'):
+    """主处理流程, cache: 可选的 HotspotCache, solver: 'hotspot' 或 'grid' (见 Thermal_solver)"""
     # 配置参数
     case_dir = f"./cases/{case_name}"
     output_dir = f"./dataset/{case_name}"
@@ -82,27 +143,24 @@ def main(case_name = "Case1"):
     system = get_system_params(case_dir)
     
     # 初始化热分析器
-    thermal = Thermal_solver(os.path.join(output_dir, ""))
+    thermal = Thermal_solver(os.path.join(output_dir, ""), cache, solver)
     thermal.set_params(system)
+
+    # 所有布局和功率一次解析 (有缓存时直接读取)
+    from layout_cache import load_case_layouts
+    case = load_case_layouts(case_name)
     
     # 处理200个布局
     for idx in range(1, 201):
         try:
             start = time.time()
-            # 文件路径
-            pl_file = os.path.join(case_dir, f"{case_name}_{idx}.pl")
-            power_file = os.path.join(case_dir, f"{case_name}.power")
-            
-            # 解析文件
-            chip_names, positions, widths, heights = parse_pl_file(pl_file)
-            powers = parse_power_file(power_file)
-            powers = [powers.get(name, 0.0) for name in chip_names] 
+            layout = case.layouts[case.rows([idx])[0]].astype(np.float64)
             # 设置热分析参数
             thermal.set_pos(
-                np.array(powers),
-                np.array(positions).transpose(),
-                np.array(widths),
-                np.array(heights))
+                case.power.copy(),
+                layout[:, :2].transpose(),
+                layout[:, 2],
+                layout[:, 3])
             
             # 执行热分析
             output_prefix = f"gen_dataset_{idx}"
@@ -113,7 +171,152 @@ def main(case_name = "Case1"):
         except Exception as e:
             print(f"处理布局{idx}时出错: {str(e)}")
             continue
+    if cache is not None:
+        print(f"HotSpot cache: {cache.stats()}")
+
+def prepare_case_files(case_name: str, output_dir: str = None) -> str:
+    """
+    在 output_dir (默认 dataset/{case_name}/) 中为整个 case 生成一次共用的 L0/L1/L2/L5 flp 和 new_hotspot.config,
+    返回该目录 (以路径分隔符结尾), 作为 generate_layout 的 case_path 传给各 worker
+    """
+    path = os.path.join(output_dir or f"./dataset/{case_name}", "")
+    os.makedirs(path, exist_ok=True)
+    Thermal_solver(path).set_params(get_system_params(f"./cases/{case_name}"))
+    return path
+
+def generate_layout(case_name: str, idx: int, power: np.ndarray, layout: np.ndarray,
+                    cache_dir: str = None, cache_size: int = 2**30, solver: str = 'hotspot',
+                    case_path: str = None) -> Tuple[float, bool]:
+    """
+    在独立的临时目录里为一个布局运行 HotSpot, 结果原子地移动到 dataset/{case_name}/
+    每次调用有自己的中间文件, 多个进程可以同时生成同一个 case
+    layout: shape (N, 4), 中心 x, 中心 y, 宽, 高 (um)
+    cache_dir: 可选, HotspotCache 的目录, 多个进程共用 (进程内见 HotspotCache.shared); cache_size 为其大小上限 (字节)
+    solver: 'hotspot' 或 'grid' (见 Thermal_solver)
+    case_path: 可选, prepare_case_files 返回的目录, 所有布局直接引用其中的 case 共用文件;
+        默认在临时目录中为这个布局单独生成一份
+    返回 (耗时(s), 是否命中缓存)
+    """
+    start = time.time()
+    case_dir = f"./cases/{case_name}"
+    output_dir = f"./dataset/{case_name}"
+    scratch = tempfile.mkdtemp(prefix=f"gen_dataset_{idx}_", dir=os.path.join(output_dir, ".scratch"))
+    # 同一 worker 进程中的布局共用一个 HotspotCache, 累加的缓存大小不必每次重新扫描
+    cache = HotspotCache.shared(cache_dir, cache_size) if cache_dir is not None else None
+    hits = cache.hits if cache is not None else 0
+    try:
+        thermal = Thermal_solver(os.path.join(scratch, ""), cache, solver, case_path)
+        thermal.set_params(get_system_params(case_dir))
+        thermal.set_pos(power, layout[:, :2].transpose(), layout[:, 2], layout[:, 3])
+        output_prefix = f"gen_dataset_{idx}"
+        thermal.run_hotspot(output_prefix)
+        grid_steady = output_prefix + ".grid.steady"
+        if not os.path.getsize(os.path.join(scratch, grid_steady)):
+            raise RuntimeError(f"hotspot wrote an empty {grid_steady}")
+
+        # layers.lcf 中的 flp 路径指向临时目录, 改成最终目录 (与顺序生成的文件一致); 命中缓存时没有 lcf
+        lcf_path = os.path.join(scratch, output_prefix + "layers.lcf")
+        if os.path.exists(lcf_path):
+            with open(lcf_path) as f:
+                lcf = f.read()
+            with open(lcf_path, 'w') as f:
+                f.write(lcf.replace(thermal.path, os.path.join(output_dir, "")))
+        # 没有 case_path 时连同 case 共用的 L0/L1/L2/L5 层一起移动 (内容相同, 覆盖无妨);
+        # .grid.steady 最后移动: 它存在即表示这个布局已经完整生成
+        for name in sorted(os.listdir(scratch), key=lambda name: name == grid_steady):
+            if name != "new_hotspot.config":
+                os.replace(os.path.join(scratch, name), os.path.join(output_dir, name))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return time.time() - start, cache is not None and cache.hits > hits
+
+def generate_parallel(case_names: Iterable[str], layout_ids: Iterable[int] = range(1, 201),
+                      workers: int = None, cache_dir: str = None,
+                      cache_size: int = 2**30, solver: str = 'hotspot') -> List[Tuple[str, int, str]]:
+    """
+    用进程池并行生成 HotSpot 数据集, 进程数默认为 CPU 核数
+    已完成的布局 (dataset/CaseK/gen_dataset_i.grid.steady 已存在) 会被跳过, 因此中断后可以直接重新运行
+    cache_dir: 可选, 所有 worker 共用的 HotspotCache 目录
+    solver: 'hotspot' 或 'grid', 用 grid 时每个 worker 进程内同一网格的布局共用消元顺序
+    返回失败的 (case, 布局 id, 错误信息)
+    """
+    from layout_cache import load_case_layouts
+    case_names, layout_ids = list(case_names), list(layout_ids)
+    workers = workers or os.cpu_count()
+    tasks = []
+    for case_name in case_names:
+        output_dir = f"./dataset/{case_name}"
+        os.makedirs(os.path.join(output_dir, ".scratch"), exist_ok=True)
+        case_path = prepare_case_files(case_name, output_dir)
+        case = load_case_layouts(case_name)
+        available = set(case.layout_ids.tolist())
+        for idx in layout_ids:
+            if idx not in available or os.path.exists(os.path.join(output_dir, f"gen_dataset_{idx}.grid.steady")):
+                continue
+            tasks.append((case_name, idx, case.power, case.layouts[case.rows([idx])[0]].astype(np.float64),
+                          cache_dir, cache_size, solver, case_path))
+    print(f"{len(tasks)} layouts to simulate with {workers} workers")
+
+    failures = []
+    cached = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate_layout, *task): task[:2] for task in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            case_name, idx = futures[future]
+            try:
+                elapsed, hit = future.result()
+                cached += hit
+                print(f"[{done}/{len(tasks)}] {case_name}:{idx} {'cached' if hit else 'done'} in {elapsed:.2f} s "
+                      f"({time.time() - start:.1f} s elapsed)")
+            except Exception as e:
+                failures.append((case_name, idx, str(e)))
+                print(f"[{done}/{len(tasks)}] {case_name}:{idx} failed: {e}")
+
+    for case_name in case_names:
+        try:
+            os.rmdir(f"./dataset/{case_name}/.scratch")
+        except OSError:
+            pass
+    if cache_dir is not None:
+        print(f"HotSpot cache: {cached} of {len(tasks)} layouts served from {cache_dir}")
+    if failures:
+        print(f"{len(failures)} layouts failed:")
+        for case_name, idx, error in failures:
+            print(f"  {case_name}:{idx}: {error}")
+    return failures
 
 if __name__ == "__main__":
-    for idx in range(1,11):
-        main(case_name = f"Case{idx}")
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="all", help='case number, or "all" for Case1-Case10')
+    arg.add_argument('--parallel', action='store_true',
+                     help='Simulate layouts in a process pool, skipping layouts that are already complete')
+    arg.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    arg.add_argument('--cache', type=str, default=None,
+                     help='Directory of a content-addressed HotSpot result cache, e.g. cache/hotspot')
+    arg.add_argument('--cache-size', type=int, default=1024, help='Size bound of the HotSpot cache in MiB')
+    arg.add_argument('--solver', type=str, default='hotspot', choices=['hotspot', 'grid'],
+                     help='"grid" solves the same grid model with grid_solver.py instead of running thermal/hotspot')
+    arg.add_argument('--transient', type=str, default=None,
+                     help='Power trace (chiplet names, then one row of powers per step) for a transient run of --layout')
+    arg.add_argument('--layout', type=int, default=1, help='Layout id used with --transient')
+    arg.add_argument('--sampling-interval', type=float, default=None,
+                     help='Duration of one trace step in seconds (default: sampling_intvl of hotspot.config)')
+    arg.add_argument('--output', type=str, default=None, help='CSV of per-step chiplet temperatures for --transient')
+    args = arg.parse_args()
+    if args.solver == 'grid' and args.cache is not None:
+        arg.error('--cache only applies to --solver hotspot')
+    if args.transient is not None:
+        if args.case == 'all' or args.solver != 'hotspot' or args.parallel:
+            arg.error('--transient needs a single --case and --solver hotspot, without --parallel')
+        transient_layout(f"Case{args.case}", args.layout, args.transient, args.sampling_interval, args.output)
+        raise SystemExit
+
+    case_names = [f"Case{idx}" for idx in range(1, 11)] if args.case == 'all' else [f"Case{args.case}"]
+    if args.parallel:
+        generate_parallel(case_names, workers=args.workers, cache_dir=args.cache, cache_size=args.cache_size * 2**20,
+                          solver=args.solver)
+    else:
+        cache = HotspotCache(args.cache, args.cache_size * 2**20) if args.cache is not None else None
+        for case_name in case_names:
+            main(case_name = case_name, cache = cache, solver = args.solver)
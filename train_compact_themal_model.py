@@ -2,8 +2,9 @@
 #ATPlace2.5D: Analytical Thermal-Aware Chiplet Placement Framework for Large-Scale 2.5D-IC
 import argparse
 import os
-from process_thermal import parse_intpsize_file,parse_power_file,parse_pl_file
-from compact_themal_model import ChipletThermalModel
+from compact_themal_model import ChipletThermalModel, MultiCaseThermalModel
+from ground_truth_store import load_ground_truth
+from layout_cache import load_case_layouts
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -11,121 +12,388 @@ from tqdm import tqdm
 from gf_layer4_tool import tri_panel, compute_metrics
 import time
 grid = 64
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-def train(case_name):
-    TRAIN = 50
+def chunked_backward(model, x_input, y_input, chiplets, T_ground_truth, env_temperature, memory_budget):
+    """
+    在 memory_budget 字节内完成一次 MSE 损失的前向和反向, 梯度累加到 model 的参数上
+
+    按布局和 chiplet 两个维度切分: 每个布局块先不建图地求出完整预测和 dL/dT,
+    再逐个 chiplet 块重新前向并以 dL/dT 反向。温度对 chiplet 求和是线性的, 所以累加后的梯度与整批训练一致。
+    chiplets: (x, y, width, height, power), 每个 shape (TRAIN, N)
+    返回整批的损失
+    """
+    TRAIN = T_ground_truth.shape[0]
+    total = T_ground_truth.numel()
+    layouts, chiplets_per_chunk = model.chunk_sizes(TRAIN, T_ground_truth.shape[1], memory_budget)
+    loss = 0.0
+    for start in range(0, TRAIN, layouts):
+        rows = slice(start, start + layouts)
+        x_chunk = x_input[rows] if x_input.shape[0] > 1 else x_input
+        y_chunk = y_input[rows] if y_input.shape[0] > 1 else y_input
+        blocks = [slice(i, i + chiplets_per_chunk) for i in range(0, model.N, chiplets_per_chunk)]
+
+        def forward(block):
+            return model(x_chunk, y_chunk, *[c[rows, block] for c in chiplets], grid, index=block)
+
+        if len(blocks) == 1:
+            T_pred = forward(blocks[0]) + env_temperature
+            chunk_loss = ((T_pred - T_ground_truth[rows]) ** 2).sum() / total
+            chunk_loss.backward()
+            loss += chunk_loss.detach()
+            continue
+        with torch.no_grad():
+            T_pred = sum(forward(block) for block in blocks) + env_temperature
+            residual = T_pred - T_ground_truth[rows]
+        for block in blocks:
+            forward(block).backward(2 * residual / total)
+        loss += (residual ** 2).sum() / total
+    return loss
 
+def solve_linear_parameters(model, x_input, y_input, chiplets, target, tol=1e-12):
+    """
+    给定 a, lx, ly 时模型输出对 A 和 A*B 是线性的:
+        T - ENV = A * phi + (A*B) * sum(P),  phi 为 A=1, B=0 时的模型输出
+    用最小二乘求出最优的 A, B 并写回 model
+    target: T_ground_truth - ENV, shape (TRAIN, grid*grid)
+    tol: |A| 不超过 tol 时 B = (A*B) / A 没有意义, 保留原来的 B
+    """
+    with torch.no_grad():
+        previous_B = model.B.item()
+        model.A.fill_(1.0)
+        model.B.zero_()
+        phi = model.predict(x_input[:1], y_input[:1], *chiplets).double()
+        power_sum = chiplets[4].double().sum(dim=1, keepdim=True)
+        target = target.double()
+        phi_power = (phi.sum(dim=1, keepdim=True) * power_sum).sum()
+        normal = torch.stack([torch.stack([(phi * phi).sum(), phi_power]),
+                              torch.stack([phi_power, phi.shape[1] * (power_sum ** 2).sum()])])
+        rhs = torch.stack([(phi * target).sum(), (power_sum * target).sum()])
+        A, AB = torch.linalg.solve(normal, rhs)
+        model.A.fill_(A.item())
+        model.B.fill_((AB / A).item() if A.abs() > tol else previous_B)
+
+def fit_varpro(model, x_input, y_input, chiplets, T_ground_truth, env_temperature, memory_budget=None,
+               tol=1e-6, max_steps=200, verbose=True):
+    """
+    变量投影 (variable projection) 拟合: 每次求值时用最小二乘精确求出线性参数 A, B,
+    只用 L-BFGS 优化非线性参数 a, lx, ly; 相邻两步损失的相对变化小于 tol 时停止
+    A, B 取最小二乘最优值时, 损失对 a, lx, ly 的梯度就等于投影后目标函数的梯度, 因此直接复用普通的反向
+    verbose: 为 False 时不打印每一步的损失
+    返回最终损失
+    """
+    target = T_ground_truth - env_temperature
+    optimizer = torch.optim.LBFGS([model.a, model.lx, model.ly], lr=1, max_iter=20, history_size=20,
+                                  line_search_fn='strong_wolfe')
+    loss_fn = torch.nn.MSELoss()
+
+    def closure():
+        model.zero_grad()
+        solve_linear_parameters(model, x_input, y_input, chiplets, target)
+        if memory_budget is not None:
+            return chunked_backward(model, x_input, y_input, chiplets, T_ground_truth, env_temperature,
+                                    memory_budget)
+        loss = loss_fn(model(x_input, y_input, *chiplets, grid) + env_temperature, T_ground_truth)
+        loss.backward()
+        return loss
+
+    previous = None
+    for step in range(max_steps):
+        optimizer.step(closure)
+        solve_linear_parameters(model, x_input, y_input, chiplets, target)
+        with torch.no_grad():
+            loss = ((model.predict(x_input[:1], y_input[:1], *chiplets) + env_temperature - T_ground_truth) ** 2).mean().item()
+        if verbose:
+            print(f"Step {step:4d}:, Loss = {loss:.6f}")
+        if previous is not None and abs(previous - loss) <= tol * abs(previous):
+            break
+        previous = loss
+    return loss
+
+def multi_case_backward(model, x_input, y_input, chiplets, case_index, T_ground_truth, env_temperature,
+                        rows_per_chunk, backward=True):
+    """
+    堆叠多个 case 时的前向和反向, 梯度累加到 model 的参数上
+    损失为各 case 的 MSE 之和; 各 case 的参数互不相关, 所以每个 case 收到的梯度与单独训练时相同
+    每次只计算 rows_per_chunk 行; backward 为 False 时只求损失
+    返回 (总损失, 各 case 的损失 shape (C,))
+    """
+    C = len(model.num_chiplets)
+    weight = 1 / (torch.bincount(case_index, minlength=C)[case_index] * T_ground_truth.shape[1])
+    losses = torch.zeros(C, device=T_ground_truth.device)
+    for start in range(0, T_ground_truth.shape[0], rows_per_chunk):
+        rows = slice(start, start + rows_per_chunk)
+        with torch.set_grad_enabled(backward):
+            T_pred = model(x_input[rows], y_input[rows], *[c[rows] for c in chiplets], case_index[rows]) + env_temperature
+            row_loss = ((T_pred - T_ground_truth[rows]) ** 2).sum(dim=1) * weight[rows]
+        if backward:
+            row_loss.sum().backward()
+        losses.index_add_(0, case_index[rows], row_loss.detach())
+    return losses.sum(), losses
+
+def solve_multi_case_linear_parameters(model, x_input, y_input, chiplets, case_index, target, rows_per_chunk):
+    """solve_linear_parameters 的多 case 版本: 每个 case 各自求解 2x2 最小二乘, 批量写回 A, B"""
+    C = len(model.num_chiplets)
+    with torch.no_grad():
+        model.A.fill_(1.0)
+        model.B.zero_()
+        phi = torch.cat([model(x_input[rows], y_input[rows], *[c[rows] for c in chiplets], case_index[rows])
+                         for rows in (slice(s, s + rows_per_chunk) for s in range(0, target.shape[0], rows_per_chunk))])
+        phi = phi.double()
+        power_sum = (chiplets[4] * model.mask[case_index]).double().sum(dim=1)
+        target = target.double()
+
+        def per_case(v):
+            return torch.zeros(C, dtype=torch.float64, device=v.device).index_add_(0, case_index, v)
+
+        phi_power = per_case(phi.sum(dim=1) * power_sum)
+        normal = torch.stack([torch.stack([per_case((phi * phi).sum(dim=1)), phi_power], dim=1),
+                              torch.stack([phi_power, per_case(phi.shape[1] * power_sum ** 2)], dim=1)], dim=1)
+        rhs = torch.stack([per_case((phi * target).sum(dim=1)), per_case(power_sum * target.sum(dim=1))], dim=1)
+        A, AB = torch.linalg.solve(normal, rhs).unbind(1)
+        model.A.copy_(A)
+        model.B.copy_(AB / A)
+
+def train_all(case_names, memory_budget=None, solver='adam', patience=None, min_delta=1e-6, tol=1e-6,
+              milestones=(200,)):
+    """
+    在一个进程里同时训练多个 case: 各 case 的布局补齐到相同的 chiplet 数后堆叠成一个 batch,
+    用 MultiCaseThermalModel 在一个向量化的优化循环里拟合所有参数, 最后仍按 case 分别保存
+    model/CaseN_thermal_model.pth。学习率、步数、milestones 和早停与 train() 相同, 早停看所有 case 的损失之和。
+    memory_budget: 每块临时张量的字节数; 默认 GPU 上整批计算, CPU 上 256 MiB
+    """
+    TRAIN = 50
     ENV_TMP = 45  # Environment temperature in Celsius
     ENV_TMP_K = ENV_TMP + 273.15  # Convert to Kelvin
-    case_dir = f"./cases/{case_name}"
-    intpsize_path = os.path.join(case_dir, f"{case_name}.intpsize")
-    intpsize, _ = parse_intpsize_file(intpsize_path)
-    intpsize /= 1e3
-    power_file = os.path.join(case_dir, f"{case_name}.power")
-    power = parse_power_file(power_file)
-    
-    T_ground_truth = torch.zeros([TRAIN,1,grid,grid], dtype=torch.float32, device='cuda')
-    dataset_x = np.zeros([TRAIN, len(power)], dtype=np.float32)  
-    dataset_y = np.zeros([TRAIN, len(power)], dtype=np.float32)
-    dataset_width = np.zeros([TRAIN, len(power)], dtype=np.float32)
-    dataset_height = np.zeros([TRAIN, len(power)], dtype=np.float32)
-    dataset_power = np.zeros([TRAIN, len(power)], dtype=np.float32)
-    
+
+    data = [load_training_data(case_name, TRAIN) for case_name in case_names]
+    model = MultiCaseThermalModel([len(names) for _, _, _, _, names in data]).to(device)
+    x_input = torch.cat([d[0] for d in data])
+    y_input = torch.cat([d[1] for d in data])
+    chiplets = tuple(torch.cat([F.pad(d[2][k], (0, model.N - d[2][k].shape[1])) for d in data]) for k in range(5))
+    T_ground_truth = torch.cat([d[3] for d in data])
+    case_index = torch.cat([torch.full((TRAIN,), c, dtype=torch.long, device=device) for c in range(len(data))])
+    del data
+    if memory_budget is None and device == 'cpu':
+        memory_budget = 2**28
+    rows_per_chunk = x_input.shape[0] if memory_budget is None else model.chunk_size(x_input.shape[1], memory_budget)
+    args = (model, x_input, y_input, chiplets, case_index)
+
+    if solver == 'varpro':
+        target = T_ground_truth - ENV_TMP_K
+        optimizer = torch.optim.LBFGS([model.a, model.lx, model.ly], lr=1, max_iter=20, history_size=20,
+                                      line_search_fn='strong_wolfe')
+
+        def closure():
+            model.zero_grad()
+            solve_multi_case_linear_parameters(*args, target, rows_per_chunk)
+            return multi_case_backward(*args, T_ground_truth, ENV_TMP_K, rows_per_chunk)[0]
+
+        previous = None
+        for step in range(200):
+            optimizer.step(closure)
+            solve_multi_case_linear_parameters(*args, target, rows_per_chunk)
+            _, losses = multi_case_backward(*args, T_ground_truth, ENV_TMP_K, rows_per_chunk, backward=False)
+            print(f"Step {step:4d}:, Loss = {losses.sum().item():.6f}, per case = {losses.tolist()}")
+            if previous is not None and ((previous - losses).abs() <= tol * previous.abs()).all():
+                break
+            previous = losses
+    else:
+        lr = 0.1
+        steps = 10000
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+        scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer, milestones=list(milestones), gamma=0.1)
+        best_loss, stale_steps = float('inf'), 0
+        for step in tqdm(range(steps)):
+            optimizer.zero_grad()
+            loss, losses = multi_case_backward(*args, T_ground_truth, ENV_TMP_K, rows_per_chunk)
+            optimizer.step()
+            scheduler.step()
+            if step % 100 == 0 or step == steps - 1:
+                print(f"Step {step:4d}:, Loss = {loss.item():.6f}, per case = {losses.tolist()}")
+
+            if loss.item() < best_loss * (1 - min_delta):
+                best_loss, stale_steps = loss.item(), 0
+            else:
+                stale_steps += 1
+            if patience is not None and stale_steps >= patience:
+                print(f"Step {step:4d}:, Loss = {loss.item():.6f} (no improvement for {patience} steps, stopping)")
+                break
+
+    for c, case_name in enumerate(case_names):
+        torch.save(model.case_state_dict(c), f'model/{case_name}_thermal_model.pth')
+    print(f"\n✅ Training complete. Models saved to model/CaseN_thermal_model.pth for {', '.join(case_names)}")
+
+def chiplet_type(name):
+    """chiplet 类型名, 如 GPU_0 -> GPU, CPU1_0 -> CPU1"""
+    return name.rsplit('_', 1)[0]
+
+def warm_start(model, chip_names, source_case):
+    """
+    用已训练好的 model/{source_case}_thermal_model.pth 初始化参数
+    A, a, B 直接复制; lx/ly 先按 chiplet 名字匹配, 否则取同类型 chiplet 的平均值, 都没有时取所有 chiplet 的平均值
+    """
+    source_names = load_case_layouts(source_case).names
+    state = torch.load(f'model/{source_case}_thermal_model.pth', weights_only=True, map_location='cpu')
+    with torch.no_grad():
+        for name in ('A', 'a', 'B'):
+            getattr(model, name).copy_(state[name])
+        for name in ('lx', 'ly'):
+            source = state[name]
+            by_type = {}
+            for i, source_name in enumerate(source_names):
+                by_type.setdefault(chiplet_type(source_name), []).append(source[i])
+            values = []
+            for chip_name in chip_names:
+                if chip_name in source_names:
+                    values.append(source[source_names.index(chip_name)])
+                elif chiplet_type(chip_name) in by_type:
+                    values.append(torch.stack(by_type[chiplet_type(chip_name)]).mean())
+                else:
+                    values.append(source.mean())
+            getattr(model, name).copy_(torch.stack(values))
+    print(f"Warm start from {source_case}")
+
+def layout_inputs(case, layout_ids):
+    """
+    一组布局的模型输入 (坐标 mm, chiplet 中心坐标取整)
+    case: layout_cache.CaseLayouts
+    返回 (x_input, y_input, chiplets): x_input/y_input shape (1, grid*grid), 所有布局共用;
+    chiplets 为 (x, y, width, height, power), 每个 shape (len(layout_ids), N)
+    """
+    intpsize = case.intpsize / 1e3
+    layouts = case.layouts[case.rows(layout_ids)].astype(np.float64)
     X, Y = torch.meshgrid(torch.arange(grid), torch.arange(grid), indexing='xy')
-    x_input = X.flatten().float().repeat(TRAIN, 1) * intpsize / grid
-    y_input = Y.flatten().float().repeat(TRAIN, 1) * intpsize / grid
-    for i in range(TRAIN):
-        gt_path = f'dataset/{case_name}/gen_dataset_{i+1}'
-        np_ground_truth = np.flipud(np.loadtxt(gt_path + ".grid.steady", usecols=[1]).reshape(grid,grid)).copy()
-        T_ground_truth[i, 0] = torch.tensor(np_ground_truth, dtype=torch.float32, device='cuda').view(grid, grid)
-        
-        pl_file = os.path.join(case_dir, f"{case_name}_{i+1}.pl")
-        chip_names, positions, widths, heights = parse_pl_file(pl_file)
-        positions = np.array(positions).transpose()
-        widths = np.array(widths)
-        heights = np.array(heights)
-        if i == 0:
-            power = [power.get(name, 0.0) for name in chip_names]
-        
-        dataset_x[i] = np.round(positions[0]/1e3)
-        dataset_y[i] = np.round(positions[1]/1e3)
-        dataset_width[i] = np.array(widths/1e3)
-        dataset_height[i] = np.array(heights/1e3)
-        dataset_power[i] = np.array(power, dtype=np.float32)
+    x_input = X.flatten().float().view(1, -1) * intpsize / grid
+    y_input = Y.flatten().float().view(1, -1) * intpsize / grid
+    dataset_x = np.round(layouts[:, :, 0]/1e3)
+    dataset_y = np.round(layouts[:, :, 1]/1e3)
+    dataset_width = layouts[:, :, 2]/1e3
+    dataset_height = layouts[:, :, 3]/1e3
+    dataset_power = np.broadcast_to(case.power, (len(layouts), len(case.names)))
+    chiplets = tuple(torch.tensor(d, dtype=torch.float32, device=device)
+                     for d in (dataset_x, dataset_y, dataset_width, dataset_height, dataset_power))
+    return x_input.to(device), y_input.to(device), chiplets
+
+def load_training_data(case_name, TRAIN):
+    """
+    读取 case 的前 TRAIN 个布局及其 HotSpot 结果
+    返回 (x_input, y_input, chiplets, T_ground_truth, names):
+    x_input/y_input shape (TRAIN, grid*grid); chiplets 为 (x, y, width, height, power), 每个 shape (TRAIN, N);
+    T_ground_truth shape (TRAIN, grid*grid); names 为 chiplet 名字
+    """
+    case = load_case_layouts(case_name)
+    T_ground_truth = torch.tensor(load_ground_truth(case_name, range(1, TRAIN + 1), grid=grid), device=device)
+    x_input, y_input, chiplets = layout_inputs(case, range(1, TRAIN + 1))
+    return x_input.repeat(TRAIN, 1), y_input.repeat(TRAIN, 1), chiplets, T_ground_truth.view(TRAIN, -1), case.names
+
+def train(case_name, memory_budget=None, solver='adam', patience=None, min_delta=1e-6,
+          save_every=None, resume=False, init_from=None, milestones=(200,)):
+    """
+    训练一个 case 的模型并保存到 model/CaseN_thermal_model.pth
+    solver 为 'adam' 时学习率在 milestones 的每一步乘以 0.1, patience/save_every/resume 控制早停和可恢复的训练状态;
+    'varpro' 按 fit_varpro 自己的收敛条件停止, 不支持 patience/save_every/resume
+    """
+    if solver == 'varpro' and (patience is not None or save_every is not None or resume):
+        raise ValueError("patience, save_every and resume only apply to solver='adam'")
+    TRAIN = 50
 
+    ENV_TMP = 45  # Environment temperature in Celsius
+    ENV_TMP_K = ENV_TMP + 273.15  # Convert to Kelvin
+    x_input, y_input, chiplets, T_ground_truth, names = load_training_data(case_name, TRAIN)
+    dataset_x, dataset_y, dataset_width, dataset_height, dataset_power = chiplets
 
     lr = 0.1
     steps = 10000
 
-    model = ChipletThermalModel(len(power)).to('cuda')
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer, milestones=[200], gamma=0.1)
+    model = ChipletThermalModel(len(names))
+    if init_from is not None:
+        warm_start(model, names, init_from)
+    model.to(device)
     loss_fn = torch.nn.MSELoss()
 
-    x_input = x_input.to('cuda')
-    y_input = y_input.to('cuda')
-    dataset_x = torch.tensor(dataset_x, dtype=torch.float32, device='cuda')
-    dataset_y = torch.tensor(dataset_y, dtype=torch.float32, device='cuda')
-    dataset_width = torch.tensor(dataset_width, dtype=torch.float32, device='cuda')
-    dataset_height = torch.tensor(dataset_height, dtype=torch.float32, device='cuda') 
-    dataset_power = torch.tensor(dataset_power, dtype=torch.float32, device ='cuda')
-    for step in tqdm(range(steps)):
-        optimizer.zero_grad()
-        T_pred = model(x_input, y_input, dataset_x, dataset_y, dataset_width, dataset_height, dataset_power, grid) + ENV_TMP_K
-        loss = loss_fn(T_pred, T_ground_truth.view(TRAIN, -1))
-        loss.backward()
-        optimizer.step()
-        scheduler.step()
-        if step % 100 == 0 or step == steps - 1:
-            print(f"Step {step:4d}:, Loss = {loss.item():.6f}")
+    if solver == 'varpro':
+        fit_varpro(model, x_input, y_input, (dataset_x, dataset_y, dataset_width, dataset_height, dataset_power),
+                   T_ground_truth, ENV_TMP_K, memory_budget)
+    else:
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+        scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer, milestones=list(milestones), gamma=0.1)
+
+        # 训练状态: 早停用的最优损失和未改善的步数, 可周期性保存并恢复
+        state_path = f'model/{case_name}_train_state.pth'
+        first_step, best_loss, stale_steps = 0, float('inf'), 0
+        if resume and os.path.exists(state_path):
+            state = torch.load(state_path, weights_only=True, map_location=device)
+            model.load_state_dict(state['model'])
+            optimizer.load_state_dict(state['optimizer'])
+            scheduler.load_state_dict(state['scheduler'])
+            first_step, best_loss, stale_steps = state['step'] + 1, state['best_loss'], state['stale_steps']
+            print(f"Resumed from {state_path} at step {first_step}")
+
+        for step in tqdm(range(first_step, steps)):
+            optimizer.zero_grad()
+            if memory_budget is None:
+                T_pred = model(x_input, y_input, dataset_x, dataset_y, dataset_width, dataset_height, dataset_power, grid) + ENV_TMP_K
+                loss = loss_fn(T_pred, T_ground_truth)
+                loss.backward()
+            else:
+                loss = chunked_backward(model, x_input, y_input,
+                                        (dataset_x, dataset_y, dataset_width, dataset_height, dataset_power),
+                                        T_ground_truth, ENV_TMP_K, memory_budget)
+            optimizer.step()
+            scheduler.step()
+            if step % 100 == 0 or step == steps - 1:
+                print(f"Step {step:4d}:, Loss = {loss.item():.6f}")
+
+            if loss.item() < best_loss * (1 - min_delta):
+                best_loss, stale_steps = loss.item(), 0
+            else:
+                stale_steps += 1
+            if save_every is not None and (step + 1) % save_every == 0:
+                torch.save({'step': step, 'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                            'scheduler': scheduler.state_dict(), 'best_loss': best_loss,
+                            'stale_steps': stale_steps}, state_path + '.tmp')
+                os.replace(state_path + '.tmp', state_path)
+            if patience is not None and stale_steps >= patience:
+                print(f"Step {step:4d}:, Loss = {loss.item():.6f} (no improvement for {patience} steps, stopping)")
+                break
     torch.save(model.state_dict(), f'model/{case_name}_thermal_model.pth')
     print(f"\n✅ Training complete. Model saved to output/{case_name}/thermal_model.pth")
 
 def test(case_name):
     ENV_TMP = 45  # Environment temperature in Celsius
     ENV_TMP_K = ENV_TMP + 273.15  # Convert to Kelvin
-    case_dir = f"./cases/{case_name}"
-    intpsize_path = os.path.join(case_dir, f"{case_name}.intpsize")
-    intpsize, _ = parse_intpsize_file(intpsize_path)
-    intpsize /= 1e3
-    power_file = os.path.join(case_dir, f"{case_name}.power")
-    power = parse_power_file(power_file)
+    case = load_case_layouts(case_name)
+    intpsize = case.intpsize / 1e3
     print(f'Case:{case_name}')
 
     model_path = f'model/{case_name}_thermal_model.pth'
-    model = ChipletThermalModel(len(power))
-    model.load_state_dict(torch.load(model_path,weights_only=True))
-    model.to('cuda')
+    model = ChipletThermalModel(len(case.names))
+    model.load_state_dict(torch.load(model_path,weights_only=True, map_location=device))
+    model.to(device)
     X, Y = torch.meshgrid(torch.arange(grid), torch.arange(grid), indexing='xy')
-    x_input = X.flatten().float().view(1, -1).to('cuda') * intpsize / grid
-    y_input = Y.flatten().float().view(1, -1).to('cuda') * intpsize / grid
+    x_input = X.flatten().float().view(1, -1).to(device) * intpsize / grid
+    y_input = Y.flatten().float().view(1, -1).to(device) * intpsize / grid
     metrics_rows = []
-    sum_time = 0.0
     with torch.no_grad():
         model.eval()
-        for i in range(51, 201):
-            gt_path = f'dataset/{case_name}/gen_dataset_{i}'
-            pl_file = os.path.join(case_dir, f"{case_name}_{i}.pl")
-            chip_names, positions, widths, heights = parse_pl_file(pl_file)
-            positions = np.array(positions).transpose()
-            widths = np.array(widths)
-            heights = np.array(heights)
-            if i == 51:
-                power = [power.get(name, 0.0) for name in chip_names]
-             
-            dataset_x = torch.tensor(np.round(positions[0]/1e3), dtype=torch.float32, device='cuda').view(1, -1)
-            dataset_y = torch.tensor(np.round(positions[1]/1e3) , dtype=torch.float32, device='cuda').view(1, -1)
-            dataset_width = torch.tensor(np.array(widths/1e3), dtype=torch.float32, device='cuda').view(1, -1)
-            dataset_height = torch.tensor(np.array(heights/1e3), dtype=torch.float32, device='cuda').view(1, -1)
-            dataset_power = torch.tensor(np.array(power, dtype=np.float32)     , dtype=torch.float32, device='cuda').view(1, -1)
+        layouts = case.layouts[case.rows(range(51, 201))].astype(np.float64).transpose(0, 2, 1) / 1e3
+        layouts[:, :2] = np.round(layouts[:, :2])
+        layouts = torch.tensor(layouts, dtype=torch.float32, device=device)
+        dataset_power = torch.tensor(case.power, dtype=torch.float32, device=device).view(1, -1)
 
-            start = time.time()
-            T_pred = model(x_input, y_input, dataset_x, dataset_y, dataset_width, dataset_height, dataset_power, grid) + ENV_TMP_K
-            end = time.time()
-            print(f"Inference time for {i}: {end - start:.6f} seconds")
-            sum_time += (end - start)
-            T_pred_np = T_pred.cpu().numpy().reshape(grid, grid)
-            T_ground_truth_np = np.flipud(np.loadtxt(gt_path + ".grid.steady", usecols=[1]).reshape(grid, grid)).copy()
+        start = time.time()
+        T_pred = model.predict(x_input, y_input, *layouts.unbind(1), dataset_power, env_temperature=ENV_TMP_K)
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        end = time.time()
+        print(f"Batched inference time for {layouts.shape[0]} layouts: {end - start:.6f} seconds")
+        T_pred = T_pred.cpu().numpy()
+        T_ground_truth = load_ground_truth(case_name, range(51, 201), grid=grid)
+
+        for k, i in enumerate(range(51, 201)):
+            T_pred_np = T_pred[k].reshape(grid, grid)
+            T_ground_truth_np = T_ground_truth[k].astype(np.float64)
             mae = np.mean(np.abs(T_pred_np - T_ground_truth_np))
             print(f"Test {i}: MAE = {mae:.4f} °C")
             tri_panel(T_ground_truth_np - 273.15,T_pred_np- 273.15, f"tmp/sid{i}_gt_pred_compact.png")
@@ -133,7 +401,7 @@ def test(case_name):
             m = compute_metrics(T_pred_np- 273.15, T_ground_truth_np- 273.15)
             metrics_rows.append((i, m["MAE"], m["RMSE"], m["MAPE"], m["CORR"],  m["PTE"]))
             print(f"Finshed processing gen_dataset_{i}.")
-        print(f"Average inference time: {sum_time/150:.6f} seconds")       
+        print(f"Average inference time: {(end - start)/150:.6f} seconds")       
     # Save metrics CSV
     import csv
     csv_path = os.path.join('tmp/', f"compact_metrics_auto_test_{case_name}.csv")
@@ -152,14 +420,48 @@ def test(case_name):
             w.writerow(["mean", mean_mae, mean_rmse, mean_mape, mean_corr, mean_pte])
 if __name__ == "__main__":
     arg = argparse.ArgumentParser()
-    arg.add_argument('--case', type=str, default="10", help='case name')
+    arg.add_argument('--case', type=str, default="10", help='case name, or "all" to train Case1-Case10 in one process')
     arg.add_argument('--train',action='store_true', help='Set this flag to train the model')
+    arg.add_argument('--memory-budget', type=int, default=None,
+                     help='Train in chunks that fit this many MiB of temporaries (default: full batch)')
+    arg.add_argument('--solver', type=str, default='adam', choices=['adam', 'varpro'],
+                     help='adam: fixed-step Adam on all parameters; varpro: least-squares A/B + L-BFGS on a/lx/ly')
+    arg.add_argument('--patience', type=int, default=None,
+                     help='Stop Adam training after this many steps without relative improvement of --min-delta')
+    arg.add_argument('--min-delta', type=float, default=1e-6, help='Relative loss improvement that resets --patience')
+    arg.add_argument('--save-every', type=int, default=None,
+                     help='Save a resumable training state to model/CaseN_train_state.pth every this many steps')
+    arg.add_argument('--resume', action='store_true', help='Resume from model/CaseN_train_state.pth if it exists')
+    arg.add_argument('--init-from', type=str, default=None,
+                     help='Warm-start parameters from model/CaseK_thermal_model.pth, e.g. --init-from 3')
+    arg.add_argument('--lr-milestones', type=int, nargs='*', default=[200],
+                     help='Adam steps at which the learning rate is multiplied by 0.1 (default: 200)')
     args = arg.parse_args()
     
-    case_name = f"Case{args.case}"
-    if args.train:
-        start = time.time()
-        train(case_name)
-        end = time.time()
-        print(f"Total training time: {end - start:.2f} seconds")
-    test(case_name)  # Uncomment to run the test function
\ No newline at end of file
+    if args.solver == 'varpro' and (args.patience is not None or args.save_every is not None or args.resume):
+        arg.error('--solver varpro stops on its own convergence test and does not support --patience, '
+                  '--save-every or --resume')
+    if args.case == 'all':
+        if args.save_every is not None or args.resume or args.init_from is not None:
+            arg.error('--case all does not support --save-every, --resume or --init-from')
+        case_names = [f"Case{idx}" for idx in range(1, 11)]
+        if args.train:
+            start = time.time()
+            memory_budget = args.memory_budget * 2**20 if args.memory_budget is not None else None
+            train_all(case_names, memory_budget, args.solver, args.patience, args.min_delta,
+                      milestones=args.lr_milestones)
+            end = time.time()
+            print(f"Total training time: {end - start:.2f} seconds")
+        for case_name in case_names:
+            test(case_name)
+    else:
+        case_name = f"Case{args.case}"
+        if args.train:
+            start = time.time()
+            memory_budget = args.memory_budget * 2**20 if args.memory_budget is not None else None
+            init_from = f"Case{args.init_from}" if args.init_from is not None else None
+            train(case_name, memory_budget, args.solver, args.patience, args.min_delta,
+                  args.save_every, args.resume, init_from, args.lr_milestones)
+            end = time.time()
+            print(f"Total training time: {end - start:.2f} seconds")
+        test(case_name)  # Uncomment to run the test function
\ No newline at end of file
@@ -5,25 +5,27 @@
 import typing
 import re
 from argparse import ArgumentParser
-from typing import Union, List
+from typing import Union, List, Optional
 
-from atplace.utils.uscs_parser import word_split, blank_line
-from atplace.utils.uscs_parser import Modules, Headers
+from utils.uscs_parser import word_split, blank_line
+from utils.uscs_parser import Headers
+from utils.chiplet_table import ChipletTable
 
+# hardrectilinear 的一个顶点 "(x, y)"
+_POINT = re.compile(r"\(\s*([^,()\s]+)\s*,\s*([^,()\s]+)\s*\)")
 
-def parse_terminals(lines: list[str], i: int, modules: Modules):
+
+def parse_terminals(lines: list[str], i: int, table: ChipletTable):
     if blank_line(lines[i]):
         return True
     words = word_split(lines[i])
     if len(words) == 2 and words[1] == "terminal":
-        modules[words[0]] = {
-            'terminal': True
-        }
+        table.set(table.intern(words[0]), terminal=True)
         return True
     return False
 
 
-def parse_rectangles(lines: list[str], i: int, modules: Modules) -> bool:
+def parse_rectangles(lines: list[str], i: int, table: ChipletTable) -> bool:
     if blank_line(lines[i]):
         return True
     words = word_split(lines[i])
@@ -33,46 +35,19 @@ def parse_rectangles(lines: list[str], i: int, modules: Modules) -> bool:
         low, high = float(words[3]), float(words[4])
         if low > high:
             low, high = high, low
-        modules[words[0]] = {
-            'area': float(words[2]),
-            'aspect_ratio': [low, high]
-        }
+        table.set(table.intern(words[0]), area=float(words[2]), aspect_ratio=(low, high))
         return True
-    elif len(words) == 11 and words[1] == "hard" + "rectilinear":
+    elif len(words) >= 3 and words[1] == "hard" + "rectilinear":
         num_vertices = int(words[2])
-        joint_string = ""
-        for i in range(3, len(words)):
-            joint_string += " " + words[i]
-        vertices = []
-        index = 0
-        for i in range(0, num_vertices):
-            while index < len(joint_string) and joint_string[index] != '(':
-                index += 1
-            index += 1
-            point_string = ""
-            while index < len(joint_string) and joint_string[index] != ')':
-                point_string += joint_string[index]
-                index += 1
-            if index >= len(joint_string) or joint_string[index] != ')':
-                raise Exception("Runaway argument at line " + str(i), lines)
-            point_split = point_string.split(",")
-            if len(point_split) != 2:
-                raise Exception("Point on line " + str(i) + " has the wrong number of dimensions")
-            x, y = float(point_split[0]), float(point_split[1])
-            vertices.append((x, y))
-        if len(vertices) != 4:
-            raise Exception("Shape not tolerated on line " + str(i) + ": Only quads allowed")
+        points = _POINT.findall(lines[i])
+        if len(points) != num_vertices:
+            raise Exception("Line " + str(i+1) + " has " + str(len(points)) + " (x, y) points, expected " +
+                            str(num_vertices))
+        if num_vertices != 4:
+            raise Exception("Shape not tolerated on line " + str(i+1) + ": Only quads allowed")
         # TODO: Check whether the input shape is actually an *orthogonal* quad
-        min_x = min(vertices[0][0], vertices[1][0], vertices[2][0], vertices[3][0])
-        max_x = max(vertices[0][0], vertices[1][0], vertices[2][0], vertices[3][0])
-        min_y = min(vertices[0][1], vertices[1][1], vertices[2][1], vertices[3][1])
-        max_y = max(vertices[0][1], vertices[1][1], vertices[2][1], vertices[3][1])
-        center = ((min_x + max_x) / 2, (min_y + max_y) / 2)
-        dims = (max_x - min_x, max_y - min_y)
-        modules[words[0]] = {
-            'rectangles': [[center[0], center[1], dims[0], dims[1]]],
-            'fixed': True
-        }
+        # bbox 和面积在整个文件读完后由 table.update_shapes() 一次算出
+        table.set(table.intern(words[0], [(float(x), float(y)) for x, y in points]), fixed=True)
         return True
     else:
         return False
@@ -103,18 +78,26 @@ def parse_header(lines: list[str], i: int, headers: Headers):
     return True
 
 
-def parse_blocks(options):
-    modules: Modules = {}
+def load_blocks_table(file_path: str, table: Optional[ChipletTable] = None) -> tuple[ChipletTable, Headers]:
+    """
+    把 .blocks 文件直接解析进 ChipletTable (不给出 table 时新建一个), 返回 (table, headers)
+    softrectangular 填 area / aspect_ratio; hardrectilinear 填 vertices / bbox / area 并标记 fixed; terminal 标记 terminal
+    """
+    table = ChipletTable() if table is None else table
     headers: Headers = {}
-    file_path = options['filename_blocks']
-    f = open(file_path, "r")
-    raw_text = f.read()
-    lines = re.split('\n', raw_text)
+    with open(file_path, "r") as f:
+        lines = re.split('\n', f.read())
     i = 0
     while i < len(lines) and parse_header(lines, i, headers):
         i += 1
-    while i < len(lines) and parse_rectangles(lines, i, modules):
+    while i < len(lines) and parse_rectangles(lines, i, table):
         i += 1
-    while i < len(lines) and parse_terminals(lines, i, modules):
+    while i < len(lines) and parse_terminals(lines, i, table):
         i += 1
-    return {'Modules': modules}, {'Headers': headers}
+    table.update_shapes()
+    return table, headers
+
+
+def parse_blocks(options):
+    table, headers = load_blocks_table(options['filename_blocks'])
+    return {'Modules': table.modules()}, {'Headers': headers}
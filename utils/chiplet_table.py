@@ -0,0 +1,174 @@
+"""
+列式 chiplet 表: 名字驻留为整数 id, 每一列是一个连续的 NumPy 数组, .blocks / .pl 解析器直接填表
+
+列 (n 为 chiplet 数, 未知的值为 NaN):
+    area           (n,)   面积
+    aspect_ratio   (n, 2) softrectangular 的宽高比上下界
+    bbox           (n, 4) 外形的包围盒 (center_x, center_y, width, height), 坐标是 .blocks 中顶点所在的坐标系
+    placement      (n, 4) .pl 给出的摆放 (center_x, center_y, width, height), 只有中心坐标的 .pl 宽高为 NaN
+    fixed          (n,)   bool
+    terminal       (n,)   bool
+    vertices       (V, 2) 所有 chiplet 的顶点, 第 i 个 chiplet 为 vertices[vertex_offsets[i]:vertex_offsets[i+1]]
+列按容量倍增增长, 追加一行均摊 O(1); 列属性返回前 n 行的视图, 表再增长后旧的视图不再跟随
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.uscs_parser import Modules
+
+# 列名: (dtype, 每行的形状, 默认值), 与 ChipletTable 的属性同名
+_COLUMNS = {
+    'area': (np.float64, (), np.nan),
+    'aspect_ratio': (np.float64, (2,), np.nan),
+    'bbox': (np.float64, (4,), np.nan),
+    'placement': (np.float64, (4,), np.nan),
+    'fixed': (np.bool_, (), False),
+    'terminal': (np.bool_, (), False),
+}
+
+
+def _grow(array: np.ndarray, capacity: int, fill) -> np.ndarray:
+    grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ChipletTable():
+    """一组 chiplet 的列式表, 行号即 chiplet id (按首次出现的顺序)"""
+    def __init__(self, capacity: int = 16):
+        self.names: List[str] = []
+        self.index: Dict[str, int] = {}
+        self._columns = {name: np.full((capacity,) + shape, fill, dtype=dtype)
+                         for name, (dtype, shape, fill) in _COLUMNS.items()}
+        self._vertices = np.empty((4 * capacity, 2), dtype=np.float64)
+        self._vertex_offsets = np.zeros(capacity + 1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def area(self) -> np.ndarray:
+        return self._columns['area'][:len(self.names)]
+
+    @property
+    def aspect_ratio(self) -> np.ndarray:
+        return self._columns['aspect_ratio'][:len(self.names)]
+
+    @property
+    def bbox(self) -> np.ndarray:
+        return self._columns['bbox'][:len(self.names)]
+
+    @property
+    def placement(self) -> np.ndarray:
+        return self._columns['placement'][:len(self.names)]
+
+    @property
+    def fixed(self) -> np.ndarray:
+        return self._columns['fixed'][:len(self.names)]
+
+    @property
+    def terminal(self) -> np.ndarray:
+        return self._columns['terminal'][:len(self.names)]
+
+    @property
+    def vertex_offsets(self) -> np.ndarray:
+        """(n+1,) int64"""
+        return self._vertex_offsets[:len(self.names) + 1]
+
+    @property
+    def vertices(self) -> np.ndarray:
+        """(V, 2) float64"""
+        return self._vertices[:self._vertex_offsets[len(self.names)]]
+
+    def vertices_of(self, chiplet: int) -> np.ndarray:
+        return self._vertices[self._vertex_offsets[chiplet]:self._vertex_offsets[chiplet + 1]]
+
+    def intern(self, name: str, vertices: Optional[np.ndarray] = None) -> int:
+        """
+        chiplet 名字对应的 id, 不存在时追加一行 (各列为默认值)
+        vertices: 新行的顶点 (k, 2); 顶点只能在追加行时给出, 这样所有顶点按行连续存放
+        """
+        chiplet = self.index.get(name)
+        if chiplet is not None:
+            if vertices is not None:
+                raise ValueError(f"chiplet {name} already exists, its vertices cannot be replaced")
+            return chiplet
+        chiplet = len(self.names)
+        capacity = len(self._vertex_offsets) - 1
+        if chiplet == capacity:
+            for column, (_, _, fill) in _COLUMNS.items():
+                self._columns[column] = _grow(self._columns[column], 2 * capacity, fill)
+            self._vertex_offsets = _grow(self._vertex_offsets, 2 * capacity + 1, 0)
+        start = self._vertex_offsets[chiplet]
+        end = start + (0 if vertices is None else len(vertices))
+        if end > len(self._vertices):
+            self._vertices = _grow(self._vertices, max(2 * len(self._vertices), end), 0.0)
+        if vertices is not None:
+            self._vertices[start:end] = vertices
+        self._vertex_offsets[chiplet + 1] = end
+        self.names.append(name)
+        self.index[name] = chiplet
+        return chiplet
+
+    def set(self, chiplet: int, **values):
+        """设置一行的若干列, 如 table.set(i, area=1.0, fixed=True)"""
+        for column, value in values.items():
+            self._columns[column][chiplet] = value
+
+    def update_shapes(self):
+        """由顶点重新计算所有有顶点的 chiplet 的 bbox 和面积 (鞋带公式), 一次向量化完成"""
+        offsets = self.vertex_offsets
+        rows = np.flatnonzero(np.diff(offsets) > 0)
+        if len(rows) == 0:
+            return
+        vertices, starts = self.vertices, offsets[rows]
+        low = np.minimum.reduceat(vertices, starts)
+        high = np.maximum.reduceat(vertices, starts)
+        # 每个顶点与同一 chiplet 的下一个顶点 (最后一个接回第一个) 的叉积
+        counts = np.diff(offsets)[rows]
+        following = np.arange(len(vertices)) + 1
+        following[starts + counts - 1] = starts
+        x, y = vertices[:, 0], vertices[:, 1]
+        cross = x * y[following] - y * x[following]
+        self._columns['area'][rows] = np.abs(np.add.reduceat(cross, starts)) / 2
+        self._columns['bbox'][rows] = np.concatenate([(low + high) / 2, high - low], axis=1)
+
+    def to_numpy(self) -> Dict[str, np.ndarray]:
+        """所有列 (前 n 行的视图) 以及 vertices / vertex_offsets"""
+        columns = {name: array[:len(self.names)] for name, array in self._columns.items()}
+        columns['vertices'] = self.vertices
+        columns['vertex_offsets'] = self.vertex_offsets
+        return columns
+
+    def to_torch(self, device=None) -> Dict[str, "torch.Tensor"]:
+        """
+        与 to_numpy 相同的列, 以 torch.from_numpy 包装, 与表共享内存 (不复制);
+        给出 device 时再拷贝到该设备 (CPU 上仍不复制); torch 只在这里导入, 解析器本身只依赖 NumPy
+        """
+        import torch
+        tensors = {name: torch.from_numpy(array) for name, array in self.to_numpy().items()}
+        return tensors if device is None else {name: t.to(device) for name, t in tensors.items()}
+
+    def modules(self) -> Modules:
+        """转换为原来的 Modules 字典 (每个 chiplet 一个 dict), 只含表中已知的字段"""
+        modules: Modules = {}
+        aspect_known = ~np.isnan(self.aspect_ratio[:, 0])
+        has_vertices = np.diff(self.vertex_offsets) > 0
+        placed = ~np.isnan(self.placement[:, 0])
+        for i, name in enumerate(self.names):
+            module = {}
+            if aspect_known[i]:
+                module['area'] = float(self.area[i])
+                module['aspect_ratio'] = self.aspect_ratio[i].tolist()
+            if has_vertices[i]:
+                module['rectangles'] = [self.bbox[i].tolist()]
+            if self.fixed[i]:
+                module['fixed'] = True
+            if self.terminal[i]:
+                module['terminal'] = True
+            if placed[i]:
+                module['center'] = self.placement[i, :2].tolist()
+            modules[name] = module
+        return modules
@@ -1,4 +1,5 @@
 import os,math,sys
+from bisect import bisect_left, insort
 from operator import itemgetter, attrgetter
 # with open('path.txt','r') as PATHFILE:
 # 	path = PATHFILE.readline().split()[0]
@@ -15,7 +16,123 @@ class FlpItem:
     def __repr__(self):
         return repr((self.name, self.width, self.height, self.x, self.y))
 
-def fill_space(width_st, width_ed, height_st, height_ed, filesim, filein, fileout, UnderFill):
+def fill_whitespace(flplist, width_st, width_ed, height_st, height_ed, tol=0.00001):
+    """
+    用矩形空白块 WS_0, WS_1, ... 填满区域 [width_st, width_ed] x [height_st, height_ed] 中
+    没有被 flplist (FlpItem 列表) 覆盖的部分, 返回空白块的 FlpItem 列表
+
+    沿 y 和沿 x 各做一次扫描线分解 (sweep_whitespace), 取块数较少的结果
+    """
+    by_rows = sweep_whitespace(flplist, width_st, width_ed, height_st, height_ed, tol)
+    transposed = [FlpItem(i.name, i.height, i.width, i.y, i.x) for i in flplist]
+    by_cols = [FlpItem(i.name, i.height, i.width, i.y, i.x)
+               for i in sweep_whitespace(transposed, height_st, height_ed, width_st, width_ed, tol)]
+    return by_rows if len(by_rows) <= len(by_cols) else by_cols
+
+def _snap(values, tol, fixed):
+    """
+    把相差小于 tol 的坐标合并为同一个, 返回 (排序后的代表值, {原坐标: 代表值下标})
+    fixed 中的坐标 (区域边界) 优先作为代表值
+    """
+    values = sorted(set(values))
+    groups = []
+    for v in values:
+        if groups and v - groups[-1][0] < tol:
+            groups[-1].append(v)
+        else:
+            groups.append([v])
+    coords, index = [], {}
+    for k, group in enumerate(groups):
+        pinned = [v for v in group if v in fixed]
+        coords.append(pinned[0] if pinned else group[0])
+        for v in group:
+            index[v] = k
+    return coords, index
+
+def sweep_whitespace(flplist, width_st, width_ed, height_st, height_ed, tol=0.00001):
+    """
+    扫描线空白分解: 自下而上扫过所有 chiplet 的上下边, 按左端有序维护当前与扫描线相交的 chiplet,
+    相邻两个 chiplet (或区域边界) 之间就是一个空白区间; 插入/删除一个 chiplet 只影响它两侧的空白区间。
+    有序 list 上用二分查找定位是 O(log n), 但 insort/pop 要移动其后的元素, 最坏 O(n), 总计最坏 O(n²);
+    这部分只是 C 层的内存移动, 实测到上万个 chiplet 仍比树状数组等 O(log n) 的纯 Python 结构快。
+    区间不变的空白块继续向上延伸, 变化时关闭旧块、打开新块,
+    所以输出的空白块在 x 方向都是极大的。
+    坐标先按 tol 合并 (与递归版本一样忽略比 tol 更细的缝隙), chiplet 先裁剪到区域内; chiplet 之间不能重叠
+    """
+    rects = []
+    for i in flplist:
+        x0, x1 = max(i.x, width_st), min(i.x + i.width, width_ed)
+        y0, y1 = max(i.y, height_st), min(i.y + i.height, height_ed)
+        if x1 - x0 >= tol and y1 - y0 >= tol:
+            rects.append((i.name, x0, x1, y0, y1))
+    xs, x_index = _snap([width_st, width_ed] + [v for r in rects for v in r[1:3]], tol, {width_st, width_ed})
+    ys, y_index = _snap([height_st, height_ed] + [v for r in rects for v in r[3:]], tol, {height_st, height_ed})
+    x_lo, x_hi = x_index[width_st], x_index[width_ed]
+    y_lo, y_hi = y_index[height_st], y_index[height_ed]
+
+    events = {}  # y 下标 -> ([结束的 chiplet], [开始的 chiplet]), chiplet 为 (名字, x0, x1) 下标
+    for name, x0, x1, y0, y1 in rects:
+        x0, x1, y0, y1 = x_index[x0], x_index[x1], y_index[y0], y_index[y1]
+        if x0 < x1 and y0 < y1:
+            events.setdefault(y0, ([], []))[1].append((name, x0, x1))
+            events.setdefault(y1, ([], []))[0].append((name, x0, x1))
+
+    ws = []
+    active = []                       # 与扫描线相交的 chiplet 的左端, 有序
+    right_end = {}                    # 左端 -> 右端
+    open_gaps = {x_lo: (x_hi, y_lo)}  # 空白区间左端 -> (右端, 起始 y 下标)
+
+    def neighbours(x0):
+        p = bisect_left(active, x0)
+        left = right_end[active[p-1]] if p > 0 else x_lo
+        right = active[p] if p < len(active) else x_hi
+        return left, right
+
+    for y in sorted(events):
+        if y >= y_hi:
+            break
+        closed = {}  # 本事件关闭的区间; 同一事件内又被打开的区间保留原来的起始 y, 不切断空白块
+
+        def close(x0, x1):
+            if x0 < x1:
+                gap = open_gaps.pop(x0)
+                if gap[1] < y:  # 本事件内打开又关闭的区间高度为 0, 直接丢掉
+                    closed[x0] = gap
+
+        def reopen(x0, x1):
+            if x0 < x1:
+                if x0 in closed and closed[x0][0] == x1:
+                    open_gaps[x0] = closed.pop(x0)
+                else:
+                    open_gaps[x0] = (x1, y)
+
+        ended, started = events[y]
+        for name, x0, x1 in ended:
+            active.pop(bisect_left(active, x0))
+            del right_end[x0]
+            left, right = neighbours(x0)
+            close(left, x0)
+            close(x1, right)
+            reopen(left, right)
+        for name, x0, x1 in started:
+            left, right = neighbours(x0)
+            if left > x0 or right < x1:
+                raise ValueError(f"{name} overlaps another chiplet")
+            close(left, right)
+            reopen(left, x0)
+            reopen(x1, right)
+            insort(active, x0)
+            right_end[x0] = x1
+        for x0, (x1, y0) in closed.items():
+            ws.append(FlpItem('WS_'+str(len(ws)), xs[x1] - xs[x0], ys[y] - ys[y0], xs[x0], ys[y0]))
+    for x0, (x1, y0) in open_gaps.items():
+        ws.append(FlpItem('WS_'+str(len(ws)), xs[x1] - xs[x0], ys[y_hi] - ys[y0], xs[x0], ys[y0]))
+    return ws
+
+def fill_whitespace_recursive(flplist, width_st, width_ed, height_st, height_ed):
+    """
+    原来的递归切分实现 (交替做竖直/水平的 guillotine 切分), 保留作对照, 见 benchmarks/bench_fill_space.py
+    """
     ws = []
     ws_n = 0
     sep_n = 16
@@ -133,27 +250,34 @@ def fill_space(width_st, width_ed, height_st, height_ed, filesim, filein, fileou
             print (i)
         print
 
-    # read original flp
+    cut_vertical(flplist, width_st,width_ed,height_st,height_ed)
+    return ws
+
+def flp_line(item, material):
+    """一个 FlpItem 在 .flp 文件中的一行; material 是以换行结尾的材料列 (比热容、热阻率), 没有材料时为换行符"""
+    return item.name+'\t'+str(item.width)+'\t'+str(item.height)+'\t'+str(item.x)+'\t'+str(item.y)+material
+
+def read_flp(filename):
+    """读取 .flp 文件中的所有单元"""
     flplist = []
-    with open(filesim+ '.flp','r') as FlpIn:
-        n=0
+    with open(filename,'r') as FlpIn:
         for line in FlpIn:
             sp = line.split()
-            # print sp
             if sp:
                 if sp[0] != '#':
                     flplist.append(FlpItem(sp[0], float(sp[1]), float(sp[2]), float(sp[3]), float(sp[4])))
-                    n += 1
-    cut_vertical(flplist, width_st,width_ed,height_st,height_ed)
+    return flplist
+
+def fill_space(width_st, width_ed, height_st, height_ed, filesim, filein, fileout, UnderFill):
+    """基于文件的接口: 按 filesim.flp 的单元计算空白块, 把 filein.flp 连同空白块写到 fileout.flp"""
+    ws = fill_whitespace(read_flp(filesim+ '.flp'), width_st, width_ed, height_st, height_ed)
 
     with open(fileout+'.flp','w') as FlpOut:
-        # for i in range(0,n):
-        # 	FlpOut.write(comp_name[i] + '\t' +str(comp_width[i])+'\t'+str(comp_height[i])+'\t'+str(comp_x[i])+'\t'+str(comp_y[i])+'\n')
         with open (filein+ '.flp','r') as FlpIn:
             for line in FlpIn:
                 FlpOut.write(line)
-        for i in range(0,ws_n):
-            FlpOut.write(ws[i].name+'\t'+str(ws[i].width)+'\t'+str(ws[i].height)+'\t'+str(ws[i].x)+'\t'+str(ws[i].y)+UnderFill)
+        for item in ws:
+            FlpOut.write(flp_line(item, UnderFill))
 
 
 if __name__ == "__main__":
@@ -2,13 +2,17 @@
 # For the FRAME Project.
 # Licensed under the MIT License (see https://github.com/jordicf/FRAME/blob/master/LICENSE.txt).
 
+import hashlib
+import os
 import re
 import typing
-from typing import Union, List
+from typing import Union, List, NamedTuple, Optional
 from argparse import ArgumentParser
 
-from atplace.utils.uscs_parser import word_split, blank_line
-from atplace.utils.uscs_parser import Net, Nets, Headers
+import numpy as np
+
+from utils.uscs_parser import word_split, blank_line
+from utils.uscs_parser import Net, Nets, Headers
 
 
 def parse_header(lines: list[str], i: int, headers: Headers):
@@ -79,3 +83,104 @@ def parse_nets(options):
         if not cont:
             break
     return {'Nets': nets}, {'Headers': headers}
+
+
+# 一次匹配整个文件: NetDegree 行给出 group 1, 引脚行 "名字 方向 : %x %y" 给出 group 2~4
+_NETS_LINE = re.compile(r"^[ \t]*(?:NetDegree[ \t]*:[ \t]*(\d+)|(\S+)[ \t]+[IOB][ \t]*:[ \t]*"
+                        r"%([-+.\deE]+)[ \t]+%([-+.\deE]+))", re.M)
+_NETS_HEADER = re.compile(r"^[ \t]*(NumNets|NumPins)[ \t]*:[ \t]*(\d+)", re.M)
+CACHE_DIR = "cache"
+
+
+class NetsCSR(NamedTuple):
+    """
+    压缩行 (CSR) 形式的线网: 第 k 个线网的引脚为 net_offsets[k]:net_offsets[k+1]
+    pin_dx / pin_dy 为引脚相对 chiplet 中心的偏移, 单位为 chiplet 宽/高的百分比 (.nets 中的 %x %y)
+    """
+    names: List[str]           # chiplet 名字, pin_chiplet 的下标
+    net_offsets: np.ndarray    # (M+1,) int64
+    pin_chiplet: np.ndarray    # (P,) int64
+    pin_dx: np.ndarray         # (P,) float64
+    pin_dy: np.ndarray         # (P,) float64
+
+    @property
+    def num_nets(self) -> int:
+        return len(self.net_offsets) - 1
+
+    def pin_net(self) -> np.ndarray:
+        """每个引脚所属线网的下标, (P,) int64"""
+        return np.repeat(np.arange(self.num_nets), np.diff(self.net_offsets))
+
+
+def parse_nets_csr(file_path: str) -> NetsCSR:
+    """
+    用一次正则扫描解析整个 .nets 文件, 名字编号、数值转换和线网划分都按列在 NumPy 中完成
+    chiplet 按在文件中首次出现的顺序编号; 引脚行必须带 %x %y 偏移, 每个线网的引脚数必须与 NetDegree 一致
+    """
+    with open(file_path, "r") as f:
+        text = f.read()
+    # 每个匹配一行: (NetDegree, 名字, x, y), NetDegree 行的后三列和引脚行的第一列为空串;
+    # 按列拼接后由 NumPy 一次解析数值, 空串只多出空白, 不产生元素
+    degree_col, name_col, dx_col, dy_col = list(zip(*_NETS_LINE.findall(text))) or ((), (), (), ())
+    is_net = np.array(degree_col, dtype=str) != ''
+    degrees = np.fromstring(' '.join(degree_col), dtype=np.int64, sep=' ')
+    pin_dx = np.fromstring(' '.join(dx_col), dtype=np.float64, sep=' ')
+    pin_dy = np.fromstring(' '.join(dy_col), dtype=np.float64, sep=' ')
+    names, first, inverse = np.unique(np.array(name_col, dtype=str)[~is_net], return_index=True,
+                                      return_inverse=True)
+    # np.unique 按字典序编号, 换成按首次出现的顺序
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    pin_chiplet = rank[inverse.reshape(-1)]
+    # 每个引脚属于它之前最近的 NetDegree 行
+    pin_net = np.cumsum(is_net)[~is_net] - 1
+    if len(pin_net) and pin_net[0] < 0:
+        raise ValueError(f"{file_path}: pin before the first NetDegree line")
+    if not np.array_equal(np.bincount(pin_net, minlength=len(degrees)), degrees):
+        raise ValueError(f"{file_path}: pin count differs from NetDegree (pins need %x %y offsets)")
+    # 表头只在第一个 NetDegree 之前
+    header_end = text.find('NetDegree')
+    headers = {name: int(value) for name, value in
+               _NETS_HEADER.findall(text, 0, len(text) if header_end < 0 else header_end)}
+    if headers.get('NumNets', len(degrees)) != len(degrees) or headers.get('NumPins', len(pin_net)) != len(pin_net):
+        raise ValueError(f"{file_path}: NumNets/NumPins do not match the nets in the file")
+    return NetsCSR(names[order].tolist(), np.concatenate([[0], np.cumsum(degrees)]).astype(np.int64), pin_chiplet, pin_dx, pin_dy)
+
+
+def load_nets_csr(file_path: str, names: Optional[List[str]] = None, cache_dir: Optional[str] = CACHE_DIR) -> NetsCSR:
+    """
+    读取 .nets 文件的 CSR 形式, 优先使用 cache_dir 中的缓存 (比 .nets 新时); cache_dir 为 None 时不使用缓存
+    缓存文件名带源文件绝对路径的哈希, 并在文件内记录该路径, 同名的不同文件不会共用缓存
+    names: 可选, chiplet 的编号顺序 (如 CaseLayouts.names), pin_chiplet 按它重新编号;
+        缓存中始终是文件本身的编号, 重新编号在读取后进行, 因此不同的 names 可以共用一份缓存
+    """
+    nets = None
+    source = os.path.abspath(file_path)
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha256(source.encode()).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(file_path)}.{digest}.npz")
+    if cache_path is not None and os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) >= os.path.getmtime(file_path):
+        with np.load(cache_path) as cached:
+            if "source" in cached and str(cached["source"]) == source:
+                nets = NetsCSR(cached["names"].tolist(), cached["net_offsets"], cached["pin_chiplet"],
+                               cached["pin_dx"], cached["pin_dy"])
+    if nets is None:
+        nets = parse_nets_csr(file_path)
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再替换, 中途中断不会留下不完整的缓存
+            np.savez(cache_path + ".tmp.npz", source=np.array(source), names=np.array(nets.names),
+                     net_offsets=nets.net_offsets, pin_chiplet=nets.pin_chiplet, pin_dx=nets.pin_dx,
+                     pin_dy=nets.pin_dy)
+            os.replace(cache_path + ".tmp.npz", cache_path)
+    if names is None or list(names) == nets.names:
+        return nets
+    index = {name: i for i, name in enumerate(names)}
+    unknown = [name for name in nets.names if name not in index]
+    if unknown:
+        raise ValueError(f"{file_path}: chiplets {unknown} are not in names")
+    remap = np.array([index[name] for name in nets.names], dtype=np.int64)
+    return nets._replace(names=list(names), pin_chiplet=remap[nets.pin_chiplet])
@@ -4,33 +4,44 @@
 
 import re
 import typing
-from typing import Union, List
+from typing import Union, List, Optional
 from argparse import ArgumentParser
 
-from atplace.utils.uscs_parser import word_split, blank_line
-from atplace.utils.uscs_parser import Modules
+import numpy as np
 
+from utils.uscs_parser import word_split, blank_line
+from utils.chiplet_table import ChipletTable
 
-def parse_pl(lines: list[str], i: int, modules: Modules) -> bool:
+
+def parse_pl(lines: list[str], i: int, table: ChipletTable) -> bool:
+    """
+    一行 "名字 x y" (中心坐标) 或 "名字 x y 宽 高" (左下角坐标, 即 CaseK_{id}.pl 的格式)
+    placement 一律存中心坐标和宽高
+    """
     if blank_line(lines[i]):
         return True
-    words = word_split(lines[i])
-    if len(words) != 3:
+    words = word_split(lines[i].strip())
+    if len(words) == 3:
+        placement = (float(words[1]), float(words[2]), np.nan, np.nan)
+    elif len(words) == 5:
+        x, y, w, h = float(words[1]), float(words[2]), float(words[3]), float(words[4])
+        placement = (x + w/2, y + h/2, w, h)
+    else:
         raise Exception("Don't know how to parse line (" + str(i + 1) + "): " + lines[i])
-    modules[words[0]] = {
-        'fixed': True,
-        'terminal': True,
-        'center': [float(words[1]), float(words[2])]
-    }
+    table.set(table.intern(words[0]), fixed=True, terminal=True, placement=placement)
     return True
 
-def parse_pls(options):
-    file_path = options['filename_pl']
-    modules: Modules = {}
-    f = open(file_path, "r")
-    raw_text = f.read()
-    lines = re.split('\n', raw_text)
+
+def load_pl_table(file_path: str, table: Optional[ChipletTable] = None) -> ChipletTable:
+    """把 .pl 文件直接解析进 ChipletTable (不给出 table 时新建一个); 已有的行只更新 placement 和 fixed/terminal"""
+    table = ChipletTable() if table is None else table
+    with open(file_path, "r") as f:
+        lines = re.split('\n', f.read())
     i = 0
-    while i < len(lines) and parse_pl(lines, i, modules):
+    while i < len(lines) and parse_pl(lines, i, table):
         i += 1
-    return {'Modules': modules}
+    return table
+
+
+def parse_pls(options):
+    return {'Modules': load_pl_table(options['filename_pl']).modules()}
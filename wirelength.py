@@ -0,0 +1,183 @@
+"""
+线长: 在 .nets 的 CSR 引脚数组 (utils.nets_parser.load_nets_csr) 上批量计算 K 个候选布局的半周长线长 (HPWL)
+
+输入与 ChipletThermalModel 相同: chiplet 中心坐标和宽高, 每个 shape (K, N), 单位 mm (见 layout_inputs),
+引脚坐标 = chiplet 中心 + .nets 中的 %x / 100 * 宽, %y / 100 * 高。
+smooth() 是可求梯度的光滑近似 (WA 或 LSE), 可以和温度一起对 chiplet 坐标求导;
+IncrementalHPWL 在每次只移动一个 chiplet 时只重算与它相连的线网
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+from layout_cache import load_case_layouts
+from utils.nets_parser import NetsCSR, load_nets_csr
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _scatter(values, index, size, reduce):
+    """按线网归约 (K, P) -> (K, size); 没有引脚的线网为 0"""
+    out = values.new_zeros(values.shape[0], size)
+    return out.scatter_reduce(1, index.expand(values.shape), values, reduce, include_self=False)
+
+
+def _net_sum(values, index, size):
+    return values.new_zeros(values.shape[0], size).index_add(1, index, values)
+
+
+def _span(values, index, size):
+    return _scatter(values, index, size, 'amax') - _scatter(values, index, size, 'amin')
+
+
+def _smooth_span(values, index, size, gamma, method):
+    """
+    光滑的 max - min: WA 为以 exp(±x/γ) 加权的平均坐标之差, LSE 为 γ·log Σexp(x/γ) + γ·log Σexp(-x/γ)
+    指数先减去 (不求导的) 线网最大/最小值, 避免溢出, 结果不变; γ → 0 时都趋于 HPWL, WA 从下方, LSE 从上方逼近
+    """
+    hi = _scatter(values.detach(), index, size, 'amax')
+    lo = _scatter(values.detach(), index, size, 'amin')
+    e_hi = torch.exp((values - hi[:, index]) / gamma)
+    e_lo = torch.exp((lo[:, index] - values) / gamma)
+    # 每个非空线网的指数和至少为 1 (最大/最小的引脚本身), 空线网置 1 使其贡献为 0
+    s_hi, s_lo = _net_sum(e_hi, index, size), _net_sum(e_lo, index, size)
+    s_hi, s_lo = s_hi.masked_fill(s_hi == 0, 1), s_lo.masked_fill(s_lo == 0, 1)
+    if method == 'wa':
+        return _net_sum(values * e_hi, index, size) / s_hi - _net_sum(values * e_lo, index, size) / s_lo
+    if method == 'lse':
+        return hi - lo + gamma * (torch.log(s_hi) + torch.log(s_lo))
+    raise ValueError(f"unknown smooth wirelength {method!r}, expected 'wa' or 'lse'")
+
+
+class Wirelength():
+    '''一个 case 的线网; 引脚数组常驻 device, chiplet 编号与 nets.names 一致'''
+    def __init__(self, nets: NetsCSR, device=device, dtype=torch.float32):
+        self.nets = nets
+        self.num_nets = nets.num_nets
+        self.device = device
+        self._pin_net = nets.pin_net()
+        self.pin_net = torch.as_tensor(self._pin_net, device=device)
+        self.pin_chiplet = torch.as_tensor(nets.pin_chiplet, device=device)
+        self.pin_dx = torch.as_tensor(nets.pin_dx / 100, dtype=dtype, device=device)
+        self.pin_dy = torch.as_tensor(nets.pin_dy / 100, dtype=dtype, device=device)
+        self._chiplet_nets = {}
+
+    @classmethod
+    def from_case(cls, case_name, names, cases_dir="cases", **kwargs):
+        '''读取 cases/{case_name}/{case_name}.nets, chiplet 按 names (如 CaseLayouts.names) 编号'''
+        return cls(load_nets_csr(os.path.join(cases_dir, case_name, f"{case_name}.nets"), names), **kwargs)
+
+    def pins(self, chiplets_x, chiplets_y, chiplets_width, chiplets_height, pins=None):
+        '''
+        引脚坐标 (px, py), 每个 shape (K, P)
+        pins: 可选, 只计算这些引脚 (下标张量)
+        '''
+        chip = self.pin_chiplet if pins is None else self.pin_chiplet[pins]
+        dx = self.pin_dx if pins is None else self.pin_dx[pins]
+        dy = self.pin_dy if pins is None else self.pin_dy[pins]
+        return (chiplets_x[:, chip] + dx * chiplets_width[:, chip],
+                chiplets_y[:, chip] + dy * chiplets_height[:, chip])
+
+    def hpwl(self, chiplets_x, chiplets_y, chiplets_width, chiplets_height, per_net=False):
+        '''
+        chiplets_*: shape (K, N), mm
+        返回每个布局的总 HPWL shape (K,); per_net 为 True 时返回每个线网的 HPWL shape (K, M)
+        '''
+        px, py = self.pins(chiplets_x, chiplets_y, chiplets_width, chiplets_height)
+        length = _span(px, self.pin_net, self.num_nets) + _span(py, self.pin_net, self.num_nets)
+        return length if per_net else length.sum(dim=1)
+
+    def smooth(self, chiplets_x, chiplets_y, chiplets_width, chiplets_height, gamma=0.1, method='wa'):
+        '''
+        HPWL 的光滑近似, 对 chiplet 坐标和尺寸可求梯度, 返回 shape (K,)
+        gamma: 光滑程度 (mm), 越小越接近 HPWL, 梯度也越集中在每个线网两端的引脚上
+        method: 'wa' (加权平均) 或 'lse' (log-sum-exp)
+        '''
+        px, py = self.pins(chiplets_x, chiplets_y, chiplets_width, chiplets_height)
+        return (_smooth_span(px, self.pin_net, self.num_nets, gamma, method) +
+                _smooth_span(py, self.pin_net, self.num_nets, gamma, method)).sum(dim=1)
+
+    def chiplet_nets(self, chiplet):
+        '''
+        与 chiplet 相连的线网 (M_c,), 这些线网的全部引脚 (P_c,), 以及每个引脚在 M_c 个线网中的局部编号 (P_c,)
+        第一次用到时由 CSR 数组算出并缓存
+        '''
+        if chiplet not in self._chiplet_nets:
+            offsets = self.nets.net_offsets
+            nets = np.unique(self._pin_net[self.nets.pin_chiplet == chiplet])
+            degree = offsets[nets + 1] - offsets[nets]
+            start = np.repeat(offsets[nets], degree)
+            local = np.repeat(np.arange(len(nets)), degree)
+            pins = start + np.arange(degree.sum()) - np.repeat(np.cumsum(degree) - degree, degree)
+            self._chiplet_nets[chiplet] = tuple(torch.as_tensor(a, device=self.device) for a in (nets, pins, local))
+        return self._chiplet_nets[chiplet]
+
+
+class IncrementalHPWL():
+    '''
+    K 个布局的 HPWL, 每次只移动一个 chiplet 时增量更新: 只重算与它相连的线网
+    坐标在构造时复制一份, 之后只通过 move() 修改; 总线长以 float64 累加, 多次移动后不漂移
+    '''
+    def __init__(self, wirelength: Wirelength, chiplets_x, chiplets_y, chiplets_width, chiplets_height):
+        self.wl = wirelength
+        self.x, self.y = chiplets_x.detach().clone(), chiplets_y.detach().clone()
+        self.width, self.height = chiplets_width.detach(), chiplets_height.detach()
+        self.net_length = wirelength.hpwl(self.x, self.y, self.width, self.height, per_net=True)
+        self.total = self.net_length.sum(dim=1, dtype=torch.float64)
+
+    def _moved(self, chiplet, new_x, new_y):
+        '''chiplet 移到 (new_x, new_y) 后与它相连的线网的 HPWL, shape (K, M_c)'''
+        nets, pins, local = self.wl.chiplet_nets(chiplet)
+        px, py = self.wl.pins(self.x, self.y, self.width, self.height, pins)
+        own = self.wl.pin_chiplet[pins] == chiplet
+        new_x = torch.as_tensor(new_x, dtype=px.dtype, device=px.device).reshape(-1, 1)
+        new_y = torch.as_tensor(new_y, dtype=py.dtype, device=py.device).reshape(-1, 1)
+        px = torch.where(own, new_x + self.wl.pin_dx[pins] * self.width[:, chiplet:chiplet+1], px)
+        py = torch.where(own, new_y + self.wl.pin_dy[pins] * self.height[:, chiplet:chiplet+1], py)
+        return nets, _span(px, local, len(nets)) + _span(py, local, len(nets))
+
+    def delta(self, chiplet, new_x, new_y):
+        '''把 chiplet 移到 (new_x, new_y) (标量或 shape (K,)) 后每个布局总 HPWL 的变化 (K,), 不修改状态'''
+        nets, length = self._moved(chiplet, new_x, new_y)
+        return (length - self.net_length[:, nets]).sum(dim=1, dtype=torch.float64)
+
+    def move(self, chiplet, new_x, new_y):
+        '''移动 chiplet 并更新, 返回每个布局新的总 HPWL (K,)'''
+        nets, length = self._moved(chiplet, new_x, new_y)
+        self.total += (length - self.net_length[:, nets]).sum(dim=1, dtype=torch.float64)
+        self.net_length[:, nets] = length
+        self.x[:, chiplet] = torch.as_tensor(new_x, dtype=self.x.dtype, device=self.x.device)
+        self.y[:, chiplet] = torch.as_tensor(new_y, dtype=self.y.dtype, device=self.y.device)
+        return self.total
+
+
+def case_chiplets(case, layout_ids, device=device):
+    '''布局的 chiplet 中心坐标和宽高 (x, y, width, height), 每个 shape (K, N), mm; 与 layout_inputs 不同, 坐标不取整'''
+    layouts = torch.tensor(case.layouts[case.rows(layout_ids)] / 1e3, dtype=torch.float32, device=device)
+    return layouts.unbind(dim=2)
+
+
+if __name__ == "__main__":
+    arg = argparse.ArgumentParser()
+    arg.add_argument('--case', type=str, default="1", help='case number')
+    arg.add_argument('--layouts', type=int, nargs='*', default=None, help='layout ids (default: all)')
+    arg.add_argument('--top', type=int, default=10, help='Print the N layouts with the shortest HPWL')
+    args = arg.parse_args()
+
+    case_name = f"Case{args.case}"
+    case = load_case_layouts(case_name)
+    layout_ids = case.layout_ids.tolist() if args.layouts is None else args.layouts
+    wirelength = Wirelength.from_case(case_name, case.names)
+    chiplets = case_chiplets(case, layout_ids)
+    start = time.time()
+    total = wirelength.hpwl(*chiplets).cpu().numpy()
+    elapsed = time.time() - start
+    print(f"{case_name}: {len(layout_ids)} layouts, {wirelength.num_nets} nets, {len(wirelength.pin_net)} pins, "
+          f"{elapsed * 1e3:.1f} ms")
+    print(f"HPWL (mm): mean {total.mean():.1f}, min {total.min():.1f}, max {total.max():.1f}")
+    for k in np.argsort(total)[:args.top]:
+        print(f"  {case_name}_{layout_ids[k]}: {total[k]:.1f}")